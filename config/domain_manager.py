@@ -1,39 +1,196 @@
 import json
+import os
+import tempfile
+import threading
 from pathlib import Path
 
+from dns.journal import (
+    ALLOWED_KEY,
+    BLOCKED_KEY,
+    OP_ADD,
+    OP_REMOVE,
+    append_entry,
+    journal_path,
+    read_entries,
+    replay,
+    rotated_path,
+)
+from dns.patterns import is_pattern, regex_rule
+
 BASE_DIR = Path(__file__).resolve().parent
 DOMAINS_FILE = BASE_DIR / "domains.json"
 
+# Regole regex (vedi dns.patterns): il maiuscolo è significativo (\W, \S...)
+REGEX_PREFIX = "re:"
+
+# Dimensione del journal oltre cui viene riversato in domains.json
+JOURNAL_COMPACT_BYTES = 256 * 1024
+
+# Una compattazione alla volta (le aggiunte al journal non aspettano)
+_compact_lock = threading.Lock()
+# Aggiunte al journal e sua rotazione: una riga scritta nel journal
+# appena ruotato (e poi cancellato) andrebbe persa
+_journal_lock = threading.Lock()
 
-def load_domains() -> list[str]:
-    if not DOMAINS_FILE.exists():
-        return []
 
+def _normalize(entry: str) -> str:
+    # Come dns.compiler: minuscolo, senza punto finale (regex invariate)
+    entry = entry.strip()
+    return entry if entry.startswith(REGEX_PREFIX) else entry.lower().rstrip(".")
+
+
+def _load_snapshot() -> dict:
+    if not DOMAINS_FILE.exists():
+        return {}
     with open(DOMAINS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+        return json.load(f)
+
+
+def _snapshot_rules(data: dict) -> dict[str, set[str]]:
+    return {key: set(_normalize(d) for d in data.get(key, [])) for key in (BLOCKED_KEY, ALLOWED_KEY)}
+
+
+def _load_rules(key: str) -> list[str]:
+    # Snapshot più le modifiche del journal, compreso quello ruotato
+    # da una compattazione interrotta
+    state = _snapshot_rules(_load_snapshot())
+    journal = journal_path(DOMAINS_FILE)
+    for path in (rotated_path(journal), journal):
+        replay(read_entries(path)[0], state)
+    return sorted(state[key])
+
+
+def _write_snapshot(data: dict):
+    # File temporaneo + fsync + os.replace: domains.json è sempre completo
+    fd, tmp = tempfile.mkstemp(dir=DOMAINS_FILE.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, DOMAINS_FILE)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def compact(overrides: dict[str, list[str]] | None = None):
+    """
+    Riversa il journal in domains.json: il journal viene prima ruotato
+    (le nuove modifiche finiscono in un journal nuovo), poi lo snapshot
+    riscritto e infine il journal ruotato cancellato. Un crash in
+    qualsiasi punto lascia uno stato da cui load_* ricostruisce le
+    stesse regole. `overrides` sostituisce per intero le liste indicate.
+    """
+    journal = journal_path(DOMAINS_FILE)
+    rotated = rotated_path(journal)
+    with _compact_lock:
+        with _journal_lock:
+            if not rotated.exists() and journal.exists():
+                os.replace(journal, rotated)
+        data = _load_snapshot()
+        state = _snapshot_rules(data)
+        replay(read_entries(rotated)[0], state)
+        for key, rules in (overrides or {}).items():
+            state[key] = set(_normalize(d) for d in rules)
+        for key, rules in state.items():
+            data[key] = sorted(rules)
+        if not data.get(ALLOWED_KEY):
+            data.pop(ALLOWED_KEY, None)
+        _write_snapshot(data)
+        if rotated.exists():
+            os.unlink(rotated)
+
 
-    return sorted(set(d.lower() for d in data.get("blocked_domains", [])))
+def _append(op: str, key: str, rule: str):
+    """
+    Una modifica = una riga aggiunta al journal (con fsync), invece di
+    riordinare e riscrivere tutto domains.json. Oltre la soglia il
+    journal viene compattato in background.
+    """
+    journal = journal_path(DOMAINS_FILE)
+    with _journal_lock:
+        append_entry(journal, op, key, rule)
+    try:
+        size = os.path.getsize(journal)
+    except OSError:
+        return
+    if size >= JOURNAL_COMPACT_BYTES:
+        _compact_in_background()
+
+
+def _compact_in_background():
+    if not _compact_lock.locked():
+        threading.Thread(target=_compact_worker, daemon=True).start()
+
+
+def _compact_worker():
+    try:
+        compact()
+    except Exception as e:
+        print(f"[JOURNAL] Compattazione fallita, riprovo alla prossima modifica: {e}")
+
+
+# =========================
+# DOMINI BLOCCATI
+# =========================
+
+def load_domains() -> list[str]:
+    return _load_rules(BLOCKED_KEY)
 
 
 def save_domains(domains: list[str]):
-    with open(DOMAINS_FILE, "w", encoding="utf-8") as f:
-        json.dump(
-            {"blocked_domains": sorted(set(domains))},
-            f,
-            indent=2
-        )
+    # Sostituisce l'intera lista: riscrive lo snapshot
+    compact({BLOCKED_KEY: domains})
+
+
+def add_domain(domain: str) -> str:
+    # Ritorna la regola normalizzata salvata ("" se vuota); ValueError
+    # per una regex re: che il resolver non potrebbe applicare
+    domain = _normalize(domain)
+    if domain.startswith(REGEX_PREFIX):
+        regex_rule(domain[len(REGEX_PREFIX):])
+    if domain:
+        _append(OP_ADD, BLOCKED_KEY, domain)
+    return domain
+
+
+def remove_domain(domain: str) -> str:
+    domain = _normalize(domain)
+    if not domain:
+        return domain
+    _append(OP_REMOVE, BLOCKED_KEY, domain)
+    if is_pattern(domain):
+        # Il resolver non può togliere una regola a pattern dall'indice
+        # compilato: si compatta subito, così viene ricompilato
+        _compact_in_background()
+    return domain
+
+
+# =========================
+# ECCEZIONI (ALLOWLIST)
+# =========================
+
+def load_allowed_domains() -> list[str]:
+    return _load_rules(ALLOWED_KEY)
+
 
+def save_allowed_domains(domains: list[str]):
+    compact({ALLOWED_KEY: domains})
 
-def add_domain(domain: str):
-    domains = load_domains()
-    domain = domain.lower().strip()
 
-    if domain and domain not in domains:
-        domains.append(domain)
-        save_domains(domains)
+def add_allowed_domain(domain: str) -> str:
+    # Le eccezioni sono solo domini: il resolver ignora quelle a pattern
+    domain = _normalize(domain)
+    if is_pattern(domain):
+        raise ValueError("le eccezioni non ammettono * o regex re:")
+    if domain:
+        _append(OP_ADD, ALLOWED_KEY, domain)
+    return domain
 
 
-def remove_domain(domain: str):
-    domains = load_domains()
-    domains = [d for d in domains if d != domain]
-    save_domains(domains)
+def remove_allowed_domain(domain: str) -> str:
+    domain = _normalize(domain)
+    if domain:
+        _append(OP_REMOVE, ALLOWED_KEY, domain)
+    return domain
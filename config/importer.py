@@ -0,0 +1,312 @@
+"""
+Importazione in blocco di liste esterne in config/lists/<nome>.txt,
+compilate da dns.compiler insieme a domains.json. Formati riconosciuti
+riga per riga (anche mescolati nello stesso file):
+- hosts:   0.0.0.0 ads.example.com [altri nomi ...]
+- domini:  ads.example.com (anche wildcard e regex re:, vedi dns.patterns)
+- adblock: ||ads.example.com^   @@||cdn.example.com^ (eccezione)
+
+Le righe sono lette in streaming e deduplicate con un ordinamento
+esterno a blocchi, quindi la memoria resta limitata anche con liste da
+milioni di righe. La lista di destinazione viene sostituita in modo
+atomico solo a importazione completata.
+
+Uso: python -m config.importer lista.txt [-n nome]
+"""
+import argparse
+import heapq
+import ipaddress
+import os
+import re
+import tempfile
+import time
+from collections.abc import Iterable, Iterator
+from itertools import groupby
+from pathlib import Path
+
+from dns.patterns import ALLOW_PREFIX, REGEX_PREFIX, is_pattern, regex_rule
+
+BASE_DIR = Path(__file__).resolve().parent
+LISTS_DIR = BASE_DIR / "lists"
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Regole distinte tenute in memoria prima di scriverle ordinate su disco
+IMPORT_CHUNK_SIZE = 200_000
+# Errori stampati (e restituiti) per importazione: gli altri solo contati
+MAX_REPORTED_ERRORS = 50
+
+# Nomi locali presenti in quasi tutti i file hosts: non vanno bloccati
+_HOSTS_IGNORED = frozenset({
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts", "0.0.0.0",
+})
+
+_LABEL = r"[a-z0-9_*][a-z0-9_*-]{0,62}"
+_DOMAIN = re.compile(rf"(?:{_LABEL}\.)*{_LABEL}")
+# Regole adblock non applicabili a un DNS: filtri cosmetici e scriptlet
+_COSMETIC_MARKERS = ("##", "#@#", "#?#", "#$#", "#%#")
+
+
+# =========================
+# PARSING RIGHE
+# =========================
+
+def normalize_domain(name: str) -> str:
+    """
+    Nome in forma canonica (minuscolo, senza punto finale, IDN in
+    punycode); ValueError se non è un nome di dominio valido.
+    Sono ammessi i caratteri jolly delle regole wildcard.
+    """
+    name = name.strip().rstrip(".").lower()
+    if not name.isascii():
+        try:
+            name = name.encode("idna").decode("ascii")
+        except UnicodeError:
+            raise ValueError(f"nome IDN non valido: {name}") from None
+    if not name or len(name) > 253:
+        raise ValueError(f"lunghezza del nome non valida: {name!r}")
+    if not _DOMAIN.fullmatch(name):
+        raise ValueError(f"nome di dominio non valido: {name}")
+    return name
+
+
+# I file hosts ripetono lo stesso indirizzo su ogni riga (0.0.0.0,
+# 127.0.0.1): ipaddress costa più del resto del parsing
+_ADDRESS_CACHE: dict[str, bool] = {}
+
+
+def _is_address(token: str) -> bool:
+    result = _ADDRESS_CACHE.get(token)
+    if result is None:
+        try:
+            ipaddress.ip_address(token.split("%", 1)[0])
+            result = True
+        except ValueError:
+            result = False
+        if len(_ADDRESS_CACHE) < 64:
+            _ADDRESS_CACHE[token] = result
+    return result
+
+
+def _parse_adblock(line: str) -> list[str] | None:
+    allow = line.startswith(ALLOW_PREFIX)
+    if allow:
+        line = line[len(ALLOW_PREFIX):]
+        if not any(c in line for c in "|/$^"):
+            # @@nome: formato delle liste scritte da questo modulo
+            line = f"||{line}^"
+    if not line.startswith("||"):
+        # |http://..., /regex/, regole su URL: non esprimibili come dominio
+        return None
+    body = line[2:]
+    if "^" in body:
+        body, rest = body.split("^", 1)
+        if rest not in ("", "|"):
+            # Opzioni ($third-party, ...) o percorsi: non applicabili a un DNS
+            return None
+    elif any(c in body for c in "/$|"):
+        return None
+    domain = normalize_domain(body)
+    if allow:
+        if is_pattern(domain):
+            raise ValueError(f"eccezione a pattern non supportata: {domain}")
+        return [ALLOW_PREFIX + domain]
+    return [domain]
+
+
+def parse_line(line: str) -> list[str] | None:
+    """
+    Regole contenute in una riga della lista, con le eccezioni
+    prefissate da @@ come nelle liste importate:
+    - [] per righe vuote, commenti e nomi locali dei file hosts
+    - None per regole adblock valide ma non applicabili a un DNS
+      (filtri cosmetici, opzioni, percorsi): vengono solo contate
+    - ValueError per righe non valide
+    """
+    line = line.strip()
+    if not line or line[0] in "#![":
+        return []
+    if line.startswith(REGEX_PREFIX):
+        regex_rule(line[len(REGEX_PREFIX):])
+        return [line]
+    if any(marker in line for marker in _COSMETIC_MARKERS):
+        return None
+    if line.startswith(("||", ALLOW_PREFIX, "|")):
+        return _parse_adblock(line)
+
+    tokens = line.split("#", 1)[0].split()
+    if not tokens:
+        return []
+    if not _is_address(tokens[0]):
+        if len(tokens) > 1:
+            raise ValueError("formato non riconosciuto")
+        return [normalize_domain(tokens[0])]
+
+    # Riga hosts: indirizzo seguito da uno o più nomi
+    if len(tokens) == 1:
+        raise ValueError("riga hosts senza nomi")
+    names = []
+    for name in tokens[1:]:
+        name = normalize_domain(name)
+        if name not in _HOSTS_IGNORED:
+            names.append(name)
+    return names
+
+
+def iter_rules(lines: Iterable[str], stats: dict, source: str = "") -> Iterator[str]:
+    """
+    Regole valide di una lista, riga per riga. Aggiorna `stats`
+    (righe, ignorate, errori) e ne conserva i primi errori con il
+    numero di riga.
+    """
+    for lineno, line in enumerate(lines, 1):
+        stats["lines"] = lineno
+        try:
+            rules = parse_line(line)
+        except ValueError as e:
+            stats["errors"] += 1
+            if len(stats["error_lines"]) < MAX_REPORTED_ERRORS:
+                stats["error_lines"].append((lineno, str(e)))
+                print(f"[IMPORT] {source}:{lineno}: {e}")
+            continue
+        if rules is None:
+            stats["ignored"] += 1
+            continue
+        yield from rules
+
+
+# =========================
+# ORDINAMENTO ESTERNO
+# =========================
+
+def _write_run(chunk: set, tmp_dir: str) -> str:
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".run")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for rule in sorted(chunk):
+            f.write(rule)
+            f.write("\n")
+    return path
+
+
+def sorted_unique(rules: Iterable[str], tmp_dir: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Regole ordinate e senza duplicati: blocchi di al massimo
+    `chunk_size` regole distinte vengono ordinati e scritti in
+    `tmp_dir`, poi fusi in un'unica passata (heapq.merge). Se tutto
+    sta in un blocco non si tocca il disco.
+    """
+    runs = []
+    chunk = set()
+    for rule in rules:
+        chunk.add(rule)
+        if len(chunk) >= chunk_size:
+            runs.append(_write_run(chunk, tmp_dir))
+            chunk = set()
+    if not runs:
+        yield from sorted(chunk)
+        return
+    if chunk:
+        runs.append(_write_run(chunk, tmp_dir))
+    del chunk
+
+    files = [open(path, "r", encoding="utf-8") for path in runs]
+    try:
+        merged = heapq.merge(*((line.rstrip("\n") for line in f) for f in files))
+        for rule, _ in groupby(merged):
+            yield rule
+    finally:
+        for f in files:
+            f.close()
+        for path in runs:
+            os.unlink(path)
+
+
+# =========================
+# IMPORTAZIONE
+# =========================
+
+def list_name(source: Path) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", Path(source).stem) or "lista"
+
+
+def import_list(
+    source: Path,
+    name: str | None = None,
+    lists_dir: Path | None = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> dict:
+    """
+    Importa `source` in <lists_dir>/<nome>.txt, una regola per riga,
+    sostituendo l'eventuale lista con lo stesso nome. Le righe non
+    valide vengono saltate e segnalate con il numero di riga; se non
+    resta nessuna regola la lista esistente non viene toccata
+    (ValueError).
+    """
+    source = Path(source)
+    lists_dir = Path(lists_dir or LISTS_DIR)
+    output = lists_dir / f"{list_name(Path(name or source))}.txt"
+    lists_dir.mkdir(parents=True, exist_ok=True)
+    stats = {
+        "output": output,
+        "lines": 0,
+        "rules": 0,
+        "allowed": 0,
+        "ignored": 0,
+        "errors": 0,
+        "error_lines": [],
+    }
+
+    with open(source, "r", encoding="utf-8-sig", errors="replace") as f, \
+            tempfile.TemporaryDirectory(dir=lists_dir) as tmp_dir:
+        fd, tmp = tempfile.mkstemp(dir=lists_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                out.write(f"# Importata da {source.name} il {time.strftime('%Y-%m-%d %H:%M')}\n")
+                for rule in sorted_unique(iter_rules(f, stats, source.name), tmp_dir, chunk_size):
+                    out.write(rule)
+                    out.write("\n")
+                    stats["rules"] += 1
+                    if rule.startswith(ALLOW_PREFIX):
+                        stats["allowed"] += 1
+                out.flush()
+                os.fsync(out.fileno())
+            if not stats["rules"]:
+                raise ValueError(f"{source}: nessuna regola valida ({stats['errors']} righe non valide)")
+            os.replace(tmp, output)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    if stats["errors"] > MAX_REPORTED_ERRORS:
+        print(f"[IMPORT] {source.name}: altri {stats['errors'] - MAX_REPORTED_ERRORS} errori non mostrati")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", type=Path)
+    parser.add_argument("-n", "--name", help="nome della lista (default: nome del file)")
+    parser.add_argument("-d", "--lists-dir", type=Path, default=LISTS_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        stats = import_list(args.source, args.name, args.lists_dir)
+    except (OSError, ValueError) as e:
+        print(f"[IMPORT] Importazione fallita: {e}")
+        raise SystemExit(1)
+    elapsed = time.perf_counter() - start
+    print(
+        f"[IMPORT] {stats['rules']} regole ({stats['allowed']} eccezioni) da "
+        f"{stats['lines']} righe -> {stats['output']} ({elapsed:.2f}s); "
+        f"{stats['ignored']} ignorate, {stats['errors']} non valide"
+    )
+
+
+if __name__ == "__main__":
+    main()
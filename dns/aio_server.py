@@ -0,0 +1,398 @@
+import asyncio
+import random
+import socket
+import struct
+import threading
+import time
+
+from dnslib import DNSRecord, DNSError
+
+from dns.metrics import STAGE_PARSE
+from dns.upstream import UpstreamPool
+from dns.wire import empty_reply, fit_udp, parse_query, question_bytes, udp_payload_size
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Secondi di inattività dopo cui il server chiude una connessione TCP
+TCP_IDLE_TIMEOUT = 10.0
+
+
+# =========================
+# UPSTREAM NON BLOCCANTI
+# =========================
+
+class _UpstreamProtocol(asyncio.DatagramProtocol):
+    """
+    Endpoint UDP connesso verso un upstream: stesso schema di
+    UpstreamConnection (ID di transazione nostro, verifica della
+    domanda) ma senza thread, tutto nel loop asyncio.
+    """
+
+    def __init__(self, address: tuple):
+        self.address = address
+        self.transport = None
+        self.pending: dict[int, tuple[bytes, asyncio.Future]] = {}
+        self.rejected = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 12 or not data[2] & 0x80:
+            self.rejected += 1
+            return
+        txid = int.from_bytes(data[:2], "big")
+        entry = self.pending.get(txid)
+        if entry is None or question_bytes(data) != entry[0]:
+            self.rejected += 1
+            return
+        del self.pending[txid]
+        future = entry[1]
+        if not future.done():
+            future.set_result((data, self.address, time.monotonic()))
+
+    def error_received(self, exc):
+        # es. ICMP port unreachable: le query in attesa scadranno da sole
+        pass
+
+    def send(self, packet: bytes, question: bytes, future: asyncio.Future) -> int:
+        txid = random.getrandbits(16)
+        while txid in self.pending:
+            txid = random.getrandbits(16)
+        self.pending[txid] = (question, future)
+        self.transport.sendto(txid.to_bytes(2, "big") + packet[2:])
+        return txid
+
+
+class AsyncUpstreamPool:
+    """
+    Versione asyncio di UpstreamPool.query(): stessa corsa scaglionata
+    tra upstream, stessa salute/ordinamento (condivisi con `pool`).
+    """
+
+    def __init__(self, pool: UpstreamPool):
+        self.pool = pool
+        self._protocols: dict[tuple, _UpstreamProtocol] = {}
+
+    async def _protocol(self, upstream: tuple) -> _UpstreamProtocol:
+        protocol = self._protocols.get(upstream)
+        if protocol is None:
+            loop = asyncio.get_running_loop()
+            _, protocol = await loop.create_datagram_endpoint(
+                lambda: _UpstreamProtocol(upstream), remote_addr=upstream
+            )
+            existing = self._protocols.setdefault(upstream, protocol)
+            if existing is not protocol:
+                protocol.transport.close()
+                protocol = existing
+        return protocol
+
+    async def query(
+        self,
+        packet: bytes,
+        upstreams: list[tuple],
+        deadline: float,
+        stagger: float,
+    ) -> bytes | None:
+        return (await self.query_with_winner(packet, upstreams, deadline, stagger))[0]
+
+    async def query_with_winner(
+        self,
+        packet: bytes,
+        upstreams: list[tuple],
+        deadline: float,
+        stagger: float,
+        trace=None,
+    ) -> tuple[bytes | None, tuple | None]:
+        question = question_bytes(packet)
+        if question is None:
+            return None, None
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        end = time.monotonic() + deadline
+        sent = []
+        try:
+            for upstream in self.pool.ordered(upstreams):
+                protocol = await self._protocol(upstream)
+                health = self.pool.health(upstream)
+                sent_at = time.monotonic()
+                try:
+                    txid = protocol.send(packet, question, future)
+                except OSError:
+                    continue
+                sent.append((protocol, txid, health, sent_at))
+                remaining = end - time.monotonic()
+                wait = max(0.0, min(stagger, health.timeout(), remaining))
+                done, _ = await asyncio.wait({future}, timeout=wait)
+                if done or remaining <= 0:
+                    break
+            if sent and not future.done():
+                await asyncio.wait({future}, timeout=max(0.0, end - time.monotonic()))
+        finally:
+            for protocol, txid, _, _ in sent:
+                protocol.pending.pop(txid, None)
+
+        data, winner, received_at = future.result() if future.done() else (None, None, 0.0)
+        attempts = [(protocol.address, health, sent_at) for protocol, _, health, sent_at in sent]
+        self.pool.record_race(packet, attempts, winner, received_at, trace)
+        if data is None:
+            return None, None
+        if data[2] & 0x02:
+            # Risposta troncata: stessa query in TCP (socket bloccanti,
+            # quindi in un thread del pool di default)
+            tcp_data = await loop.run_in_executor(None, self.pool.retry_tcp, packet, winner, end, trace)
+            if tcp_data is not None:
+                return tcp_data, winner
+        return packet[:2] + data[2:], winner
+
+    def close(self):
+        for protocol in self._protocols.values():
+            protocol.transport.close()
+        self._protocols.clear()
+
+
+# =========================
+# SERVER ASYNCIO
+# =========================
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "AsyncDNSServer"):
+        self.server = server
+        self.transport = None
+        # Il loop tiene solo riferimenti deboli ai task: senza questo set
+        # una query in corso può essere raccolta dal garbage collector
+        self._tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        task = asyncio.ensure_future(self._reply(data, addr))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reply(self, data: bytes, addr):
+        rdata = await self.server.handle(data, addr)
+        if rdata is not None:
+            self.transport.sendto(fit_udp(rdata, udp_payload_size(data)), addr)
+
+
+class AsyncDNSServer:
+    """
+    Motore alternativo a DNSServer di dnslib: un solo thread con loop
+    asyncio per UDP e TCP, invece di un thread per richiesta.
+    Riusa la logica di BlockResolver (blocco, cache) e inoltra
+    upstream senza bloccare. Stessa interfaccia start_thread()/stop().
+    """
+
+    def __init__(
+        self,
+        resolver,
+        addresses=("0.0.0.0",),
+        port: int = 53,
+        tcp: bool = True,
+        reuse_port: bool = False,
+    ):
+        self.resolver = resolver
+        self.addresses = list(addresses)
+        self.port = port
+        self.tcp = tcp
+        # SO_REUSEPORT: più processi sulla stessa porta (vedi dns.workers)
+        self.reuse_port = reuse_port
+        self.upstreams = AsyncUpstreamPool(resolver.upstreams)
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._loop = None
+        self._transports = []
+        self._tcp_servers = []
+        self.thread = None
+
+    # ---------- risoluzione ----------
+
+    async def handle(self, data: bytes, client=None) -> bytes | None:
+        resolver = self.resolver
+        metrics = resolver.metrics
+        if metrics is None:
+            query = parse_query(data)
+        else:
+            t0 = time.perf_counter()
+            query = parse_query(data)
+            metrics.observe(STAGE_PARSE, time.perf_counter() - t0)
+        tracer = resolver.tracer
+        if query is not None:
+            qname, qtype, qclass, qend = query
+            trace = tracer.start(qname, qtype, client) if tracer is not None else None
+            rdata = resolver.blocked_wire_reply(data, query, client, trace)
+            if rdata is None:
+                rdata = await self.relay(data, (qname, qtype, qclass), client, trace)
+                if rdata is None:
+                    rdata = empty_reply(data, qend)
+            if trace is not None:
+                tracer.finish(trace)
+            return rdata
+
+        # Pacchetto insolito: passa da dnslib
+        try:
+            request = DNSRecord.parse(data)
+        except DNSError:
+            return None
+        trace = tracer.start(str(request.q.qname), request.q.qtype, client) if tracer is not None else None
+        reply = resolver.blocked_reply(request, client, trace)
+        if reply is not None:
+            rdata = reply.pack()
+        else:
+            rdata = await self.relay(request.pack(), resolver.cache.key(request), client, trace)
+            if rdata is None:
+                rdata = request.reply().pack()
+        if trace is not None:
+            tracer.finish(trace)
+        return rdata
+
+    async def relay(self, packet: bytes, key: tuple, client=None, trace=None) -> bytes | None:
+        """
+        Come BlockResolver.relay(): byte del client verso l'upstream,
+        byte dell'upstream verso il client con il solo ID cambiato.
+        """
+        resolver = self.resolver
+        start = time.monotonic()
+        cached = resolver.cached_wire_reply(packet, key, client, start, trace)
+        if cached is not None:
+            return cached
+
+        t0 = time.perf_counter()
+        future = self._inflight.get(key)
+        if future is not None:
+            data = await asyncio.shield(future)
+            return resolver.coalesced_reply(packet, key, data, client, start, t0, trace)
+
+        future = self._loop.create_future()
+        self._inflight[key] = future
+        data = winner = None
+        try:
+            try:
+                data, winner = await self.upstreams.query_with_winner(
+                    packet, resolver.upstream_dns_list, resolver.deadline, resolver.stagger, trace
+                )
+            except OSError as e:
+                resolver.report_upstream_error(key, e)
+            resolver.store_reply(key, data)
+        finally:
+            del self._inflight[key]
+            future.set_result(data)
+        return resolver.upstream_reply(key, data, winner, client, start, t0, trace)
+
+    async def _reply_tcp(self, data: bytes, writer: asyncio.StreamWriter):
+        rdata = await self.handle(data, writer.get_extra_info("peername"))
+        if rdata is None or writer.is_closing():
+            return
+        writer.write(struct.pack("!H", len(rdata)) + rdata)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Query in pipeline risolte in parallelo: le risposte escono
+        # nell'ordine in cui sono pronte, abbinate dal client per ID
+        # (RFC 7766)
+        tasks = set()
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(2), TCP_IDLE_TIMEOUT)
+                data = await reader.readexactly(struct.unpack("!H", header)[0])
+                task = asyncio.ensure_future(self._reply_tcp(data, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    # ---------- ciclo di vita ----------
+
+    @staticmethod
+    def _udp_socket(address: str, port: int, reuse_port: bool = False) -> socket.socket:
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            if family == socket.AF_INET6:
+                # Solo IPv6: convive con il listener IPv4 sulla stessa porta
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.bind((address, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        for address in self.addresses:
+            try:
+                sock = self._udp_socket(address, self.port, self.reuse_port)
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda: _ServerProtocol(self), sock=sock
+                )
+                self._transports.append(transport)
+                # Con port=0 tutti i listener usano la porta scelta dal primo
+                self.port = sock.getsockname()[1]
+                if self.tcp:
+                    self._tcp_servers.append(
+                        await asyncio.start_server(
+                            self._handle_tcp, address, self.port, reuse_port=self.reuse_port or None
+                        )
+                    )
+            except OSError as e:
+                if ":" in address and self._transports:
+                    print(f"[DNS] Listener {address} non disponibile: {e}")
+                    continue
+                self._close_listeners()
+                raise
+
+    def _close_listeners(self):
+        for transport in self._transports:
+            transport.close()
+        for server in self._tcp_servers:
+            server.close()
+
+    def _run(self, ready: threading.Event, errors: list):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._start())
+        except Exception as e:
+            errors.append(e)
+            ready.set()
+            self._loop.close()
+            return
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._close_listeners()
+            self.upstreams.close()
+            self._loop.close()
+
+    def start_thread(self):
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        errors = []
+        self.thread = threading.Thread(target=self._run, args=(ready, errors), daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self.thread.join(timeout=2)
+        self.resolver.close()
+
+    def isAlive(self):
+        return self.thread is not None and self.thread.is_alive()
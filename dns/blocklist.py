@@ -0,0 +1,726 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Iterable
+from itertools import groupby
+from pathlib import Path
+from zlib import crc32
+
+from dns.journal import ALLOWED_KEY, BLOCKED_KEY, OP_ADD, JournalReader
+from dns.patterns import PatternMatcher, is_pattern
+
+
+# =========================
+# INDICE SUFFISSI
+# =========================
+
+def match_suffix(domain: str, domains) -> str | None:
+    """
+    Ritorna la voce di `domains` che copre `domain` (match esatto o
+    dominio padre), None se nessuna.
+    Costo O(numero di label del dominio), indipendente dalla lista.
+    """
+    if domain in domains:
+        return domain
+    dot = domain.find(".")
+    while dot != -1:
+        suffix = domain[dot + 1:]
+        if suffix in domains:
+            return suffix
+        dot = domain.find(".", dot + 1)
+    return None
+
+
+# Esito di una voce dell'indice: dominio bloccato o eccezione (allow)
+RULE_BLOCK = 0
+RULE_ALLOW = 1
+
+
+def first_rule(domain: str, lookup: Callable[[str], int | None]) -> tuple[str, int] | None:
+    """
+    (suffisso, esito) della prima voce trovata partendo dal nome intero
+    verso il TLD, cioè la più specifica: blocchi ed eccezioni si
+    risolvono nella stessa scansione delle label.
+    """
+    rule = lookup(domain)
+    if rule is not None:
+        return domain, rule
+    dot = domain.find(".")
+    while dot != -1:
+        suffix = domain[dot + 1:]
+        rule = lookup(suffix)
+        if rule is not None:
+            return suffix, rule
+        dot = domain.find(".", dot + 1)
+    return None
+
+
+def _resolve(found: tuple[str, int] | None, domain: str, patterns) -> str | None:
+    if found is not None and found[1] == RULE_BLOCK:
+        return found[0]
+    if patterns is None:
+        return None
+    # Qui `found` è None oppure un'eccezione. Eccezione su un nome più
+    # specifico della wildcard (o uguale): vince l'eccezione
+    matched = patterns.match_wildcard(domain)
+    if matched is not None and (found is None or len(found[0]) < len(matched)):
+        return matched
+    # Una regex copre il nome intero, senza un suffisso da confrontare:
+    # qualsiasi eccezione che copre il nome vince
+    if found is None and patterns.match_regex(domain):
+        return domain
+    return None
+
+
+class DomainIndex:
+    """
+    Indice dei domini bloccati: un set hash interrogato per ogni
+    suffisso del nome richiesto, invece di scorrere tutta la lista.
+    Semantica invariata: blocca il dominio esatto e tutti i sottodomini.
+    Le eccezioni (`allowed`) sbloccano un sottoalbero; vince la voce più
+    specifica, a parità l'eccezione.
+    """
+
+    __slots__ = ("_domains", "_allowed")
+
+    def __init__(self, domains: Iterable[str] = (), allowed: Iterable[str] = ()):
+        if isinstance(domains, (set, frozenset)):
+            self._domains = domains
+        else:
+            self._domains = frozenset(domains)
+        self._allowed = frozenset(allowed)
+
+    def __len__(self) -> int:
+        return len(self._domains)
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self._domains
+
+    def __iter__(self):
+        return iter(self._domains)
+
+    def _lookup(self, domain: str) -> int | None:
+        if domain in self._allowed:
+            return RULE_ALLOW
+        if domain in self._domains:
+            return RULE_BLOCK
+        return None
+
+    def _entries(self, domain: str) -> tuple[bool, bool]:
+        # (bloccato, eccezione) per il nome esatto, anche se ci sono entrambi
+        return domain in self._domains, domain in self._allowed
+
+    def match(self, domain: str) -> str | None:
+        if not self._allowed:
+            return match_suffix(domain, self._domains)
+        return _resolve(first_rule(domain, self._lookup), domain, None)
+
+    def is_blocked(self, domain: str) -> bool:
+        return self.match(domain) is not None
+
+
+# =========================
+# INDICE COMPILATO (MMAP)
+# =========================
+
+# Formato del file indice (little endian):
+#   header di 32 byte: magic, versione, flag, numero di hash, digest
+#   delle sorgenti da cui è stato compilato
+#   seguono gli hash a 64 bit dei domini, ordinati e senza duplicati;
+#   il bit meno significativo indica l'esito (RULE_BLOCK/RULE_ALLOW)
+#   con FLAG_BLOOM: header del filtro (bit, funzioni hash, tasso di
+#   falsi positivi) e i suoi bit
+#   con FLAG_PATTERNS: lunghezza e testo UTF-8 delle regole a pattern,
+#   una per riga (vedi dns.patterns)
+INDEX_MAGIC = b"DBLK"
+INDEX_VERSION = 2
+FLAG_BLOOM = 0x0001
+FLAG_PATTERNS = 0x0002
+_INDEX_HEADER = struct.Struct("<4sHHQQ")
+_BLOOM_HEADER = struct.Struct("<QIf")
+_PATTERNS_HEADER = struct.Struct("<I")
+
+# Falsi positivi attesi dal filtro di Bloom davanti all'indice
+# (0 = nessun filtro)
+BLOOM_FP_RATE = 0.01
+# Test di bit per nome al massimo: oltre costano più della ricerca nell'indice
+BLOOM_MAX_HASHES = 8
+_BLOOM_SEED = 0x9E3779B9
+_HASH_MASK = ~1 & 0xFFFFFFFFFFFFFFFF
+
+
+def domain_hash(domain: str) -> int:
+    """
+    Hash a 64 bit del dominio (blake2b, stabile tra processi, a
+    differenza di hash()).
+    """
+    return int.from_bytes(hashlib.blake2b(domain.encode(), digest_size=8).digest(), "little")
+
+
+def bloom_hashes(domain: str) -> tuple[int, int]:
+    """
+    Coppia di hash per il filtro di Bloom (double hashing): due crc32,
+    molto più economici di domain_hash().
+    """
+    data = domain.encode()
+    return crc32(data), crc32(data, _BLOOM_SEED) | 1
+
+
+class BloomFilter:
+    """
+    Filtro di Bloom sui domini bloccati: per ogni suffisso del nome
+    richiesto dice "sicuramente assente" con pochi test di bit, e solo
+    negli altri casi si consulta l'indice.
+    """
+
+    __slots__ = ("bits", "size", "hashes", "fp_rate")
+
+    def __init__(self, bits, size: int, hashes: int, fp_rate: float):
+        self.bits = bits
+        self.size = size
+        self.hashes = hashes
+        self.fp_rate = fp_rate
+
+    @staticmethod
+    def parameters(count: int, fp_rate: float) -> tuple[int, int]:
+        """
+        (numero di bit, numero di funzioni hash) ottimali per `count`
+        voci al tasso di falsi positivi `fp_rate`. Le funzioni hash
+        dipendono solo dal tasso (-log2), non dalla dimensione
+        arrotondata: con liste piccole il minimo di 64 bit abbassa i
+        falsi positivi, non deve moltiplicare i test per query.
+        """
+        count = max(count, 1)
+        hashes = min(BLOOM_MAX_HASHES, max(1, round(-math.log2(fp_rate))))
+        size = math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2)
+        size = max(64, (size + 7) // 8 * 8)
+        return size, hashes
+
+    @classmethod
+    def build(cls, pairs: Iterable[tuple[int, int]], count: int, fp_rate: float) -> "BloomFilter":
+        size, hashes = cls.parameters(count, fp_rate)
+        bits = bytearray(size // 8)
+        for h1, h2 in pairs:
+            for i in range(hashes):
+                pos = (h1 + i * h2) % size
+                bits[pos >> 3] |= 1 << (pos & 7)
+        return cls(bits, size, hashes, fp_rate)
+
+    def might_contain(self, domain: str) -> bool:
+        h1, h2 = bloom_hashes(domain)
+        bits = self.bits
+        size = self.size
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        return self.size // 8
+
+
+def write_hash_index(
+    domains: Iterable[str],
+    path: Path,
+    source_digest: int = 0,
+    bloom_fp_rate: float = BLOOM_FP_RATE,
+    patterns: Iterable[str] = (),
+    allowed: Iterable[str] = (),
+) -> int:
+    """
+    Scrive l'indice dei domini bloccati e delle eccezioni (con il
+    filtro di Bloom se `bloom_fp_rate` > 0, e le regole a pattern) e
+    ritorna il numero di voci. Il file viene scritto a parte e poi
+    rinominato, quindi non si vede mai a metà; su Windows però non si
+    può sostituire un file mappato (il resolver scrive ogni versione in
+    un file nuovo, vedi dns.compiler.index_version_path). `patterns` e
+    `allowed` si leggono dopo `domains`.
+    """
+    hashes = []
+    pairs_low, pairs_high = array("I"), array("I")
+
+    def add(domain: str, rule: int):
+        hashes.append(domain_hash(domain) & _HASH_MASK | rule)
+        if bloom_fp_rate:
+            h1, h2 = bloom_hashes(domain)
+            pairs_low.append(h1)
+            pairs_high.append(h2)
+
+    for domain in domains:
+        add(domain, RULE_BLOCK)
+    for domain in allowed:
+        add(domain, RULE_ALLOW)
+    hashes.sort()
+    unique = array("Q", (h for h, _ in groupby(hashes)))
+    del hashes
+    bloom = None
+    if bloom_fp_rate:
+        bloom = BloomFilter.build(zip(pairs_low, pairs_high), len(unique), bloom_fp_rate)
+        del pairs_low, pairs_high
+    if sys.byteorder != "little":
+        unique.byteswap()
+
+    patterns_text = "\n".join(patterns).encode()
+    flags = FLAG_BLOOM if bloom is not None else 0
+    if patterns_text:
+        flags |= FLAG_PATTERNS
+    fd, tmp = tempfile.mkstemp(dir=Path(path).parent, prefix=f"{Path(path).name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, flags, len(unique), source_digest))
+            unique.tofile(f)
+            if bloom is not None:
+                f.write(_BLOOM_HEADER.pack(bloom.size, bloom.hashes, bloom.fp_rate))
+                f.write(bloom.bits)
+            if patterns_text:
+                f.write(_PATTERNS_HEADER.pack(len(patterns_text)))
+                f.write(patterns_text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return len(unique)
+
+
+def read_index_header(path: Path) -> tuple[int, int] | None:
+    """
+    (numero di hash, digest sorgenti) dell'indice, None se il file
+    manca o non è un indice valido.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_INDEX_HEADER.size)
+    except OSError:
+        return None
+    if len(header) < _INDEX_HEADER.size:
+        return None
+    magic, version, _, count, digest = _INDEX_HEADER.unpack(header)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+    return count, digest
+
+
+class MappedDomainIndex:
+    """
+    Indice in sola lettura su file mappato in memoria (vedi
+    write_hash_index): nessun oggetto Python per voce, avvio immediato
+    e pagine condivise tra tutti i processi che lo aprono. Ricerca
+    binaria per ogni suffisso; una collisione a 64 bit è trascurabile.
+    Se presente, il filtro di Bloom scarta prima la maggior parte dei
+    suffissi non bloccati; le regole a pattern sono compilate in un
+    unico matcher all'apertura. Eccezioni e blocchi stanno nello stesso
+    array e si risolvono nella stessa scansione (vedi first_rule).
+
+    Compromesso: memoria in cambio di latenza. Con 1M domini il set di
+    stringhe (DomainIndex) occupa centinaia di MB per processo, l'indice
+    8 byte per voce condivisi; ma ogni suffisso non scartato dal filtro
+    costa un hash blake2b e una ricerca binaria al posto di un lookup in
+    un set, e una ricerca è alcune volte più lenta (vedi
+    tests/baselines/bench_hotpath.json, casi set/index contro mapped).
+    """
+
+    __slots__ = ("path", "source_digest", "bloom", "patterns", "_mmap", "_hashes")
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _INDEX_HEADER.size:
+            self._mmap.close()
+            raise ValueError(f"{path}: indice blocklist non valido")
+        magic, version, flags, count, self.source_digest = _INDEX_HEADER.unpack_from(self._mmap)
+        end = _INDEX_HEADER.size + count * 8
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or len(self._mmap) < end:
+            self._mmap.close()
+            raise ValueError(f"{path}: indice blocklist non valido")
+        if sys.byteorder == "little":
+            self._hashes = memoryview(self._mmap)[_INDEX_HEADER.size:end].cast("Q")
+        else:
+            # Raro: copia in memoria con i byte invertiti
+            self._hashes = array("Q", self._mmap[_INDEX_HEADER.size:end])
+            self._hashes.byteswap()
+
+        self.bloom = None
+        if flags & FLAG_BLOOM:
+            size, hashes, fp_rate = _BLOOM_HEADER.unpack_from(self._mmap, end)
+            start = end + _BLOOM_HEADER.size
+            if len(self._mmap) < start + size // 8:
+                raise ValueError(f"{path}: filtro di Bloom troncato")
+            self.bloom = BloomFilter(memoryview(self._mmap)[start:start + size // 8], size, hashes, fp_rate)
+            end = start + size // 8
+
+        self.patterns = None
+        if flags & FLAG_PATTERNS:
+            (length,) = _PATTERNS_HEADER.unpack_from(self._mmap, end)
+            start = end + _PATTERNS_HEADER.size
+            text = self._mmap[start:start + length].decode()
+            self.patterns = PatternMatcher(text.split("\n"))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _lookup(self, domain: str) -> int | None:
+        # Percorso di ogni suffisso di ogni query: niente contatori, e il
+        # test del filtro è quello di BloomFilter.might_contain() senza
+        # chiamate (vedi bloom_stats() per misurarne l'efficacia)
+        bloom = self.bloom
+        if bloom is not None:
+            data = domain.encode()
+            step = crc32(data, _BLOOM_SEED) | 1
+            bits = bloom.bits
+            size = bloom.size
+            pos = crc32(data) % size
+            for _ in range(bloom.hashes):
+                if not bits[pos >> 3] >> (pos & 7) & 1:
+                    return None
+                pos = (pos + step) % size
+        h = domain_hash(domain) & _HASH_MASK
+        hashes = self._hashes
+        i = bisect_left(hashes, h)
+        if i < len(hashes):
+            entry = hashes[i]
+            if entry == h:
+                # Blocco ed eccezione sullo stesso nome: vince l'eccezione
+                if i + 1 < len(hashes) and hashes[i + 1] == h | RULE_ALLOW:
+                    return RULE_ALLOW
+                return RULE_BLOCK
+            if entry == h | RULE_ALLOW:
+                return RULE_ALLOW
+        return None
+
+    def _entries(self, domain: str) -> tuple[bool, bool]:
+        # (bloccato, eccezione) per il nome esatto, anche se ci sono entrambi
+        h = domain_hash(domain) & _HASH_MASK
+        hashes = self._hashes
+        i = bisect_left(hashes, h)
+        blocked = i < len(hashes) and hashes[i] == h
+        if blocked:
+            i += 1
+        return blocked, i < len(hashes) and hashes[i] == h | RULE_ALLOW
+
+    def __contains__(self, domain: str) -> bool:
+        return self._lookup(domain) == RULE_BLOCK
+
+    def match(self, domain: str) -> str | None:
+        return _resolve(first_rule(domain, self._lookup), domain, self.patterns)
+
+    def is_blocked(self, domain: str) -> bool:
+        return self.match(domain) is not None
+
+    def stats(self) -> dict:
+        bloom = self.bloom
+        return {
+            "entries": len(self._hashes),
+            "patterns": len(self.patterns) if self.patterns else 0,
+            "index_bytes": len(self._hashes) * 8,
+            "bloom_bytes": bloom.nbytes if bloom else 0,
+            "bloom_hashes": bloom.hashes if bloom else 0,
+            "bloom_fp_rate": bloom.fp_rate if bloom else None,
+        }
+
+    def bloom_stats(self, domains: Iterable[str]) -> dict:
+        """
+        Efficacia del filtro sui suffissi dei nomi `domains` (es. un
+        campione di query), misurata a richiesta e non a ogni ricerca:
+        - bloom_hit_ratio: quota dei suffissi scartati dal solo filtro
+        - bloom_observed_fp_rate: falsi positivi sui suffissi non bloccati
+        """
+        lookups = rejected = false_positives = 0
+        for domain in domains:
+            labels = domain.split(".")
+            for i in range(len(labels)):
+                suffix = ".".join(labels[i:])
+                lookups += 1
+                if self.bloom is None or not self.bloom.might_contain(suffix):
+                    rejected += self.bloom is not None
+                elif not any(self._entries(suffix)):
+                    false_positives += 1
+        negatives = rejected + false_positives
+        return {
+            "lookups": lookups,
+            "bloom_rejected": rejected,
+            "bloom_false_positives": false_positives,
+            "bloom_hit_ratio": rejected / lookups if lookups else 0.0,
+            "bloom_observed_fp_rate": false_positives / negatives if negatives else 0.0,
+        }
+
+
+# =========================
+# MODIFICHE DAL JOURNAL
+# =========================
+
+class JournalOverlay:
+    """
+    Indice di base più le modifiche non ancora compattate (journal o
+    delta inviati dal controller): per i nomi modificati vale l'esito
+    calcolato qui, per tutti gli altri quello della base.
+    Ogni modifica costa O(1) (più una ricerca nella base) e si applica
+    sul posto con un solo assegnamento nel dict degli esiti: i thread di
+    resolve() leggono senza lock e vedono la voce prima o dopo, mai a
+    metà. Le scritture sono serializzate da BlocklistHolder.
+    Una rimozione nasconde il nome anche se compare in una lista
+    importata, fino alla ricompilazione dopo la compattazione; le
+    regole a pattern rimosse restano nella base fino ad allora, per
+    questo domain_manager compatta subito quando se ne rimuove una.
+    """
+
+    __slots__ = ("base", "entries", "_state", "_patterns", "_rules", "_extra", "_delta")
+
+    def __init__(self, base):
+        self.base = base
+        self.entries = 0
+        # nome -> (bloccato, eccezione): True/False se modificato, None se no
+        self._state: dict[str, tuple[bool | None, bool | None]] = {}
+        self._patterns: dict[str, bool] = {}
+        self._rules: dict[str, int | None] = {}
+        self._extra = None
+        self._delta = 0
+
+    def apply(self, entries) -> "JournalOverlay":
+        """
+        Applica le modifiche (op, chiave, regola) in ordine. Rigiocare
+        modifiche già applicate non cambia il risultato.
+        """
+        patterns_changed = False
+        for op, key, rule in entries:
+            self.entries += 1
+            present = op == OP_ADD
+            if is_pattern(rule):
+                # Le eccezioni a pattern non sono supportate (vedi dns.compiler)
+                if key == BLOCKED_KEY and self._patterns.get(rule) != present:
+                    self._patterns[rule] = present
+                    patterns_changed = True
+                continue
+            previous = self._state.get(rule, (None, None))
+            blocked, allowed = previous
+            if key == BLOCKED_KEY:
+                blocked = present
+            elif key == ALLOWED_KEY:
+                allowed = present
+            else:
+                continue
+            self._state[rule] = (blocked, allowed)
+            self._set_rule(rule, blocked, allowed, previous[0])
+        if patterns_changed:
+            added = [rule for rule, present in self._patterns.items() if present]
+            self._extra = PatternMatcher(added) if added else None
+        return self
+
+    def _set_rule(self, name: str, blocked: bool | None, allowed: bool | None, was_blocked: bool | None):
+        # Blocco ed eccezione della base presi separatamente: togliere
+        # l'eccezione lascia il blocco della base, se c'è
+        base_blocked, base_allowed = self.base._entries(name)
+        if was_blocked is None:
+            was_blocked = base_blocked
+        if blocked is None:
+            blocked = base_blocked
+        if allowed is None:
+            allowed = base_allowed
+        self._rules[name] = RULE_ALLOW if allowed else RULE_BLOCK if blocked else None
+        # len() conta le voci di blocco, come la base
+        self._delta += blocked - was_blocked
+
+    def __len__(self) -> int:
+        return len(self.base) + self._delta
+
+    def _lookup(self, domain: str) -> int | None:
+        rules = self._rules
+        if domain in rules:
+            return rules[domain]
+        return self.base._lookup(domain)
+
+    def __contains__(self, domain: str) -> bool:
+        return self._lookup(domain) == RULE_BLOCK
+
+    def match(self, domain: str) -> str | None:
+        found = first_rule(domain, self._lookup)
+        matched = _resolve(found, domain, getattr(self.base, "patterns", None))
+        if matched is None and self._extra is not None:
+            matched = _resolve(found, domain, self._extra)
+        return matched
+
+    def is_blocked(self, domain: str) -> bool:
+        return self.match(domain) is not None
+
+    def stats(self) -> dict:
+        stats = self.base.stats() if hasattr(self.base, "stats") else {"entries": len(self.base)}
+        stats["journal_entries"] = self.entries
+        stats["journal_rules"] = len(self._rules) + len(self._patterns)
+        return stats
+
+
+# =========================
+# HOLDER CON RELOAD
+# =========================
+
+class BlocklistHolder:
+    """
+    Tiene in memoria l'indice dei domini bloccati e lo ricostruisce solo
+    quando il file cambia (mtime/size), controllando al massimo una volta
+    ogni `check_interval` secondi.
+    Il nuovo indice viene costruito in un thread a parte (la query che
+    nota il cambiamento non aspetta la compilazione) e poi sostituito
+    con un solo assegnamento: i thread di resolve() vedono sempre un
+    indice completo.
+    `loader` ritorna i domini oppure un indice già pronto; `signature`
+    sostituisce mtime/size di `path` quando le sorgenti sono più file.
+    Con `journal` le modifiche aggiunte al journal dopo lo snapshot si
+    applicano sopra l'indice caricato (JournalOverlay), senza ricaricarlo.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        loader: Callable[[], Iterable[str] | DomainIndex | MappedDomainIndex],
+        check_interval: float = 1.0,
+        signature: Callable[[], object] | None = None,
+        journal: JournalReader | None = None,
+    ):
+        self.path = path
+        self._loader = loader
+        self._journal = journal
+        self._check_interval = check_interval
+        self._signature_func = signature
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._signature = None
+        self._next_check = 0.0
+        self._base = DomainIndex()
+        self._index = self._base
+        self.reload()
+
+    def _file_signature(self):
+        if self._signature_func is not None:
+            return self._signature_func()
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload(self) -> bool:
+        """
+        Ricarica il file. In caso di errore (es. JSON scritto a metà)
+        mantiene l'indice attuale e riprova al controllo successivo.
+        """
+        with self._reload_lock:
+            return self._reload_locked()
+
+    def _reload_locked(self) -> bool:
+        signature = self._file_signature()
+        index = self._load()
+        if index is None:
+            return False
+        return self._publish(index, signature)
+
+    def _reload_in_background(self):
+        # Caricamento fuori dal lock: query e apply() continuano
+        # sull'indice attuale finché il nuovo non è pronto
+        signature = self._file_signature()
+        index = self._load()
+        with self._reload_lock:
+            if index is not None:
+                self._publish(index, signature)
+            self._reload_thread = None
+
+    def _load(self) -> DomainIndex | MappedDomainIndex | None:
+        try:
+            index = self._loader()
+            if not isinstance(index, (DomainIndex, MappedDomainIndex)):
+                index = DomainIndex(index)
+        except Exception as e:
+            print(f"[BLOCKLIST] Ricarica fallita, mantengo lista attuale: {e}")
+            return None
+        return index
+
+    def _publish(self, index: DomainIndex | MappedDomainIndex, signature) -> bool:
+        # Journal applicato prima di pubblicare: le query non vedono mai
+        # la base senza le modifiche in attesa
+        published = index
+        if self._journal is not None:
+            try:
+                entries = self._journal.read_all()
+            except OSError as e:
+                print(f"[BLOCKLIST] Lettura journal fallita, mantengo lista attuale: {e}")
+                return False
+            if entries:
+                published = JournalOverlay(index).apply(entries)
+        self._base = index
+        self._index = published
+        self._signature = signature
+        return True
+
+    def _apply_journal(self, stale_base: bool = False):
+        """
+        Applica le righe nuove del journal all'indice corrente; se il
+        journal è stato ruotato (compattazione) lo rilegge per intero
+        sopra l'indice di base. Con `stale_base` (sorgenti cambiate, base
+        non ancora ricaricata) un journal ruotato aspetta la ricarica:
+        le modifiche riversate nello snapshot mancano alla base vecchia.
+        """
+        try:
+            entries = self._journal.read_new()
+            index = self._index
+            if entries is None:
+                if stale_base:
+                    return
+                entries = self._journal.read_all()
+                index = self._base
+        except OSError as e:
+            print(f"[BLOCKLIST] Lettura journal fallita: {e}")
+            return
+        if not entries:
+            self._index = index
+            return
+        if isinstance(index, JournalOverlay):
+            index.apply(entries)
+        else:
+            self._index = JournalOverlay(index).apply(entries)
+
+    def apply(self, entries):
+        """
+        Applica subito all'indice in uso delle modifiche (op, chiave,
+        regola) già salvate, senza attendere il journal: quando il
+        journal verrà letto, rigiocarle non cambierà il risultato.
+        """
+        with self._reload_lock:
+            index = self._index
+            if isinstance(index, JournalOverlay):
+                index.apply(entries)
+            else:
+                self._index = JournalOverlay(index).apply(entries)
+
+    def get(self) -> DomainIndex | MappedDomainIndex | JournalOverlay:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._check(now)
+        return self._index
+
+    def _check(self, now: float):
+        # Un solo thread controlla/ricarica; gli altri usano l'indice corrente
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self._check_interval
+            changed = self._file_signature() != self._signature
+            if changed and self._reload_thread is None:
+                self._reload_thread = threading.Thread(
+                    target=self._reload_in_background, name="blocklist-reload", daemon=True
+                )
+                self._reload_thread.start()
+            # Le modifiche nuove valgono anche mentre una ricarica è in
+            # corso o continua a fallire
+            if self._journal is not None:
+                self._apply_journal(stale_base=changed)
+        finally:
+            self._reload_lock.release()
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from dnslib import DNSRecord
+
+from dns.wire import age_ttls, reply_ttl, reuse_reply
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_TTL = 86400
+
+
+# =========================
+# CACHE RISPOSTE
+# =========================
+
+class DNSCache:
+    """
+    Cache LRU delle risposte upstream (in byte), chiave (qname, qtype, qclass).
+    - Risposte positive: scadono dopo il TTL minimo dei record
+    - NXDOMAIN/NODATA: scadono dopo il minimum del SOA (RFC 2308)
+    - Su hit ID, domanda ed EDNS vengono presi dalla query del client
+      e i TTL decrementati, direttamente sui byte
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_ttl: int = CACHE_MAX_TTL):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries: OrderedDict[tuple, tuple[float, float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(request: DNSRecord) -> tuple[str, int, int]:
+        # Stesso formato di wire.parse_query(): minuscolo, senza punto finale
+        q = request.q
+        return str(q.qname).lower().rstrip("."), q.qtype, q.qclass
+
+    def get_wire(self, key: tuple, packet: bytes) -> bytes | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _, stored_at, data = entry
+
+        elapsed = int(now - stored_at)
+        if elapsed:
+            data = age_ttls(data, elapsed)
+        return reuse_reply(packet, data)
+
+    def put_wire(self, key: tuple, data: bytes):
+        ttl = reply_ttl(data)
+        if not ttl or ttl <= 0:
+            return
+        ttl = min(ttl, self.max_ttl)
+        now = time.monotonic()
+
+        with self._lock:
+            self._entries[key] = (now + ttl, now, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, request: DNSRecord) -> DNSRecord | None:
+        data = self.get_wire(self.key(request), request.pack())
+        return None if data is None else DNSRecord.parse(data)
+
+    def put(self, request: DNSRecord, reply: DNSRecord, data: bytes | None = None):
+        self.put_wire(self.key(request), data if data is not None else reply.pack())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,212 @@
+"""
+Compilatore della lista bloccati: config/domains.json e le liste
+importate (un dominio per riga) diventano un unico indice binario
+(vedi dns.blocklist.write_hash_index) che il resolver mappa in memoria
+senza costruire un oggetto Python per dominio.
+
+Uso: python -m dns.compiler [-o config/domains.idx] [sorgenti ...]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from dns.blocklist import BLOOM_FP_RATE, MappedDomainIndex, read_index_header, write_hash_index
+from dns.patterns import ALLOW_PREFIX, REGEX_PREFIX, is_pattern, regex_rule
+
+
+# =========================
+# SORGENTI
+# =========================
+
+def iter_source_domains(path: Path) -> Iterator[str]:
+    """
+    Domini, regole a pattern ed eccezioni (prefisso @@) di una sorgente,
+    normalizzati (minuscolo, senza punto finale; le regex re: restano
+    invariate):
+    - .json: chiavi "blocked_domains" e "allowed_domains" (formato di
+      config/domains.json)
+    - altri file: una voce per riga, righe vuote e commenti (#) ignorati;
+      una regex re: occupa tutta la riga (# e spazi ne fanno parte)
+    """
+    if path.suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = data.get("blocked_domains", [])
+        allowed = data.get("allowed_domains", [])
+    else:
+        entries = _iter_lines(path)
+        allowed = ()
+    for entry in entries:
+        entry = _normalize(entry)
+        if entry:
+            yield entry
+    for entry in allowed:
+        entry = _normalize(entry)
+        if entry:
+            yield ALLOW_PREFIX + entry
+
+
+def _normalize(entry: str) -> str:
+    entry = entry.strip()
+    if entry.startswith(REGEX_PREFIX):
+        return entry
+    return entry.lower().rstrip(".")
+
+
+def _iter_lines(path: Path) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line.removeprefix(ALLOW_PREFIX).startswith(REGEX_PREFIX):
+                yield line
+                continue
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield line.split()[0]
+
+
+def sources_digest(sources: Iterable[Path], bloom_fp_rate: float = BLOOM_FP_RATE) -> int:
+    """
+    Digest a 64 bit di nome, mtime e dimensione delle sorgenti (e dei
+    parametri di compilazione): se non coincide con quello scritto
+    nell'indice, l'indice va ricompilato.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(f"bloom={bloom_fp_rate}\n".encode())
+    for path in sources:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+        except OSError:
+            h.update(f"{path}\0-\n".encode())
+    return int.from_bytes(h.digest(), "little")
+
+
+# =========================
+# COMPILAZIONE
+# =========================
+
+def compile_blocklist(sources: list[Path], output: Path, bloom_fp_rate: float = BLOOM_FP_RATE) -> int:
+    """
+    Compila le sorgenti (quelle mancanti sono ignorate) nell'indice
+    `output` e ritorna il numero di voci distinte (domini ed eccezioni).
+    Le regole a pattern vengono separate dai domini e salvate a parte
+    nell'indice; le regex non valide sono scartate con un avviso.
+    """
+    digest = sources_digest(sources, bloom_fp_rate)
+    patterns = {}
+    allowed = set()
+
+    def domains():
+        for path in sources:
+            if not Path(path).exists():
+                continue
+            for entry in iter_source_domains(Path(path)):
+                if entry.startswith(ALLOW_PREFIX):
+                    entry = entry[len(ALLOW_PREFIX):]
+                    if is_pattern(entry):
+                        print(f"[BLOCKLIST] Eccezione a pattern non supportata in {path}: {entry}")
+                    elif entry:
+                        allowed.add(entry)
+                elif not is_pattern(entry):
+                    yield entry
+                elif entry not in patterns and _valid_pattern(entry, path):
+                    patterns[entry] = None
+
+    return write_hash_index(domains(), output, digest, bloom_fp_rate, patterns, allowed)
+
+
+def _valid_pattern(rule: str, path: Path) -> bool:
+    if not rule.startswith(REGEX_PREFIX):
+        return True
+    try:
+        regex_rule(rule[len(REGEX_PREFIX):])
+    except ValueError as e:
+        print(f"[BLOCKLIST] Regola non valida in {path}: {rule} ({e})")
+        return False
+    return True
+
+
+def ensure_compiled(sources: list[Path], output: Path, bloom_fp_rate: float = BLOOM_FP_RATE) -> bool:
+    """
+    Ricompila solo se le sorgenti sono cambiate dall'ultima volta;
+    True se l'indice è stato riscritto.
+    """
+    header = read_index_header(output)
+    if header is not None and header[1] == sources_digest(sources, bloom_fp_rate):
+        return False
+    compile_blocklist(sources, output, bloom_fp_rate)
+    return True
+
+
+def index_version_path(output: Path, digest: int) -> Path:
+    """
+    File della versione dell'indice per un digest delle sorgenti
+    (domains.<digest>.idx accanto a `output`). Su Windows un file
+    mappato non si può sostituire: ogni compilazione scrive quindi un
+    file nuovo e le versioni precedenti si cancellano quando nessuno le
+    mappa più (remove_stale_indexes).
+    """
+    return output.with_name(f"{output.stem}.{digest:016x}{output.suffix}")
+
+
+def ensure_compiled_version(sources: list[Path], output: Path, bloom_fp_rate: float = BLOOM_FP_RATE) -> int:
+    """
+    Come ensure_compiled(), sul file della versione: ritorna il digest
+    delle sorgenti, da passare a index_version_path().
+    """
+    digest = sources_digest(sources, bloom_fp_rate)
+    ensure_compiled(sources, index_version_path(output, digest), bloom_fp_rate)
+    return digest
+
+
+def remove_stale_indexes(output: Path, keep: Path):
+    # Versioni precedenti (e il vecchio domains.idx): su Windows quelle
+    # ancora mappate non si cancellano, si riprova alla compilazione dopo
+    for path in [output, *output.parent.glob(f"{output.stem}.{'[0-9a-f]' * 16}{output.suffix}")]:
+        if path != keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def load_compiled(sources: list[Path], output: Path, bloom_fp_rate: float = BLOOM_FP_RATE) -> MappedDomainIndex:
+    path = index_version_path(output, ensure_compiled_version(sources, output, bloom_fp_rate))
+    index = MappedDomainIndex(path)
+    remove_stale_indexes(output, path)
+    return index
+
+
+def main():
+    # Import qui: dns.server importa questo modulo
+    from dns.server import BLOCKLIST_INDEX_PATH, blocklist_sources
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="*", type=Path, help="default: domains.json e config/lists/*.txt")
+    parser.add_argument("-o", "--output", type=Path, default=BLOCKLIST_INDEX_PATH)
+    parser.add_argument(
+        "--bloom-fp-rate", type=float, default=BLOOM_FP_RATE,
+        help="falsi positivi del filtro di Bloom (0 = nessun filtro)",
+    )
+    args = parser.parse_args()
+
+    sources = args.sources or blocklist_sources()
+    start = time.perf_counter()
+    count = compile_blocklist(sources, args.output, args.bloom_fp_rate)
+    elapsed = time.perf_counter() - start
+    print(f"[BLOCKLIST] {count} domini da {len(sources)} sorgenti -> {args.output} ({elapsed:.2f}s)")
+    stats = MappedDomainIndex(args.output).stats()
+    if stats["bloom_bytes"]:
+        print(
+            f"[BLOCKLIST] Filtro di Bloom: {stats['bloom_bytes'] / 1024:.0f} KB, "
+            f"{stats['bloom_hashes']} hash, falsi positivi attesi {stats['bloom_fp_rate']:.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
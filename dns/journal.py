@@ -0,0 +1,152 @@
+import json
+import os
+from pathlib import Path
+
+
+# =========================
+# FORMATO DEL JOURNAL
+# =========================
+
+# Modifiche a domains.json dopo l'ultimo snapshot, una per riga (JSON):
+#   {"op": "add", "key": "blocked_domains", "rule": "ads.example.com"}
+# Le righe vengono solo aggiunte (fsync a ogni modifica); la
+# compattazione (vedi config.domain_manager) rinomina il journal in
+# <nome>.old, lo riversa nello snapshot e poi lo cancella. Rigiocare
+# un journal già riversato non cambia il risultato: add/remove sono
+# operazioni su insiemi e vale l'ultima per ogni regola.
+OP_ADD = "add"
+OP_REMOVE = "remove"
+
+# Chiavi di domains.json (vedi config.domain_manager)
+BLOCKED_KEY = "blocked_domains"
+ALLOWED_KEY = "allowed_domains"
+
+
+def journal_path(snapshot: Path) -> Path:
+    return Path(snapshot).with_suffix(".journal")
+
+
+def rotated_path(journal: Path) -> Path:
+    return journal.with_name(journal.name + ".old")
+
+
+def append_entry(path: Path, op: str, key: str, rule: str):
+    """
+    Aggiunge una modifica al journal e la rende persistente (fsync)
+    prima di tornare.
+    """
+    line = json.dumps({"op": op, "key": key, "rule": rule}, ensure_ascii=False).encode() + b"\n"
+    with open(path, "ab") as f:
+        if f.tell():
+            # Riga finale troncata da un crash: la si chiude, il lettore la scarta
+            with open(path, "rb") as tail:
+                tail.seek(-1, os.SEEK_END)
+                if tail.read(1) != b"\n":
+                    line = b"\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def parse_entries(data: bytes, source: Path | str = "") -> list[tuple[str, str, str]]:
+    """
+    (op, chiave, regola) delle righe complete di `data`; le righe non
+    valide vengono saltate con un avviso.
+    """
+    entries = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            op, key, rule = entry["op"], entry["key"], entry["rule"]
+        except (ValueError, KeyError, TypeError):
+            print(f"[JOURNAL] Riga non valida in {source}: {line[:80]!r}")
+            continue
+        if op in (OP_ADD, OP_REMOVE):
+            entries.append((op, key, rule))
+    return entries
+
+
+def read_entries(path: Path, offset: int = 0) -> tuple[list[tuple[str, str, str]], int]:
+    """
+    Modifiche scritte da `offset` in poi e offset della fine dell'ultima
+    riga completa: una riga a metà (scrittura in corso) verrà letta al
+    giro successivo.
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    end = data.rfind(b"\n") + 1
+    return parse_entries(data[:end], path), offset + end
+
+
+def replay(entries, state: dict[str, set[str]]) -> dict[str, set[str]]:
+    for op, key, rule in entries:
+        rules = state.setdefault(key, set())
+        if op == OP_ADD:
+            rules.add(rule)
+        else:
+            rules.discard(rule)
+    return state
+
+
+# =========================
+# LETTURA INCREMENTALE
+# =========================
+
+def _identity(path: Path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_dev
+
+
+class JournalReader:
+    """
+    Segue il journal di uno snapshot per il resolver: read_new() ritorna
+    solo le righe aggiunte dall'ultima lettura, oppure None quando il
+    journal è stato ruotato o troncato dalla compattazione e va riletto
+    per intero (read_all(), journal ruotato compreso).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.rotated = rotated_path(self.path)
+        self._identity = None
+        self._rotated_identity = None
+        self._offset = 0
+
+    def read_all(self) -> list[tuple[str, str, str]]:
+        self._rotated_identity = _identity(self.rotated)
+        self._identity = _identity(self.path)
+        entries, _ = read_entries(self.rotated)
+        current, self._offset = read_entries(self.path)
+        return entries + current
+
+    def read_new(self) -> list[tuple[str, str, str]] | None:
+        if _identity(self.rotated) != self._rotated_identity:
+            return None
+        identity = _identity(self.path)
+        if identity != self._identity:
+            if self._identity is not None:
+                return None
+            # Journal creato dopo l'ultima lettura: è tutto nuovo
+            self._identity = identity
+            self._offset = 0
+        if identity is None:
+            return []
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        if size < self._offset:
+            return None
+        if size == self._offset:
+            return []
+        entries, self._offset = read_entries(self.path, self._offset)
+        return entries
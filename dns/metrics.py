@@ -0,0 +1,219 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dns.querylog import VERDICT_BLOCKED, VERDICT_CACHED, VERDICT_FAILED, VERDICT_FORWARDED
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Fasi di una query misurate da BlockResolver
+STAGE_PARSE = "parse"
+STAGE_NORMALIZE = "normalize"
+STAGE_MATCH = "match"
+STAGE_CACHE = "cache"
+STAGE_UPSTREAM = "upstream"
+STAGE_PACK = "pack"
+STAGES = (STAGE_PARSE, STAGE_NORMALIZE, STAGE_MATCH, STAGE_CACHE, STAGE_UPSTREAM, STAGE_PACK)
+
+# Limiti superiori dei bucket (secondi): da 1 µs a 10 s, 1-2.5-5 per decade
+LATENCY_BUCKETS = tuple(
+    m * 10.0 ** e for e in range(-6, 1) for m in (1.0, 2.5, 5.0)
+) + (10.0,)
+
+_VERDICTS = (VERDICT_BLOCKED, VERDICT_CACHED, VERDICT_FORWARDED, VERDICT_FAILED)
+
+
+# =========================
+# ISTOGRAMMI E CONTATORI
+# =========================
+
+class Histogram:
+    """
+    Istogramma a bucket fissi: observe() è una bisect e due somme,
+    senza lock (sotto il GIL al più si perde qualche incremento in
+    caso di corsa, come per gli altri contatori del resolver).
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        self.bounds = bounds
+        # Ultimo bucket: oltre il limite più alto (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Quantile stimato per interpolazione lineare nel bucket (come
+        histogram_quantile di Prometheus); None senza osservazioni.
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class ResolverMetrics:
+    """
+    Tempi per fase (istogrammi) e contatori del resolver: esiti delle
+    query e timeout per upstream. Il resolver li aggiorna solo se ha un
+    oggetto metriche: senza, ogni punto di misura costa un confronto
+    con None.
+    """
+
+    def __init__(self):
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.verdicts = dict.fromkeys(_VERDICTS, 0)
+        self.upstream_timeouts: dict[str, int] = {}
+        self.started = time.monotonic()
+        self._last_rate = (self.started, 0)
+
+    def observe(self, stage: str, seconds: float):
+        self.stages[stage].observe(seconds)
+
+    def count(self, verdict: str):
+        self.verdicts[verdict] += 1
+
+    def timeout(self, upstream: tuple):
+        key = f"{upstream[0]}:{upstream[1]}"
+        self.upstream_timeouts[key] = self.upstream_timeouts.get(key, 0) + 1
+
+    @property
+    def queries(self) -> int:
+        return sum(self.verdicts.values())
+
+    def stats(self) -> dict:
+        """
+        Riepilogo per controller/GUI: query al secondo dalla chiamata
+        precedente, esiti, timeout e per ogni fase media e quantili in µs.
+        """
+        now = time.monotonic()
+        queries = self.queries
+        last_at, last_queries = self._last_rate
+        self._last_rate = (now, queries)
+        elapsed = now - last_at
+        stages = {}
+        for stage, histogram in self.stages.items():
+            count = histogram.count
+            stages[stage] = {
+                "count": count,
+                "avg_us": histogram.sum / count * 1e6 if count else None,
+                "p50_us": _us(histogram.quantile(0.5)),
+                "p99_us": _us(histogram.quantile(0.99)),
+            }
+        return {
+            "queries": queries,
+            "qps": (queries - last_queries) / elapsed if elapsed > 0 else 0.0,
+            **self.verdicts,
+            "upstream_timeouts": dict(self.upstream_timeouts),
+            "stages": stages,
+        }
+
+    def prometheus(self) -> str:
+        """
+        Metriche nel formato testo di Prometheus (versione 0.0.4).
+        """
+        lines = [
+            "# HELP dns_blocker_queries_total Query risolte per esito.",
+            "# TYPE dns_blocker_queries_total counter",
+        ]
+        for verdict, count in self.verdicts.items():
+            lines.append(f'dns_blocker_queries_total{{verdict="{verdict}"}} {count}')
+        lines += [
+            "# HELP dns_blocker_upstream_timeouts_total Upstream che non hanno risposto in tempo.",
+            "# TYPE dns_blocker_upstream_timeouts_total counter",
+        ]
+        for upstream, count in sorted(self.upstream_timeouts.items()):
+            lines.append(f'dns_blocker_upstream_timeouts_total{{upstream="{upstream}"}} {count}')
+        lines += [
+            "# HELP dns_blocker_stage_duration_seconds Durata di ogni fase di una query.",
+            "# TYPE dns_blocker_stage_duration_seconds histogram",
+        ]
+        for stage, histogram in self.stages.items():
+            counts = list(histogram.counts)
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, counts):
+                cumulative += count
+                lines.append(
+                    f'dns_blocker_stage_duration_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}'
+                )
+            cumulative += counts[-1]
+            lines.append(f'dns_blocker_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'dns_blocker_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.sum:.9f}')
+            lines.append(f'dns_blocker_stage_duration_seconds_count{{stage="{stage}"}} {cumulative}')
+        lines += [
+            "# HELP dns_blocker_uptime_seconds Secondi dall'avvio del resolver.",
+            "# TYPE dns_blocker_uptime_seconds gauge",
+            f"dns_blocker_uptime_seconds {time.monotonic() - self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _us(seconds: float | None) -> float | None:
+    return seconds * 1e6 if seconds is not None else None
+
+
+# =========================
+# ENDPOINT HTTP
+# =========================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Nessun print per ogni scrape
+        pass
+
+
+class MetricsServer:
+    """
+    Endpoint /metrics per Prometheus, solo su localhost, in un thread
+    daemon. Stessa interfaccia start_thread()/stop() dei server DNS.
+    """
+
+    def __init__(self, metrics: ResolverMetrics, address: str = "127.0.0.1", port: int = 9153):
+        self.metrics = metrics
+        self.httpd = ThreadingHTTPServer((address, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    def start_thread(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
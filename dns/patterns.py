@@ -0,0 +1,178 @@
+import re
+from collections.abc import Iterable
+
+
+# =========================
+# SINTASSI REGOLE
+# =========================
+
+# Nelle voci di blocked_domains (come per i domini semplici, la regola
+# vale anche per tutti i sottodomini del nome che corrisponde):
+#   ads*.example.com   "*" dentro una label: qualsiasi carattere tranne "."
+#   *.tracking.*       "*" come label intera: esattamente una label
+#   **.cdn.example     "**" come label: una o più label
+#   re:^ad[0-9]+\.     regex Python applicata al nome intero (re.search)
+# Nelle liste importate "@@nome" è un'eccezione (come nelle liste
+# adblock); in domains.json le eccezioni stanno in allowed_domains
+REGEX_PREFIX = "re:"
+ALLOW_PREFIX = "@@"
+
+_ONE_LABEL = "[^.]+"
+_ANY_IN_LABEL = "[^.]*"
+_MANY_LABELS = r"[^.]+(?:\.[^.]+)*"
+# Fine regola: il nome finisce qui oppure continua con un sottodominio
+_END = r"(?:\.|$)"
+
+# Flag globali all'inizio di una regex re: ((?i), (?s)...): nell'alternanza
+# diventano flag locali del gruppo della regola
+_GLOBAL_FLAGS = re.compile(r"(?:\(\?([aiLmsux]+)\))+")
+# Costrutti che valgono solo nella regex intera: gruppi con nome (due
+# regole con lo stesso nome non si possono unire), riferimenti
+# all'indietro e condizioni sui gruppi (i numeri cambiano nell'alternanza)
+_UNCOMBINABLE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P[<=]|\(\?\()")
+
+
+def is_pattern(rule: str) -> bool:
+    return rule.startswith(REGEX_PREFIX) or "*" in rule
+
+
+def regex_rule(expr: str) -> str:
+    """
+    Regex di una regola re: (senza prefisso) pronta per l'alternanza del
+    PatternMatcher. ValueError se non è valida o usa costrutti che non
+    si possono combinare con le altre regole.
+    """
+    flags = _GLOBAL_FLAGS.match(expr)
+    if flags:
+        letters = "".join(dict.fromkeys(re.findall(r"[aiLmsux]", flags.group(0))))
+        body = expr[flags.end():]
+        if "x" in letters:
+            # In modo verbose un commento finale coprirebbe la ")" del gruppo
+            body += "\n"
+        expr = f"(?{letters}:{body})"
+    if _UNCOMBINABLE.search(expr):
+        raise ValueError("gruppi con nome e riferimenti all'indietro non supportati")
+    try:
+        re.compile(f"(?:{expr})")
+    except re.error as e:
+        raise ValueError(f"regex non valida: {e}") from None
+    return f"(?:{expr})"
+
+
+def _tokens(rule: str) -> list[str]:
+    """
+    Regola wildcard -> token regex sulle label in ordine inverso
+    (com, example, ads*): il nome viene confrontato dal TLD in giù.
+    """
+    tokens = []
+    for i, label in enumerate(reversed(rule.split("."))):
+        if i:
+            tokens.append(r"\.")
+        if label == "**":
+            tokens.append(_MANY_LABELS)
+        elif label == "*":
+            tokens.append(_ONE_LABEL)
+        else:
+            tokens.extend(_ANY_IN_LABEL if ch == "*" else re.escape(ch) for ch in label)
+    return tokens
+
+
+def _trie_regex(node: dict) -> str:
+    """
+    Regex di un nodo del trie dei token: le regole con lo stesso
+    suffisso ne condividono il prefisso, quindi ogni alternativa
+    diverge al primo carattere e il costo non cresce con il numero
+    di regole.
+    """
+    alternatives = []
+    if None in node:
+        alternatives.append(_END)
+    for token in sorted(t for t in node if t is not None):
+        alternatives.append(token + _trie_regex(node[token]))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:" + "|".join(alternatives) + ")"
+
+
+# =========================
+# MATCHER COMBINATO
+# =========================
+
+class PatternMatcher:
+    """
+    Tutte le regole a pattern compilate insieme, una volta per ricarica:
+    - wildcard: un'unica regex a trie sul nome con label invertite
+    - regex (re:): un'unica alternanza applicata al nome
+    Costo per query: al massimo due match di regex, non uno per regola.
+    Le wildcard si fattorizzano nel trie; le regex re: no, quindi
+    conviene usarle con parsimonia. Una regex valida che non si può
+    unire alle altre (indice compilato da una versione precedente) viene
+    applicata da sola: una regola non disattiva mai l'intera lista.
+    """
+
+    __slots__ = ("rules", "invalid", "_wildcard", "_regex", "_separate")
+
+    def __init__(self, rules: Iterable[str]):
+        trie: dict = {}
+        regexes = []
+        self._separate = []
+        self.rules = 0
+        self.invalid = []
+        for rule in rules:
+            if rule.startswith(REGEX_PREFIX):
+                expr = rule[len(REGEX_PREFIX):]
+                try:
+                    regexes.append(regex_rule(expr))
+                except ValueError:
+                    try:
+                        self._separate.append(re.compile(expr))
+                    except re.error as e:
+                        self.invalid.append((rule, str(e)))
+                        continue
+            else:
+                node = trie
+                for token in _tokens(rule):
+                    node = node.setdefault(token, {})
+                node[None] = {}
+            self.rules += 1
+
+        self._wildcard = re.compile(_trie_regex(trie)) if trie else None
+        self._regex = None
+        if regexes:
+            try:
+                self._regex = re.compile("|".join(regexes))
+            except re.error:
+                # Ogni regola compila da sola (regex_rule): si rinuncia all'alternanza
+                self._separate.extend(re.compile(expr) for expr in regexes)
+
+    def __len__(self) -> int:
+        return self.rules
+
+    def match(self, domain: str) -> str | None:
+        """
+        Parte del nome coperta da una regola (il nome stesso o un suo
+        dominio padre), None se nessuna regola corrisponde.
+        """
+        matched = self.match_wildcard(domain)
+        if matched is not None:
+            return matched
+        return domain if self.match_regex(domain) else None
+
+    def match_wildcard(self, domain: str) -> str | None:
+        # Suffisso del nome coperto da una wildcard
+        if self._wildcard is None:
+            return None
+        labels = domain.split(".")
+        labels.reverse()
+        m = self._wildcard.match(".".join(labels))
+        if m is None:
+            return None
+        matched = m.group(0).rstrip(".").split(".")
+        matched.reverse()
+        return ".".join(matched)
+
+    def match_regex(self, domain: str) -> bool:
+        # Una regex re: copre il nome intero, non un suffisso
+        if self._regex is not None and self._regex.search(domain):
+            return True
+        return any(regex.search(domain) for regex in self._separate)
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Record in attesa di scrittura: oltre, i nuovi vengono scartati e contati
+QUERY_LOG_QUEUE_SIZE = 10000
+# Ogni quanto il thread di scrittura svuota la coda (secondi)
+QUERY_LOG_FLUSH_INTERVAL = 0.5
+# Rotazione: dimensione massima del file e numero di file precedenti tenuti
+QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+QUERY_LOG_BACKUPS = 3
+
+# Esito di una query
+VERDICT_BLOCKED = "blocked"
+VERDICT_CACHED = "cached"
+VERDICT_FORWARDED = "forwarded"
+VERDICT_FAILED = "failed"
+# Un upstream non ha risposto (la query può essere andata a buon fine su un altro)
+VERDICT_TIMEOUT = "timeout"
+
+# Stringa JSON tra virgolette (versione in C del modulo json)
+_quote = json.encoder.encode_basestring
+
+
+# =========================
+# LOG DELLE QUERY
+# =========================
+
+class QueryLog:
+    """
+    Log strutturato delle query, al posto dei print() sul thread della
+    richiesta: record() mette una tupla in una deque (append atomico,
+    nessun lock) e un thread in background la svuota a blocchi in un
+    file JSON lines con rotazione (<nome>, <nome>.1, ...).
+    Se la coda è piena il record viene scartato e contato: la
+    risoluzione non aspetta mai il disco.
+    Con `echo` i blocchi e i timeout vengono anche stampati, dal thread
+    di scrittura.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_queue: int = QUERY_LOG_QUEUE_SIZE,
+        flush_interval: float = QUERY_LOG_FLUSH_INTERVAL,
+        max_bytes: int = QUERY_LOG_MAX_BYTES,
+        backups: int = QUERY_LOG_BACKUPS,
+        echo: bool = False,
+    ):
+        self.path = Path(path)
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.echo = echo
+        self._queue: deque = deque(maxlen=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self._file = None
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._thread.start()
+
+    def record(
+        self,
+        client,
+        qname: str,
+        qtype: int,
+        verdict: str,
+        upstream=None,
+        latency: float | None = None,
+    ):
+        """
+        Hot path: solo append in coda; la formattazione avviene nel
+        thread di scrittura. `client`/`upstream` sono indirizzi (ip,
+        porta) o None, `latency` in secondi.
+        """
+        queue = self._queue
+        if len(queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        queue.append((time.time(), client, qname, qtype, verdict, upstream, latency))
+
+    # ---------- scrittura ----------
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """
+        Scrive tutto ciò che è in coda (un blocco per chiamata). Chiamata
+        dal thread di scrittura; sicura anche da altri thread.
+        """
+        queue = self._queue
+        records = []
+        try:
+            while True:
+                records.append(queue.popleft())
+        except IndexError:
+            pass
+        if not records:
+            return
+        lines = []
+        for ts, client, qname, qtype, verdict, upstream, latency in records:
+            # Formattazione a mano: json.dumps di un dict costa il triplo
+            lines.append(
+                f'{{"ts":{ts:.3f},'
+                f'"client":{_quote(client[0]) if client else "null"},'
+                f'"qname":{_quote(qname) if qname is not None else "null"},'
+                f'"qtype":{qtype if qtype is not None else "null"},'
+                f'"verdict":"{verdict}",'
+                f'"upstream":{_quote(f"{upstream[0]}:{upstream[1]}") if upstream else "null"},'
+                f'"latency_ms":{round(latency * 1000, 2) if latency is not None else "null"}}}'
+            )
+            if self.echo and verdict == VERDICT_BLOCKED:
+                print(f"[BLOCCATO] {qname}")
+            elif self.echo and verdict == VERDICT_TIMEOUT:
+                print(f"[TIMEOUT] DNS upstream {upstream[0]} non risponde")
+        data = ("\n".join(lines) + "\n").encode()
+        try:
+            with self._write_lock:
+                self._write(data)
+        except OSError as e:
+            self.write_errors += 1
+            self.dropped += len(records)
+            print(f"[QUERYLOG] Scrittura fallita, {len(records)} record persi: {e}")
+            return
+        self.written += len(records)
+        self.batches += 1
+
+    def _write(self, data: bytes):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "ab")
+        if self.max_bytes and self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                older = self.path.with_name(f"{self.path.name}.{i}")
+                if older.exists():
+                    os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            os.unlink(self.path)
+        self._file = open(self.path, "ab")
+
+    # ---------- ciclo di vita ----------
+
+    def close(self):
+        # Svuota la coda prima di chiudere il file
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+        }
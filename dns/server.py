@@ -1,11 +1,31 @@
 import json
 import socket
-import threading
+import struct
+import time
 from pathlib import Path
 
-from dnslib import DNSRecord, QTYPE, RR, A, AAAA
-from dnslib.server import DNSServer, BaseResolver
+from dnslib import DNSRecord, DNSError, QTYPE, RR, A, AAAA
+from dnslib.server import DNSServer, DNSHandler, DNSLogger, BaseResolver, TCPServer, UDPServer
 
+from dns.aio_server import TCP_IDLE_TIMEOUT, AsyncDNSServer
+from dns.blocklist import BlocklistHolder, DomainIndex, JournalOverlay, MappedDomainIndex, match_suffix
+from dns.cache import DNSCache
+from dns.compiler import load_compiled, sources_digest
+from dns.journal import JournalReader, journal_path
+from dns.metrics import (
+    STAGE_CACHE,
+    STAGE_MATCH,
+    STAGE_NORMALIZE,
+    STAGE_PACK,
+    STAGE_PARSE,
+    STAGE_UPSTREAM,
+    ResolverMetrics,
+)
+from dns.querylog import VERDICT_BLOCKED, VERDICT_CACHED, VERDICT_FAILED, VERDICT_FORWARDED, QueryLog
+from dns.tracing import QueryTrace, SlowQueryTracer
+from dns.upstream import InflightQueries, UpstreamPool, recv_exact
+from dns.wire import empty_reply, fit_udp, parse_query, reuse_reply, sinkhole_reply, udp_payload_size
+from dns.workers import WorkerSupervisor
 from system.network import load_dns_state
 
 
@@ -15,8 +35,44 @@ from system.network import load_dns_state
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 CONFIG_PATH = BASE_DIR / "config" / "domains.json"
+# Liste importate, un dominio per riga (*.txt)
+IMPORTED_LISTS_DIR = BASE_DIR / "config" / "lists"
+# Indice compilato di domains.json + liste importate (file mappato)
+BLOCKLIST_INDEX_PATH = BASE_DIR / "config" / "domains.idx"
 
+# Tempo massimo totale per una query upstream (non per singolo upstream)
 DNS_TIMEOUT = 3
+# Ritardo prima di interrogare in parallelo l'upstream successivo
+# (0 = tutti insieme)
+UPSTREAM_STAGGER = 0.2
+
+# Indirizzi di ascolto: IPv4 e IPv6 (il sistema usa anche ::1 come DNS)
+LISTEN_ADDRESSES = ("0.0.0.0", "::")
+
+# Motore server: "threaded" (dnslib, un thread per richiesta)
+# oppure "asyncio" (un solo loop per UDP e TCP)
+DNS_ENGINE = "threaded"
+
+# Log delle query (JSON lines con rotazione, vedi dns.querylog);
+# con più worker ogni processo scrive queries-<n>.jsonl
+QUERY_LOG_PATH = BASE_DIR / "logs" / "queries.jsonl"
+# Stampa anche blocchi e timeout su console (dal thread del log)
+QUERY_LOG_ECHO = False
+
+# Tempi per fase e contatori del resolver (vedi dns.metrics), esposti
+# in formato Prometheus su http://127.0.0.1:METRICS_PORT/metrics; solo
+# con un processo (DNS_WORKERS = 1). Disattivate non costano nulla.
+METRICS_ENABLED = False
+METRICS_PORT = 9153
+
+# Tracce delle query lente campionate (soglia e frequenza in
+# dns.tracing), salvabili dalla GUI in SLOW_QUERY_DUMP_DIR
+SLOW_QUERY_TRACING = True
+SLOW_QUERY_DUMP_DIR = BASE_DIR / "logs"
+
+# Processi worker sulla stessa porta con SO_REUSEPORT (solo Linux/BSD):
+# 1 = tutto nel processo corrente
+DNS_WORKERS = 1
 
 LOCAL_SUFFIXES = [
     "homenet.telecomitalia.it",
@@ -29,14 +85,27 @@ LOCAL_SUFFIXES = [
 # UTILS DOMINI BLOCCATI
 # =========================
 
-def load_blocked_domains() -> set[str]:
-    if not CONFIG_PATH.exists():
+def load_blocked_domains(path: Path | None = None) -> set[str]:
+    path = path or CONFIG_PATH
+    if not path.exists():
         return set()
-    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         data = json.load(f)
     return {d.lower().rstrip(".") for d in data.get("blocked_domains", [])}
 
 
+def blocklist_sources() -> list[Path]:
+    sources = [CONFIG_PATH]
+    if IMPORTED_LISTS_DIR.is_dir():
+        sources.extend(sorted(IMPORTED_LISTS_DIR.glob("*.txt")))
+    return sources
+
+
+def load_compiled_blocklist() -> MappedDomainIndex:
+    # Ricompila solo se domains.json o le liste importate sono cambiati
+    return load_compiled(blocklist_sources(), BLOCKLIST_INDEX_PATH)
+
+
 def normalize_domain(qname: str) -> str:
     domain = qname.rstrip(".").lower()
     for suffix in LOCAL_SUFFIXES:
@@ -46,11 +115,15 @@ def normalize_domain(qname: str) -> str:
     return domain
 
 
-def is_blocked(domain: str, blocked_domains: set[str]) -> bool:
-    for blocked in blocked_domains:
-        if domain == blocked or domain.endswith("." + blocked):
-            return True
-    return False
+def is_blocked(
+    domain: str,
+    blocked_domains: set[str] | DomainIndex | MappedDomainIndex | JournalOverlay,
+) -> bool:
+    # Lookup per suffisso (a.b.c -> a.b.c, b.c, c): O(label), non O(lista)
+    if isinstance(blocked_domains, (set, frozenset)):
+        return match_suffix(domain, blocked_domains) is not None
+    # Gli indici applicano anche le regole a pattern
+    return blocked_domains.is_blocked(domain)
 
 
 # =========================
@@ -58,7 +131,41 @@ def is_blocked(domain: str, blocked_domains: set[str]) -> bool:
 # =========================
 
 class BlockResolver(BaseResolver):
-    def __init__(self):
+    def __init__(
+        self,
+        blocklist: BlocklistHolder | None = None,
+        cache: DNSCache | None = None,
+        deadline: float = DNS_TIMEOUT,
+        stagger: float = UPSTREAM_STAGGER,
+        query_log: QueryLog | None = None,
+        metrics: ResolverMetrics | None = None,
+        tracer: SlowQueryTracer | None = None,
+    ):
+        # Lista bloccati compilata e mappata, ricaricata solo se le sorgenti
+        # cambiano; le modifiche dal journal si applicano senza ricaricarla
+        self.blocklist = blocklist or BlocklistHolder(
+            BLOCKLIST_INDEX_PATH,
+            load_compiled_blocklist,
+            signature=lambda: sources_digest(blocklist_sources()),
+            journal=JournalReader(journal_path(CONFIG_PATH)),
+        )
+        # Cache risposte upstream (TTL-aware, LRU)
+        self.cache = cache or DNSCache()
+        self.deadline = deadline
+        self.stagger = stagger
+        # Socket upstream persistenti, condivisi tra i thread
+        self.upstreams = UpstreamPool()
+        # Query identiche concorrenti condividono un'unica richiesta upstream
+        self.inflight = InflightQueries()
+        # Log delle query in background; None = blocchi e timeout stampati
+        self.query_log = query_log
+        self.upstreams.query_log = query_log
+        # Tempi per fase e contatori; None = nessuna misura
+        self.metrics = metrics
+        self.upstreams.metrics = metrics
+        # Tracce delle query lente; None = nessun campionamento
+        self.tracer = tracer
+
         # Legge dinamicamente DNS upstream dalla rete attiva
         state = load_dns_state()
         dns_v4 = None
@@ -70,51 +177,452 @@ class BlockResolver(BaseResolver):
             self.upstream_dns_list = [("8.8.8.8", 53)]  # fallback
 
     def resolve(self, request: DNSRecord, handler):
+        client = getattr(handler, "client_address", None)
+        tracer = self.tracer
+        trace = tracer.start(str(request.q.qname), request.q.qtype, client) if tracer is not None else None
+        reply = self.blocked_reply(request, client, trace)
+        if reply is None:
+            # FORWARD DINAMICO
+            reply = self.forward_request(request, client, trace)
+        if trace is not None:
+            tracer.finish(trace)
+        return reply
+
+    def log_query(
+        self,
+        client,
+        key: tuple,
+        verdict: str,
+        upstream=None,
+        start: float | None = None,
+        trace: QueryTrace | None = None,
+    ):
+        if self.metrics is not None:
+            self.metrics.count(verdict)
+        if trace is not None:
+            trace.verdict = verdict
+        log = self.query_log
+        if log is not None:
+            latency = time.monotonic() - start if start is not None else None
+            log.record(client, key[0], key[1], verdict, upstream, latency)
+
+    def _log_blocked(self, client, domain: str, qtype: int, trace: QueryTrace | None = None):
+        if self.metrics is not None:
+            self.metrics.count(VERDICT_BLOCKED)
+        if trace is not None:
+            trace.verdict = VERDICT_BLOCKED
+        if self.query_log is not None:
+            self.query_log.record(client, domain, qtype, VERDICT_BLOCKED)
+        else:
+            print(f"[BLOCCATO] {domain}")
+
+    def handle_packet(self, data: bytes, client=None) -> bytes | None:
+        """
+        Percorso principale sui byte: blocco (sinkhole), cache e relay
+        upstream, senza parse/pack dnslib. None se il pacchetto non è una
+        query semplice: in quel caso lo gestisce resolve().
+        """
+        metrics = self.metrics
+        if metrics is None:
+            query = parse_query(data)
+        else:
+            t0 = time.perf_counter()
+            query = parse_query(data)
+            metrics.observe(STAGE_PARSE, time.perf_counter() - t0)
+        if query is None:
+            return None
+        qname, qtype, qclass, qend = query
+        tracer = self.tracer
+        trace = tracer.start(qname, qtype, client) if tracer is not None else None
+        rdata = self.blocked_wire_reply(data, query, client, trace)
+        if rdata is None:
+            rdata = self.relay(data, (qname, qtype, qclass), client, trace)
+            if rdata is None:
+                # fallback: risposta vuota
+                rdata = empty_reply(data, qend)
+        if trace is not None:
+            tracer.finish(trace)
+        return rdata
+
+    def blocked_wire_reply(
+        self,
+        data: bytes,
+        query: tuple,
+        client=None,
+        trace: QueryTrace | None = None,
+    ) -> bytes | None:
+        """
+        Risposta sinkhole costruita sui byte della query se il dominio è
+        bloccato, None altrimenti. `query` è il risultato di parse_query().
+        """
+        if self.metrics is not None:
+            return self._timed_blocked_wire_reply(self.metrics, data, query, client, trace)
+        qname, qtype, _, qend = query
+        domain = normalize_domain(qname)
+        blocked = is_blocked(domain, self.blocklist.get())
+        if trace is not None:
+            self._trace_match(trace, domain)
+        if not blocked:
+            return None
+        self._log_blocked(client, domain, qtype, trace)
+        return sinkhole_reply(data, qend, qtype)
+
+    def _timed_blocked_wire_reply(
+        self,
+        metrics: ResolverMetrics,
+        data: bytes,
+        query: tuple,
+        client=None,
+        trace: QueryTrace | None = None,
+    ) -> bytes | None:
+        # Come blocked_wire_reply(), con i tempi di ogni fase
+        qname, qtype, _, qend = query
+        t0 = time.perf_counter()
+        domain = normalize_domain(qname)
+        t1 = time.perf_counter()
+        blocked = is_blocked(domain, self.blocklist.get())
+        t2 = time.perf_counter()
+        metrics.observe(STAGE_NORMALIZE, t1 - t0)
+        metrics.observe(STAGE_MATCH, t2 - t1)
+        if trace is not None:
+            self._trace_match(trace, domain)
+        if not blocked:
+            return None
+        self._log_blocked(client, domain, qtype, trace)
+        t0 = time.perf_counter()
+        rdata = sinkhole_reply(data, qend, qtype)
+        metrics.observe(STAGE_PACK, time.perf_counter() - t0)
+        return rdata
+
+    def _trace_match(self, trace: QueryTrace, domain: str):
+        # Regola che ha deciso (solo per le query tracciate: costa un'altra ricerca)
+        index = self.blocklist.get()
+        if isinstance(index, (set, frozenset)):
+            rule = match_suffix(domain, index)
+        else:
+            rule = index.match(domain)
+        trace.record_match(domain, rule)
+
+    def blocked_reply(self, request: DNSRecord, client=None, trace: QueryTrace | None = None) -> DNSRecord | None:
+        """
+        Risposta sinkhole se il dominio è bloccato, None altrimenti.
+        """
         qname_raw = str(request.q.qname)
         qtype = QTYPE[request.q.qtype]
 
         domain = normalize_domain(qname_raw)
-        blocked_domains = load_blocked_domains()
+        blocked_domains = self.blocklist.get()
 
-        reply = request.reply()
+        blocked = is_blocked(domain, blocked_domains)
+        if trace is not None:
+            self._trace_match(trace, domain)
+        if not blocked:
+            return None
 
         # BLOCCO DOMINIO
-        if is_blocked(domain, blocked_domains):
-            print(f"[BLOCCATO] {domain}")
-            if qtype == "A":
-                reply.add_answer(
-                    RR(rname=request.q.qname, rtype=QTYPE.A, rclass=1, ttl=60, rdata=A("0.0.0.0"))
-                )
-            elif qtype == "AAAA":
-                reply.add_answer(
-                    RR(rname=request.q.qname, rtype=QTYPE.AAAA, rclass=1, ttl=60, rdata=AAAA("::"))
-                )
-            return reply
+        self._log_blocked(client, domain, request.q.qtype, trace)
+        reply = request.reply()
+        if qtype == "A":
+            reply.add_answer(
+                RR(rname=request.q.qname, rtype=QTYPE.A, rclass=1, ttl=60, rdata=A("0.0.0.0"))
+            )
+        elif qtype == "AAAA":
+            reply.add_answer(
+                RR(rname=request.q.qname, rtype=QTYPE.AAAA, rclass=1, ttl=60, rdata=AAAA("::"))
+            )
+        return reply
+
+    def forward_request(self, request: DNSRecord, client=None, trace: QueryTrace | None = None) -> DNSRecord:
+        rdata = self.relay(request.pack(), self.cache.key(request), client, trace)
+        if rdata is None:
+            # fallback: risposta vuota
+            return request.reply()
+        return DNSRecord.parse(rdata)
 
-        # FORWARD DINAMICO
-        return self.forward_request(request)
+    def relay(self, packet: bytes, key: tuple, client=None, trace: QueryTrace | None = None) -> bytes | None:
+        """
+        Inoltra i byte della query così come sono e ritorna quelli
+        dell'upstream cambiando solo l'ID. La risposta viene letta (in
+        modo parziale, sui byte) solo per calcolarne il TTL di cache.
+        """
+        start = time.monotonic()
+        cached = self.cached_wire_reply(packet, key, client, start, trace)
+        if cached is not None:
+            return cached
 
-    def forward_request(self, request: DNSRecord) -> DNSRecord:
-        for upstream in self.upstream_dns_list:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(DNS_TIMEOUT)
+        t0 = time.perf_counter()
+        flight, leader = self.inflight.join(key)
+        if not leader:
+            data = flight.data if flight.event.wait(self.deadline) else None
+            return self.coalesced_reply(packet, key, data, client, start, t0, trace)
+
+        data = upstream = None
+        try:
             try:
-                sock.sendto(request.pack(), upstream)
-                data, _ = sock.recvfrom(4096)
-                return DNSRecord.parse(data)
-            except socket.timeout:
-                print(f"[TIMEOUT] DNS upstream {upstream[0]} non risponde")
-            finally:
-                sock.close()
-        # fallback: risposta vuota
-        return request.reply()
-
-
-def start_dns_server(address="0.0.0.0", port=53):
-    resolver = BlockResolver()
-    server = DNSServer(resolver, port=port, address=address, tcp=False)
-    print(f"[DNS] Blocker attivo su {address}:{port}")
-    t = threading.Thread(target=server.start_thread)
-    t.daemon = True
-    t.start()
+                data, upstream = self.upstreams.query_with_winner(
+                    packet, self.upstream_dns_list, self.deadline, self.stagger, trace
+                )
+            except OSError as e:
+                self.report_upstream_error(key, e)
+            self.store_reply(key, data)
+        finally:
+            self.inflight.finish(key, flight, data)
+        return self.upstream_reply(key, data, upstream, client, start, t0, trace)
+
+    # Passi di relay() condivisi con dns.aio_server: i due motori
+    # differiscono solo nell'attesa (evento o future)
+
+    def cached_wire_reply(
+        self,
+        packet: bytes,
+        key: tuple,
+        client=None,
+        start: float | None = None,
+        trace: QueryTrace | None = None,
+    ) -> bytes | None:
+        # Risposta in cache adattata alla query del client, None se assente
+        metrics = self.metrics
+        if metrics is None:
+            cached = self.cache.get_wire(key, packet)
+        else:
+            t0 = time.perf_counter()
+            cached = self.cache.get_wire(key, packet)
+            metrics.observe(STAGE_CACHE, time.perf_counter() - t0)
+        if trace is not None:
+            trace.record_cache(cached is not None)
+        if cached is not None:
+            self.log_query(client, key, VERDICT_CACHED, None, start, trace)
+        return cached
+
+    def coalesced_reply(
+        self,
+        packet: bytes,
+        key: tuple,
+        data: bytes | None,
+        client,
+        start: float,
+        waited_since: float,
+        trace: QueryTrace | None = None,
+    ) -> bytes | None:
+        # Query che ha atteso quella identica in volo: `data` è la sua
+        # risposta, None se è fallita o l'attesa è scaduta
+        elapsed = time.perf_counter() - waited_since
+        if self.metrics is not None:
+            self.metrics.observe(STAGE_UPSTREAM, elapsed)
+        if trace is not None:
+            trace.record_wait(elapsed)
+        if data is None:
+            self.log_query(client, key, VERDICT_FAILED, None, start, trace)
+            return None
+        self.log_query(client, key, VERDICT_FORWARDED, None, start, trace)
+        return reuse_reply(packet, data)
+
+    def store_reply(self, key: tuple, data: bytes | None):
+        # Prima di chiudere il flight: una query identica che arriva dopo
+        # la trova in cache
+        if data is not None:
+            self.cache.put_wire(key, data)
+
+    def upstream_reply(
+        self,
+        key: tuple,
+        data: bytes | None,
+        upstream,
+        client,
+        start: float,
+        sent_since: float,
+        trace: QueryTrace | None = None,
+    ) -> bytes | None:
+        if self.metrics is not None:
+            self.metrics.observe(STAGE_UPSTREAM, time.perf_counter() - sent_since)
+        self.log_query(client, key, VERDICT_FAILED if data is None else VERDICT_FORWARDED, upstream, start, trace)
+        return data
+
+    def report_upstream_error(self, key: tuple, error: OSError):
+        # es. rete dell'upstream irraggiungibile: trattato come un timeout
+        print(f"[UPSTREAM] Inoltro di {key[0]} fallito: {error}")
+
+    def query_upstreams(self, packet: bytes) -> bytes | None:
+        """
+        Invia la query all'upstream più veloce e, se non risponde entro
+        il suo timeout adattivo (al massimo `stagger` secondi), anche al
+        successivo, tenendo la prima risposta valida. Il tempo totale è
+        limitato da `deadline`, non da N x timeout.
+        """
+        return self.upstreams.query(packet, self.upstream_dns_list, self.deadline, self.stagger)
+
+    def close(self):
+        self.upstreams.close()
+        if self.query_log is not None:
+            self.query_log.close()
+
+
+class BlockHandler(DNSHandler):
+    def handle(self):
+        if self.server.socket_type != socket.SOCK_STREAM:
+            return super().handle()
+
+        # TCP: più query sulla stessa connessione (RFC 7766), chiusa
+        # dopo TCP_IDLE_TIMEOUT secondi di inattività
+        self.protocol = "tcp"
+        self.request.settimeout(TCP_IDLE_TIMEOUT)
+        try:
+            while True:
+                header = recv_exact(self.request, 2)
+                if header is None:
+                    break
+                data = recv_exact(self.request, struct.unpack("!H", header)[0])
+                if data is None:
+                    break
+                self.server.logger.log_recv(self, data)
+                rdata = self.get_reply(data)
+                self.server.logger.log_send(self, rdata)
+                self.request.sendall(struct.pack("!H", len(rdata)) + rdata)
+        except DNSError as e:
+            self.server.logger.log_error(self, e)
+        except OSError:
+            # timeout di inattività o client disconnesso
+            pass
+
+    def get_reply(self, data):
+        # Percorso sui byte; dnslib solo per pacchetti insoliti
+        rdata = self.server.resolver.handle_packet(data, self.client_address)
+        if rdata is None:
+            rdata = super().get_reply(data)
+        if self.protocol == "udp":
+            rdata = fit_udp(rdata, udp_payload_size(data))
+        return rdata
+
+
+class _V6OnlyMixin:
+    # Socket IPv6 solo IPv6: convive con il listener IPv4 sulla stessa porta
+    def server_bind(self):
+        if self.address_family == socket.AF_INET6:
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+        super().server_bind()
+
+
+class BlockerUDPServer(_V6OnlyMixin, UDPServer):
+    pass
+
+
+class BlockerTCPServer(_V6OnlyMixin, TCPServer):
+    # Le connessioni restano aperte tra una query e l'altra:
+    # server_close() non deve aspettarle
+    daemon_threads = True
+
+
+# SO_REUSEPORT: più processi sulla stessa porta (vedi dns.workers)
+class ReusePortUDPServer(BlockerUDPServer):
+    allow_reuse_port = True
+
+
+class ReusePortTCPServer(BlockerTCPServer):
+    allow_reuse_port = True
+
+
+class BlockerDNSServer(DNSServer):
+    def __init__(self, resolver, tcp=False, reuse_port=False, **kwargs):
+        kwargs.setdefault("handler", BlockHandler)
+        # Le query finiscono nel log del resolver: dnslib stampa solo gli errori
+        kwargs.setdefault("logger", DNSLogger("error", prefix=False))
+        if reuse_port:
+            kwargs.setdefault("server", ReusePortTCPServer if tcp else ReusePortUDPServer)
+        else:
+            kwargs.setdefault("server", BlockerTCPServer if tcp else BlockerUDPServer)
+        super().__init__(resolver, tcp=tcp, **kwargs)
+
+    def stop(self):
+        super().stop()
+        self.server.server_close()
+
+
+class DNSServerGroup:
+    """
+    Tutti i listener (IPv4/IPv6, UDP/TCP) gestiti come un solo server:
+    un unico resolver, e quindi lista bloccati e cache, dietro a tutti
+    i socket. Se IPv6 non è disponibile si prosegue con il solo IPv4.
+    """
+
+    def __init__(self, resolver, addresses=LISTEN_ADDRESSES, port=53, tcp=True, reuse_port=False):
+        self.resolver = resolver
+        self.servers: list[BlockerDNSServer] = []
+        for address in addresses:
+            for use_tcp in (False, True) if tcp else (False,):
+                try:
+                    server = BlockerDNSServer(
+                        resolver, address=address, port=port, tcp=use_tcp, reuse_port=reuse_port
+                    )
+                except OSError as e:
+                    if ":" in address and self.servers:
+                        print(f"[DNS] Listener {address} ({'tcp' if use_tcp else 'udp'}) non disponibile: {e}")
+                        continue
+                    for started in self.servers:
+                        started.server.server_close()
+                    raise
+                self.servers.append(server)
+                # Con port=0 tutti i listener usano la porta scelta dal primo
+                port = server.server.server_address[1]
+        self.port = port
+
+    def start_thread(self):
+        for server in self.servers:
+            server.start_thread()
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+        self.resolver.close()
+
+    def isAlive(self):
+        return any(server.isAlive() for server in self.servers)
+
+
+def build_dns_server(resolver, addresses, port=53, engine=DNS_ENGINE, reuse_port=False):
+    if engine == "asyncio":
+        return AsyncDNSServer(resolver, addresses=addresses, port=port, reuse_port=reuse_port)
+    if engine == "threaded":
+        return DNSServerGroup(resolver, addresses=addresses, port=port, reuse_port=reuse_port)
+    raise ValueError(f"Motore DNS sconosciuto: {engine}")
+
+
+def start_dns_server(
+    address=LISTEN_ADDRESSES,
+    port=53,
+    engine=DNS_ENGINE,
+    resolver=None,
+    workers=DNS_WORKERS,
+):
+    addresses = [address] if isinstance(address, str) else list(address)
+    if engine not in ("asyncio", "threaded"):
+        raise ValueError(f"Motore DNS sconosciuto: {engine}")
+
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("[DNS] SO_REUSEPORT non disponibile: avvio in un solo processo")
+        workers = 1
+    if workers > 1:
+        # I worker hanno ciascuno il proprio resolver: da quello passato
+        # si prendono solo gli upstream
+        server = WorkerSupervisor(
+            workers,
+            addresses,
+            port,
+            engine=engine,
+            sources=blocklist_sources,
+            index_path=BLOCKLIST_INDEX_PATH,
+            journal=journal_path(CONFIG_PATH),
+            query_log=QUERY_LOG_PATH,
+            upstreams=resolver.upstream_dns_list if resolver else None,
+        )
+        engine = f"{engine}, {workers} processi"
+    else:
+        if resolver is None:
+            resolver = BlockResolver(
+                query_log=QueryLog(QUERY_LOG_PATH, echo=QUERY_LOG_ECHO),
+                metrics=ResolverMetrics() if METRICS_ENABLED else None,
+                tracer=SlowQueryTracer() if SLOW_QUERY_TRACING else None,
+            )
+        server = build_dns_server(resolver, addresses, port, engine)
+    server.start_thread()
+    print(f"[DNS] Blocker attivo su {', '.join(addresses)} porta {server.port} ({engine})")
     return server
@@ -0,0 +1,156 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Query più lente di così (secondi) vengono conservate con la traccia
+SLOW_QUERY_THRESHOLD = 0.5
+# Frazione delle query tracciate (0-1): limita il costo sotto carico
+SLOW_QUERY_SAMPLE_RATE = 0.1
+# Tracce conservate: oltre, le più vecchie vengono scartate
+SLOW_QUERY_BUFFER_SIZE = 200
+
+
+# =========================
+# TRACCIA DI UNA QUERY
+# =========================
+
+class QueryTrace:
+    """
+    Dettaglio di una singola query campionata: esito della lista
+    bloccati, stato della cache, attesa su una query identica già in
+    corso e ogni tentativo upstream con istanti di invio e ricezione.
+    Gli istanti sono in ms dall'inizio della query.
+    """
+
+    __slots__ = (
+        "qname", "qtype", "client", "thread", "started", "wall", "verdict",
+        "duration", "match", "cache", "wait", "attempts",
+    )
+
+    def __init__(self, qname: str, qtype: int, client=None):
+        self.qname = qname
+        self.qtype = qtype
+        self.client = client
+        self.thread = threading.current_thread().name
+        self.started = time.monotonic()
+        self.wall = time.time()
+        self.verdict = None
+        self.duration = None
+        self.match = None
+        self.cache = None
+        self.wait = None
+        self.attempts = []
+
+    def _ms(self, instant: float | None) -> float | None:
+        return round((instant - self.started) * 1000, 3) if instant is not None else None
+
+    def record_match(self, domain: str, rule: str | None):
+        self.match = {"domain": domain, "rule": rule}
+
+    def record_cache(self, hit: bool):
+        self.cache = "hit" if hit else "miss"
+
+    def record_wait(self, seconds: float):
+        # Attesa della risposta di una query identica già in volo
+        self.wait = seconds
+
+    def record_attempts(self, attempts: list[tuple], winner: tuple | None, received_at: float, transport: str = "udp"):
+        """
+        `attempts` come per dns.upstream.record_attempts: (indirizzo,
+        salute, istante di invio); solo il vincitore ha la ricezione.
+        """
+        for address, _, sent_at in attempts:
+            won = address == winner
+            self.attempts.append({
+                "upstream": f"{address[0]}:{address[1]}",
+                "transport": transport,
+                "sent_ms": self._ms(sent_at),
+                "received_ms": self._ms(received_at) if won else None,
+                "outcome": "answer" if won else ("late" if winner else "timeout"),
+            })
+
+    def to_dict(self) -> dict:
+        return {
+            "ts": round(self.wall, 3),
+            "client": self.client[0] if self.client else None,
+            "qname": self.qname,
+            "qtype": self.qtype,
+            "verdict": self.verdict,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "thread": self.thread,
+            "match": self.match,
+            "cache": self.cache,
+            "wait_ms": round(self.wait * 1000, 3) if self.wait is not None else None,
+            "attempts": self.attempts,
+        }
+
+
+# =========================
+# CAMPIONATORE
+# =========================
+
+class SlowQueryTracer:
+    """
+    Traccia una query su `sample_rate` e conserva in un buffer circolare
+    quelle che superano `threshold` secondi. Per le query non campionate
+    il costo è un numero casuale; le tracce si leggono con dump().
+    """
+
+    def __init__(
+        self,
+        threshold: float = SLOW_QUERY_THRESHOLD,
+        sample_rate: float = SLOW_QUERY_SAMPLE_RATE,
+        size: int = SLOW_QUERY_BUFFER_SIZE,
+    ):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self._traces: deque = deque(maxlen=size)
+        self.sampled = 0
+        self.slow = 0
+
+    def start(self, qname: str, qtype: int, client=None) -> QueryTrace | None:
+        if random.random() >= self.sample_rate:
+            return None
+        self.sampled += 1
+        return QueryTrace(qname, qtype, client)
+
+    def finish(self, trace: QueryTrace):
+        trace.duration = time.monotonic() - trace.started
+        if trace.duration >= self.threshold:
+            self.slow += 1
+            # append su deque limitata: atomico, nessun lock
+            self._traces.append(trace)
+
+    def dump(self) -> list[dict]:
+        """
+        Tracce conservate, dalla più vecchia.
+        """
+        return [trace.to_dict() for trace in list(self._traces)]
+
+    def dump_to(self, path: Path) -> int:
+        traces = self.dump()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(traces, indent=2, ensure_ascii=False), encoding="utf-8")
+        return len(traces)
+
+    def clear(self):
+        self._traces.clear()
+
+    def stats(self) -> dict:
+        return {
+            "threshold_s": self.threshold,
+            "sample_rate": self.sample_rate,
+            "sampled": self.sampled,
+            "slow": self.slow,
+            "kept": len(self._traces),
+            "max_kept": self._traces.maxlen,
+        }
@@ -0,0 +1,599 @@
+import random
+import socket
+import struct
+import threading
+import time
+
+from dns.querylog import VERDICT_TIMEOUT
+from dns.wire import parse_query, question_bytes
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Socket persistenti per ogni upstream (porte sorgente diverse)
+SOCKETS_PER_UPSTREAM = 2
+RECV_BUFFER = 65535
+TCP_CONNECT_TIMEOUT = 2.0
+
+# Timeout adattivo per upstream (secondi): iniziale e limiti
+INITIAL_UPSTREAM_TIMEOUT = 1.0
+MIN_UPSTREAM_TIMEOUT = 0.05
+MAX_UPSTREAM_TIMEOUT = 3.0
+# Circuit breaker: timeout consecutivi prima di escludere l'upstream
+FAILURE_THRESHOLD = 3
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 120.0
+
+
+# =========================
+# SALUTE UPSTREAM
+# =========================
+
+class UpstreamHealth:
+    """
+    RTT smussato (stile RFC 6298) e contatori di errore di un upstream.
+    Dopo FAILURE_THRESHOLD timeout consecutivi l'upstream viene escluso
+    per un periodo di backoff che raddoppia a ogni nuova apertura.
+    """
+
+    def __init__(self, address: tuple):
+        self.address = address
+        self.srtt: float | None = None
+        self.rttvar = 0.0
+        self.failures = 0
+        self.queries = 0
+        self.timeouts = 0
+        self.open_until = 0.0
+        self._backoff = BACKOFF_BASE
+        self._lock = threading.Lock()
+
+    def timeout(self) -> float:
+        if self.srtt is None:
+            return INITIAL_UPSTREAM_TIMEOUT
+        rto = self.srtt + 4 * self.rttvar
+        return min(MAX_UPSTREAM_TIMEOUT, max(MIN_UPSTREAM_TIMEOUT, rto))
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def record_success(self, rtt: float):
+        with self._lock:
+            self.queries += 1
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.failures = 0
+            self._backoff = BACKOFF_BASE
+
+    def record_timeout(self, now: float):
+        with self._lock:
+            self.queries += 1
+            self.timeouts += 1
+            self.failures += 1
+            if self.failures >= FAILURE_THRESHOLD and now >= self.open_until:
+                self.open_until = now + self._backoff
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX)
+                print(f"[UPSTREAM] {self.address[0]} escluso per {self.open_until - now:.0f}s")
+
+    def stats(self, now: float) -> dict:
+        return {
+            "srtt_ms": None if self.srtt is None else round(self.srtt * 1000, 2),
+            "timeout_ms": round(self.timeout() * 1000, 2),
+            "failures": self.failures,
+            "queries": self.queries,
+            "timeouts": self.timeouts,
+            "available": self.available(now),
+        }
+
+
+def record_attempts(attempts: list[tuple], winner: tuple | None, received_at: float):
+    """
+    Aggiorna la salute degli upstream interrogati per una query:
+    `attempts` è una lista di (indirizzo, UpstreamHealth, istante invio).
+    """
+    now = time.monotonic()
+    for address, health, sent_at in attempts:
+        if address == winner:
+            health.record_success(received_at - sent_at)
+        elif winner is None or now - sent_at >= health.timeout():
+            # Non ha risposto entro il suo timeout: conta come errore
+            health.record_timeout(now)
+
+
+# =========================
+# QUERY IN ATTESA
+# =========================
+
+class _PendingQuery:
+    """
+    Query in attesa di risposta, condivisa tra tutti gli upstream a cui
+    è stata inviata: vince la prima risposta valida.
+    """
+
+    __slots__ = ("question", "event", "data", "upstream", "received_at")
+
+    def __init__(self, question: bytes):
+        self.question = question
+        self.event = threading.Event()
+        self.data = None
+        self.upstream = None
+        self.received_at = 0.0
+
+    def set_result(self, data: bytes, upstream: tuple):
+        if self.data is None:
+            self.received_at = time.monotonic()
+            self.data = data
+            self.upstream = upstream
+            self.event.set()
+
+    def abort(self):
+        # Connessione persa: sveglia chi aspetta, senza risposta
+        self.event.set()
+
+
+# =========================
+# CONNESSIONE UPSTREAM
+# =========================
+
+class _MultiplexedConnection:
+    """
+    Base delle connessioni upstream condivise tra thread. Le query in
+    volo sono identificate da un ID di transazione scelto qui (non
+    quello del client); le risposte vengono accettate solo se ID e
+    domanda coincidono, le altre sono scartate e contate.
+    """
+
+    def __init__(self, address: tuple):
+        self.address = address
+        self._pending: dict[int, _PendingQuery] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _write(self, data: bytes, timeout: float | None = None):
+        raise NotImplementedError
+
+    def send(self, packet: bytes, pending: _PendingQuery, timeout: float | None = None) -> int | None:
+        """
+        Invia la query con un nuovo ID, None se la scrittura fallisce.
+        `timeout` limita l'attesa per scrivere (es. connessione TCP).
+        """
+        with self._lock:
+            txid = random.getrandbits(16)
+            while txid in self._pending:
+                txid = random.getrandbits(16)
+            self._pending[txid] = pending
+        try:
+            self._write(txid.to_bytes(2, "big") + packet[2:], timeout)
+        except OSError:
+            self.cancel(txid)
+            return None
+        return txid
+
+    def cancel(self, txid: int):
+        with self._lock:
+            self._pending.pop(txid, None)
+
+    def _dispatch(self, data: bytes):
+        if len(data) < 12 or not data[2] & 0x80:
+            self.rejected += 1
+            return
+        txid = int.from_bytes(data[:2], "big")
+        with self._lock:
+            pending = self._pending.get(txid)
+            if pending is None or question_bytes(data) != pending.question:
+                self.rejected += 1
+                return
+            del self._pending[txid]
+        pending.set_result(data, self.address)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+
+class UpstreamConnection(_MultiplexedConnection):
+    """
+    Socket UDP persistente verso un upstream.
+    """
+
+    def __init__(self, address: tuple):
+        super().__init__(address)
+        family = socket.AF_INET6 if ":" in address[0] else socket.AF_INET
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        # Socket connesso: il kernel scarta pacchetti da altri indirizzi
+        self._sock.connect(address)
+        self._sock.settimeout(0.5)
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def _write(self, data: bytes, timeout: float | None = None):
+        self._sock.send(data)
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                data = self._sock.recv(RECV_BUFFER)
+            except socket.timeout:
+                continue
+            except OSError:
+                # es. ICMP port unreachable su socket connesso
+                if not self._running:
+                    break
+                continue
+            self._dispatch(data)
+
+    def close(self):
+        # Il thread lettore esce al prossimo timeout di recv()
+        self._running = False
+        self._sock.close()
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes | None:
+    """
+    Legge esattamente `size` byte da un socket TCP, None se la
+    connessione viene chiusa prima.
+    """
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+class TCPUpstreamConnection(_MultiplexedConnection):
+    """
+    Connessione TCP persistente verso un upstream, riusata tra query e
+    in pipeline: più query scritte senza attendere le risposte, che
+    vengono abbinate per ID (anche se arrivano in ordine diverso).
+    Se l'upstream chiude la connessione (es. idle timeout) le query in
+    attesa vengono sbloccate e la successiva send() riconnette.
+    """
+
+    def __init__(self, address: tuple):
+        super().__init__(address)
+        self._sock = None
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+    def connected(self) -> bool:
+        return self._sock is not None
+
+    def _connect(self, timeout: float):
+        if timeout <= 0:
+            raise socket.timeout("connessione TCP scaduta")
+        sock = socket.create_connection(self.address, timeout=timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def _write(self, data: bytes, timeout: float | None = None):
+        # Attesa del lock e connessione entro il tempo rimasto alla query
+        if timeout is None:
+            timeout = TCP_CONNECT_TIMEOUT
+        end = time.monotonic() + timeout
+        if not self._write_lock.acquire(timeout=max(0.0, timeout)):
+            raise socket.timeout("connessione TCP occupata")
+        try:
+            if self._closed:
+                raise OSError("connessione chiusa")
+            if self._sock is None:
+                self._connect(min(TCP_CONNECT_TIMEOUT, end - time.monotonic()))
+            try:
+                self._sock.sendall(struct.pack("!H", len(data)) + data)
+            except OSError:
+                self._drop(self._sock)
+                raise
+        finally:
+            self._write_lock.release()
+
+    def _read_loop(self, sock: socket.socket):
+        try:
+            while True:
+                header = recv_exact(sock, 2)
+                if header is None:
+                    break
+                data = recv_exact(sock, struct.unpack("!H", header)[0])
+                if data is None:
+                    break
+                self._dispatch(data)
+        except OSError:
+            pass
+        self._drop(sock)
+
+    def _drop(self, sock: socket.socket):
+        with self._lock:
+            if self._sock is not sock:
+                return
+            self._sock = None
+            pending = list(self._pending.values())
+            self._pending.clear()
+        try:
+            sock.close()
+        except OSError:
+            pass
+        # Le query in attesa su questa connessione non avranno risposta
+        for query in pending:
+            query.abort()
+
+    def close(self):
+        with self._write_lock:
+            self._closed = True
+            sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._drop(sock)
+
+
+# =========================
+# COALESCING QUERY IDENTICHE
+# =========================
+
+class _Flight:
+    __slots__ = ("event", "data")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.data = None
+
+
+class InflightQueries:
+    """
+    Singleflight: la prima query per una chiave va upstream, quelle
+    identiche che arrivano mentre è in volo aspettano la sua risposta.
+    """
+
+    def __init__(self):
+        self._flights: dict[tuple, _Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key: tuple) -> tuple[_Flight, bool]:
+        """
+        Ritorna (flight, leader): se leader è True il chiamante deve
+        eseguire la query e poi chiamare finish().
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key: tuple, flight: _Flight, data: bytes | None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.data = data
+        flight.event.set()
+
+
+# =========================
+# POOL UPSTREAM
+# =========================
+
+class UpstreamPool:
+    """
+    Tiene pochi socket di lunga durata per ogni upstream, condivisi da
+    tutti i thread del resolver, invece di aprire un socket per query,
+    e lo stato di salute di ciascun upstream per ordinarli per latenza.
+    Risparmia socket e syscall per query, non latenza: la risposta
+    arriva tramite il thread lettore (vedi tests/bench_upstream.py).
+    """
+
+    def __init__(self, sockets_per_upstream: int = SOCKETS_PER_UPSTREAM):
+        self.sockets_per_upstream = sockets_per_upstream
+        self._connections: dict[tuple, list[UpstreamConnection]] = {}
+        self._tcp: dict[tuple, TCPUpstreamConnection] = {}
+        self._health: dict[tuple, UpstreamHealth] = {}
+        self._lock = threading.Lock()
+        # QueryLog del resolver (vedi dns.querylog): None = timeout stampati
+        self.query_log = None
+        # ResolverMetrics del resolver (vedi dns.metrics): timeout per upstream
+        self.metrics = None
+
+    def health(self, upstream: tuple) -> UpstreamHealth:
+        health = self._health.get(upstream)
+        if health is None:
+            with self._lock:
+                health = self._health.setdefault(upstream, UpstreamHealth(upstream))
+        return health
+
+    def ordered(self, upstreams: list[tuple]) -> list[tuple]:
+        """
+        Upstream disponibili ordinati per RTT misurato (quelli mai
+        misurati in coda, nell'ordine di configurazione); quelli esclusi
+        dal circuit breaker vengono saltati, a meno che lo siano tutti.
+        """
+        now = time.monotonic()
+        available = []
+        for position, upstream in enumerate(upstreams):
+            health = self.health(upstream)
+            if health.available(now):
+                srtt = health.srtt if health.srtt is not None else float("inf")
+                available.append((srtt, position, upstream))
+        if not available:
+            return list(upstreams)
+        available.sort()
+        return [upstream for _, _, upstream in available]
+
+    def connection(self, upstream: tuple) -> UpstreamConnection:
+        conns = self._connections.get(upstream)
+        if conns is None:
+            with self._lock:
+                conns = self._connections.get(upstream)
+                if conns is None:
+                    conns = [UpstreamConnection(upstream) for _ in range(self.sockets_per_upstream)]
+                    self._connections[upstream] = conns
+        return random.choice(conns)
+
+    def tcp_connection(self, upstream: tuple) -> TCPUpstreamConnection:
+        conn = self._tcp.get(upstream)
+        if conn is None:
+            with self._lock:
+                conn = self._tcp.setdefault(upstream, TCPUpstreamConnection(upstream))
+        return conn
+
+    def query(
+        self,
+        packet: bytes,
+        upstreams: list[tuple],
+        deadline: float,
+        stagger: float,
+    ) -> bytes | None:
+        """
+        Invia all'upstream più veloce e, se non risponde entro il suo
+        timeout adattivo (al massimo `stagger` secondi), anche ai
+        successivi; ritorna la prima risposta valida con l'ID originale
+        del client, None allo scadere di `deadline`. Se la risposta è
+        troncata (bit TC) la query viene ripetuta in TCP allo stesso
+        upstream, nel tempo rimasto.
+        """
+        return self.query_with_winner(packet, upstreams, deadline, stagger)[0]
+
+    def query_with_winner(
+        self,
+        packet: bytes,
+        upstreams: list[tuple],
+        deadline: float,
+        stagger: float,
+        trace=None,
+    ) -> tuple[bytes | None, tuple | None]:
+        # Come query(), più l'upstream che ha risposto (per il log);
+        # con `trace` (dns.tracing.QueryTrace) registra ogni tentativo
+        question = question_bytes(packet)
+        if question is None:
+            return None, None
+
+        pending = _PendingQuery(question)
+        end = time.monotonic() + deadline
+        sent = []
+        try:
+            for upstream in self.ordered(upstreams):
+                conn = self.connection(upstream)
+                health = self.health(upstream)
+                sent_at = time.monotonic()
+                txid = conn.send(packet, pending)
+                if txid is None:
+                    continue
+                sent.append((conn, txid, health, sent_at))
+                remaining = end - time.monotonic()
+                wait = min(stagger, health.timeout(), remaining)
+                if pending.event.wait(max(0.0, wait)) or remaining <= 0:
+                    break
+            if sent:
+                pending.event.wait(max(0.0, end - time.monotonic()))
+        finally:
+            for conn, txid, _, _ in sent:
+                conn.cancel(txid)
+
+        attempts = [(conn.address, health, sent_at) for conn, _, health, sent_at in sent]
+        self.record_race(packet, attempts, pending.upstream, pending.received_at, trace)
+        if pending.data is None:
+            return None, None
+        if pending.data[2] & 0x02:
+            data = self.retry_tcp(packet, pending.upstream, end, trace)
+            if data is not None:
+                return data, pending.upstream
+        return packet[:2] + pending.data[2:], pending.upstream
+
+    # Passi di query_with_winner() condivisi con dns.aio_server
+
+    def record_race(self, packet: bytes, attempts: list[tuple], winner: tuple | None, received_at: float, trace=None):
+        """
+        Esito di una corsa tra upstream: salute di ogni upstream
+        interrogato, traccia e timeout se nessuno ha risposto.
+        """
+        record_attempts(attempts, winner, received_at)
+        if trace is not None:
+            trace.record_attempts(attempts, winner, received_at)
+        if winner is None:
+            for address, _, _ in attempts:
+                self.report_timeout(packet, address)
+
+    def retry_tcp(self, packet: bytes, upstream: tuple, end: float, trace=None) -> bytes | None:
+        # Risposta troncata (bit TC): stessa query in TCP, entro `end`
+        sent_at = time.monotonic()
+        data = self.query_tcp(packet, upstream, end - sent_at)
+        if trace is not None:
+            winner = upstream if data is not None else None
+            trace.record_attempts([(upstream, None, sent_at)], winner, time.monotonic(), "tcp")
+        return data
+
+    def report_timeout(self, packet: bytes, upstream: tuple, transport: str = ""):
+        """
+        Upstream che non ha risposto: record nel log delle query se
+        presente, altrimenti un print (come prima del log).
+        """
+        if self.metrics is not None:
+            self.metrics.timeout(upstream)
+        log = self.query_log
+        if log is None:
+            print(f"[TIMEOUT] DNS upstream {upstream[0]} non risponde{transport}")
+            return
+        query = parse_query(packet)
+        qname, qtype = (query[0], query[1]) if query is not None else (None, None)
+        log.record(None, qname, qtype, VERDICT_TIMEOUT, upstream)
+
+    def query_tcp(self, packet: bytes, upstream: tuple, timeout: float) -> bytes | None:
+        """
+        Query su connessione TCP persistente, con un solo nuovo tentativo
+        se cade una connessione già aperta (l'upstream può chiuderla
+        quando è inattiva). Connessione compresa, non supera `timeout`.
+        """
+        question = question_bytes(packet)
+        if question is None:
+            return None
+        end = time.monotonic() + timeout
+        conn = self.tcp_connection(upstream)
+        for _ in range(2):
+            reused = conn.connected()
+            pending = _PendingQuery(question)
+            txid = conn.send(packet, pending, max(0.0, end - time.monotonic()))
+            if txid is not None:
+                pending.event.wait(max(0.0, end - time.monotonic()))
+                conn.cancel(txid)
+                if pending.data is not None:
+                    return packet[:2] + pending.data[2:]
+            # Connessione nuova non riuscita o caduta subito: inutile riprovare
+            if not reused or time.monotonic() >= end:
+                break
+        self.report_timeout(packet, upstream, " in TCP")
+        return None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            connections = dict(self._connections)
+            health = dict(self._health)
+        result = {}
+        for addr, upstream_health in health.items():
+            conns = connections.get(addr, [])
+            result[f"{addr[0]}:{addr[1]}"] = {
+                **upstream_health.stats(now),
+                "sockets": len(conns),
+                "in_flight": sum(c.in_flight() for c in conns),
+                "rejected": sum(c.rejected for c in conns),
+            }
+        return result
+
+    def close(self):
+        with self._lock:
+            conns = [c for group in self._connections.values() for c in group]
+            conns.extend(self._tcp.values())
+            self._connections.clear()
+            self._tcp.clear()
+        for conn in conns:
+            conn.close()
@@ -0,0 +1,276 @@
+import struct
+
+
+# =========================
+# PARSING PACCHETTI DNS (BYTES)
+# =========================
+
+HEADER_LEN = 12
+
+QTYPE_A = 1
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+QTYPE_OPT = 41
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+SINKHOLE_TTL = 60
+
+
+def question_end(packet: bytes) -> int | None:
+    """
+    Offset di fine della prima domanda (qname + qtype + qclass),
+    None se il pacchetto è troppo corto o usa compressione nel qname.
+    """
+    i = HEADER_LEN
+    size = len(packet)
+    while i < size:
+        length = packet[i]
+        if length == 0:
+            end = i + 5
+            return end if end <= size else None
+        if length & 0xC0:
+            return None
+        i += length + 1
+    return None
+
+
+def question_bytes(packet: bytes) -> bytes | None:
+    end = question_end(packet)
+    if end is None:
+        return None
+    return packet[HEADER_LEN:end]
+
+
+def parse_query(packet: bytes) -> tuple[str, int, int, int] | None:
+    """
+    Estrae (qname, qtype, qclass, fine domanda) da una query standard
+    senza costruire oggetti dnslib. Ritorna None per tutto ciò che non è
+    una query semplice (risposte, opcode diversi, più domande, label
+    compresse o non ASCII): in quel caso si ripiega su dnslib.
+    qname è in minuscolo e senza punto finale.
+    """
+    if len(packet) < HEADER_LEN or packet[2] & 0xF8:
+        # QR=1 oppure opcode != QUERY
+        return None
+    if packet[4:10] != b"\x00\x01\x00\x00\x00\x00" or packet[10] or packet[11] > 1:
+        # qdcount=1, nessuna answer/authority, al massimo un additional (EDNS)
+        return None
+
+    labels = []
+    i = HEADER_LEN
+    size = len(packet)
+    while True:
+        if i >= size:
+            return None
+        length = packet[i]
+        if length == 0:
+            break
+        if length & 0xC0:
+            return None
+        label = packet[i + 1:i + 1 + length]
+        if len(label) != length or b"." in label:
+            return None
+        labels.append(label)
+        i += length + 1
+
+    end = i + 5
+    if end > size:
+        return None
+    qtype, qclass = struct.unpack_from("!HH", packet, i + 1)
+    try:
+        qname = b".".join(labels).decode("ascii").lower()
+    except UnicodeDecodeError:
+        return None
+    return qname, qtype, qclass, end
+
+
+# Risposta sinkhole: puntatore al qname (offset 12), classe IN, TTL 60
+_SINKHOLE_ANSWERS = {
+    QTYPE_A: b"\xc0\x0c" + struct.pack("!HHIH", QTYPE_A, 1, SINKHOLE_TTL, 4) + bytes(4),
+    QTYPE_AAAA: b"\xc0\x0c" + struct.pack("!HHIH", QTYPE_AAAA, 1, SINKHOLE_TTL, 16) + bytes(16),
+}
+
+
+def sinkhole_reply(packet: bytes, qend: int, qtype: int) -> bytes:
+    """
+    Risposta a un dominio bloccato costruita copiando header e domanda
+    della query: 0.0.0.0 per A, :: per AAAA, nessun record per gli altri
+    tipi. Stessi flag di DNSRecord.reply() (QR, AA, RA).
+    """
+    answer = _SINKHOLE_ANSWERS.get(qtype, b"")
+    header = bytes((
+        packet[0], packet[1],
+        packet[2] | 0x84, packet[3] | 0x80,
+        0, 1,
+        0, 1 if answer else 0,
+        0, 0,
+        0, 0,
+    ))
+    return header + packet[HEADER_LEN:qend] + answer
+
+
+def empty_reply(packet: bytes, qend: int) -> bytes:
+    """
+    Risposta vuota (NOERROR, nessun record): fallback se nessun upstream
+    risponde, come DNSRecord.reply().
+    """
+    return sinkhole_reply(packet, qend, 0)
+
+
+# =========================
+# RECORD DELLE RISPOSTE
+# =========================
+
+def _skip_name(packet: bytes, i: int) -> int:
+    while True:
+        length = packet[i]
+        if length == 0:
+            return i + 1
+        if length & 0xC0 == 0xC0:
+            return i + 2
+        i += length + 1
+
+
+def iter_records(packet: bytes):
+    """
+    Scorre i record di answer/authority/additional senza decodificarli.
+    Genera (sezione, rtype, offset TTL, offset rdata, lunghezza rdata),
+    con sezione 0/1/2. IndexError/struct.error se il pacchetto è troppo
+    corto.
+    """
+    qdcount, ancount, nscount, arcount = struct.unpack_from("!HHHH", packet, 4)
+    i = HEADER_LEN
+    for _ in range(qdcount):
+        i = _skip_name(packet, i) + 4
+    for section, count in enumerate((ancount, nscount, arcount)):
+        for _ in range(count):
+            i = _skip_name(packet, i)
+            rtype, _, _, rdlength = struct.unpack_from("!HHIH", packet, i)
+            rdata = i + 10
+            if rdata + rdlength > len(packet):
+                raise IndexError("rdata oltre la fine del pacchetto")
+            yield section, rtype, i + 4, rdata, rdlength
+            i = rdata + rdlength
+
+
+def reply_ttl(packet: bytes) -> int | None:
+    """
+    TTL con cui mettere in cache una risposta, None se non cacheabile:
+    - positive: TTL minimo dei record (OPT escluso)
+    - NXDOMAIN/NODATA: minimo tra TTL e campo minimum del SOA (RFC 2308)
+    - troncate, SERVFAIL e simili: non cacheabili
+    """
+    if len(packet) < HEADER_LEN or packet[2] & 0x02:
+        return None
+    rcode = packet[3] & 0x0F
+    try:
+        records = list(iter_records(packet))
+    except (IndexError, struct.error):
+        return None
+
+    has_answer = any(section == 0 for section, *_ in records)
+    if rcode == RCODE_NXDOMAIN or (rcode == RCODE_NOERROR and not has_answer):
+        for section, rtype, ttl_at, rdata, rdlength in records:
+            if section == 1 and rtype == QTYPE_SOA and rdlength >= 20:
+                ttl = struct.unpack_from("!I", packet, ttl_at)[0]
+                minimum = struct.unpack_from("!I", packet, rdata + rdlength - 4)[0]
+                return min(ttl, minimum)
+        return None
+    if rcode != RCODE_NOERROR:
+        return None
+
+    ttls = [
+        struct.unpack_from("!I", packet, ttl_at)[0]
+        for _, rtype, ttl_at, _, _ in records
+        if rtype != QTYPE_OPT
+    ]
+    return min(ttls) if ttls else None
+
+
+def age_ttls(packet: bytes, elapsed: int) -> bytes:
+    """
+    Copia del pacchetto con i TTL ridotti di `elapsed` secondi (minimo 0).
+    """
+    out = bytearray(packet)
+    for _, rtype, ttl_at, _, _ in iter_records(packet):
+        if rtype != QTYPE_OPT:
+            ttl = struct.unpack_from("!I", out, ttl_at)[0]
+            struct.pack_into("!I", out, ttl_at, max(0, ttl - elapsed))
+    return bytes(out)
+
+
+def reuse_reply(packet: bytes, reply: bytes) -> bytes:
+    """
+    Risposta già ottenuta (in cache o per una query identica) adattata
+    alla query `packet`: ID, bit RD e domanda del client, con le sue
+    maiuscole (chi randomizza il qname, 0x20, lo confronta), e record
+    OPT solo se il client ha usato EDNS. Se uno dei due pacchetti non
+    si può scomporre cambia solo l'ID.
+    """
+    qend = question_end(packet)
+    rend = question_end(reply)
+    if qend is None or rend is None or qend != rend:
+        return packet[:2] + reply[2:]
+    header = bytearray(reply[:HEADER_LEN])
+    header[0:2] = packet[0:2]
+    header[2] = (reply[2] & 0xFE) | (packet[2] & 0x01)
+    body = reply[rend:]
+    if not (packet[10] or packet[11]) and (reply[10] or reply[11]):
+        # Client senza EDNS: si toglie l'OPT dell'upstream se è l'ultimo record
+        try:
+            records = list(iter_records(reply))
+        except (IndexError, struct.error):
+            records = []
+        if records and records[-1][0] == 2 and records[-1][1] == QTYPE_OPT:
+            _, _, ttl_at, rdata, rdlength = records[-1]
+            if rdata + rdlength == len(reply) and reply[ttl_at - 5] == 0:
+                body = reply[rend:ttl_at - 5]
+                struct.pack_into("!H", header, 10, struct.unpack_from("!H", reply, 10)[0] - 1)
+    return bytes(header) + packet[HEADER_LEN:qend] + body
+
+
+# =========================
+# TRONCAMENTO UDP
+# =========================
+
+# Dimensione massima di una risposta UDP senza EDNS (RFC 1035)
+UDP_MAX_SIZE = 512
+
+
+def udp_payload_size(packet: bytes) -> int:
+    """
+    Dimensione massima della risposta UDP accettata dal client: quella
+    annunciata nel record OPT (EDNS0) se presente, altrimenti 512.
+    """
+    end = question_end(packet)
+    if end is None or packet[11] != 1 or packet[10]:
+        return UDP_MAX_SIZE
+    # OPT: nome radice (0), tipo 41, classe = dimensione payload
+    if end + 5 > len(packet) or packet[end] != 0:
+        return UDP_MAX_SIZE
+    rtype, size = struct.unpack_from("!HH", packet, end + 1)
+    if rtype != QTYPE_OPT:
+        return UDP_MAX_SIZE
+    return max(UDP_MAX_SIZE, size)
+
+
+def fit_udp(reply: bytes, limit: int) -> bytes:
+    """
+    Risposta entro `limit` byte per UDP: se è più grande resta solo la
+    domanda, con il bit TC acceso, così il client ripete la query in TCP.
+    """
+    if len(reply) <= limit:
+        return reply
+    end = question_end(reply)
+    qdcount = 1 if end is not None else 0
+    header = bytes((
+        reply[0], reply[1],
+        reply[2] | 0x02, reply[3],
+        0, qdcount,
+        0, 0,
+        0, 0,
+        0, 0,
+    ))
+    return header + (reply[HEADER_LEN:end] if end is not None else b"")
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from dns.blocklist import BlocklistHolder, MappedDomainIndex
+from dns.compiler import ensure_compiled_version, index_version_path, remove_stale_indexes
+from dns.journal import JournalReader
+from dns.querylog import QueryLog
+
+
+# =========================
+# CONFIGURAZIONE
+# =========================
+
+# Ogni quanto il supervisore controlla worker e lista bloccati (secondi)
+SUPERVISOR_INTERVAL = 1.0
+# Attesa massima per l'avvio dei worker
+WORKER_START_TIMEOUT = 10.0
+
+
+# =========================
+# PROCESSO WORKER
+# =========================
+
+def _worker_main(
+    worker_id: int,
+    addresses: list[str],
+    port: int,
+    engine: str,
+    index_path: str,
+    index_digest,
+    journal: str | None,
+    query_log: str | None,
+    upstreams: list[tuple] | None,
+    ready,
+):
+    """
+    Corpo di un processo worker: resolver e cache propri, lista
+    bloccati letta dall'indice mappato scritto dal supervisore (la
+    versione in uso è `index_digest`, condiviso) e dal journal delle
+    modifiche successive.
+    """
+    # Import qui: dns.server importa questo modulo
+    from dns.server import BlockResolver, build_dns_server
+
+    path = Path(index_path)
+    log = None
+    if query_log:
+        # Un file per worker: la rotazione non è condivisibile tra processi
+        log_path = Path(query_log)
+        log = QueryLog(log_path.with_name(f"{log_path.stem}-{worker_id}{log_path.suffix}"))
+    resolver = BlockResolver(
+        blocklist=BlocklistHolder(
+            path,
+            lambda: MappedDomainIndex(index_version_path(path, index_digest.value)),
+            signature=lambda: index_digest.value,
+            journal=JournalReader(Path(journal)) if journal else None,
+        ),
+        query_log=log,
+    )
+    if upstreams:
+        resolver.upstream_dns_list = [tuple(u) for u in upstreams]
+    try:
+        server = build_dns_server(resolver, addresses, port, engine, reuse_port=True)
+        server.start_thread()
+    except Exception as e:
+        ready.put((worker_id, f"{type(e).__name__}: {e}"))
+        return
+    ready.put((worker_id, None))
+
+    # Se il supervisore muore senza fermarci, usciamo anche noi
+    parent = os.getppid()
+    while os.getppid() == parent and server.isAlive():
+        time.sleep(SUPERVISOR_INTERVAL)
+    server.stop()
+
+
+# =========================
+# SUPERVISORE
+# =========================
+
+class WorkerSupervisor:
+    """
+    N processi worker in ascolto sulla stessa porta con SO_REUSEPORT: il
+    kernel distribuisce le query tra i processi, ognuno con il proprio
+    GIL. Il supervisore (nel processo chiamante) compila l'indice dei
+    domini bloccati, mappato in sola lettura dai worker, lo ricompila
+    quando le sorgenti cambiano e riavvia i worker terminati.
+    Stessa interfaccia start_thread()/stop() degli altri server.
+    """
+
+    # Statistiche di cache/upstream restano nei singoli processi
+    resolver = None
+
+    def __init__(
+        self,
+        workers: int,
+        addresses: list[str],
+        port: int,
+        engine: str,
+        sources: Callable[[], list[Path]],
+        index_path: Path,
+        journal: Path | None = None,
+        query_log: Path | None = None,
+        upstreams: list[tuple] | None = None,
+    ):
+        self.workers = workers
+        self.addresses = list(addresses)
+        self.port = port
+        self.engine = engine
+        self.index_path = index_path
+        self.journal = journal
+        self.query_log = query_log
+        self.upstreams = upstreams
+        self.restarts = 0
+        self._sources = sources
+        # spawn: nessuno stato (thread, socket, Qt) ereditato dal padre
+        self._ctx = multiprocessing.get_context("spawn")
+        self._ready = self._ctx.Queue()
+        # Digest della versione dell'indice pubblicata, letto dai worker
+        self._index_digest = self._ctx.Value("Q", 0)
+        self._processes: list = [None] * workers
+        self._stopping = threading.Event()
+        self._monitor = None
+
+    def _publish_blocklist(self):
+        try:
+            digest = ensure_compiled_version(self._sources(), self.index_path)
+        except Exception as e:
+            # es. domains.json scritto a metà: i worker tengono l'indice attuale
+            print(f"[BLOCKLIST] Compilazione fallita, mantengo lista attuale: {e}")
+            return
+        if digest != self._index_digest.value:
+            self._index_digest.value = digest
+            remove_stale_indexes(self.index_path, index_version_path(self.index_path, digest))
+
+    def _free_port(self) -> int:
+        # Con port=0 la porta va scelta prima: ogni worker deve usare la stessa
+        family = socket.AF_INET6 if ":" in self.addresses[0] else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.bind((self.addresses[0], 0))
+            return sock.getsockname()[1]
+
+    def _spawn(self, worker_id: int):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                worker_id,
+                self.addresses,
+                self.port,
+                self.engine,
+                str(self.index_path),
+                self._index_digest,
+                str(self.journal) if self.journal else None,
+                str(self.query_log) if self.query_log else None,
+                self.upstreams,
+                self._ready,
+            ),
+            name=f"dns-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    def start_thread(self):
+        self._publish_blocklist()
+        if not self.port:
+            self.port = self._free_port()
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        errors = []
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        for _ in range(self.workers):
+            try:
+                worker_id, error = self._ready.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                errors.append("avvio scaduto")
+                break
+            if error:
+                errors.append(f"worker {worker_id}: {error}")
+        if errors:
+            self.stop()
+            raise RuntimeError(f"Avvio worker DNS fallito ({'; '.join(errors)})")
+
+        self._monitor = threading.Thread(target=self._supervise, daemon=True)
+        self._monitor.start()
+
+    def _supervise(self):
+        while not self._stopping.wait(SUPERVISOR_INTERVAL):
+            self._publish_blocklist()
+            self._drain_ready()
+            for worker_id, process in enumerate(self._processes):
+                if self._stopping.is_set():
+                    return
+                if process is not None and not process.is_alive():
+                    print(f"[WORKER] Processo {worker_id} terminato (exit {process.exitcode}), riavvio")
+                    self.restarts += 1
+                    self._spawn(worker_id)
+
+    def _drain_ready(self):
+        # Esito dei worker riavviati
+        while True:
+            try:
+                worker_id, error = self._ready.get_nowait()
+            except queue.Empty:
+                return
+            if error:
+                print(f"[WORKER] Avvio processo {worker_id} fallito: {error}")
+
+    def stop(self):
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join(timeout=SUPERVISOR_INTERVAL * 2)
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=2)
+
+    def isAlive(self):
+        return any(p is not None and p.is_alive() for p in self._processes)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "restarts": self.restarts,
+            "pids": [p.pid for p in self._processes if p is not None],
+        }
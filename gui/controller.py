@@ -1,4 +1,10 @@
-from dns.server import start_dns_server
+import time
+from pathlib import Path
+
+import config.domain_manager as domain_manager
+from dns.journal import ALLOWED_KEY, BLOCKED_KEY, OP_ADD, OP_REMOVE
+from dns.metrics import MetricsServer
+from dns.server import METRICS_PORT, SLOW_QUERY_DUMP_DIR, start_dns_server
 
 from system.network import (
     refresh_dns_state,
@@ -14,6 +20,11 @@ class AppController:
         self.log = log_callback
         self.server = None
         self.is_running = False
+        # Lista bloccati del resolver in esecuzione: le modifiche dalla
+        # GUI vi arrivano direttamente, il file serve solo a salvarle
+        self.blocklist = None
+        # Endpoint /metrics (Prometheus) se il resolver ha le metriche
+        self.metrics_server = None
 
         # =========================
         # AVVIO APP
@@ -42,6 +53,10 @@ class AppController:
             # 2. Avvia server DNS
             self.server = start_dns_server()
             self.is_running = True
+            resolver = self._resolver()
+            # Con più processi worker (resolver None) vale il journal
+            self.blocklist = resolver.blocklist if resolver is not None else None
+            self._start_metrics_server(resolver)
 
             save_state(True)
             self.log("[APP] DNS blocker ATTIVO")
@@ -50,6 +65,7 @@ class AppController:
             self.log(f"[ERRORE] Avvio fallito: {e}")
             self.is_running = False
             self.server = None
+            self.blocklist = None
 
     # =========================
     # STOP DNS BLOCKER
@@ -67,7 +83,11 @@ class AppController:
             if self.server:
                 self.server.stop()
                 self.server = None
+                self.blocklist = None
                 self.log("[DNS] Server DNS fermato")
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
 
             self.is_running = False
 
@@ -80,3 +100,112 @@ class AppController:
 
         except Exception as e:
             self.log(f"[ERRORE] Arresto fallito: {e}")
+
+    def _start_metrics_server(self, resolver):
+        if resolver is None or resolver.metrics is None:
+            return
+        # Porta occupata: il DNS resta attivo, solo senza endpoint
+        try:
+            self.metrics_server = MetricsServer(resolver.metrics, port=METRICS_PORT)
+            self.metrics_server.start_thread()
+        except OSError as e:
+            self.log(f"[METRICS] Endpoint non disponibile sulla porta {METRICS_PORT}: {e}")
+            self.metrics_server = None
+            return
+        self.log(f"[METRICS] http://127.0.0.1:{self.metrics_server.port}/metrics")
+
+    # =========================
+    # MODIFICHE LISTA BLOCCATI
+    # =========================
+
+    def _edit(self, save, op: str, key: str, domain: str) -> str:
+        # Prima su disco (journal con fsync), poi nell'indice in uso:
+        # la modifica vale dalla query successiva, senza ricaricare nulla
+        rule = save(domain)
+        if rule and self.blocklist is not None:
+            self.blocklist.apply([(op, key, rule)])
+        return rule
+
+    def add_domain(self, domain: str) -> str:
+        return self._edit(domain_manager.add_domain, OP_ADD, BLOCKED_KEY, domain)
+
+    def remove_domain(self, domain: str) -> str:
+        return self._edit(domain_manager.remove_domain, OP_REMOVE, BLOCKED_KEY, domain)
+
+    def add_allowed_domain(self, domain: str) -> str:
+        return self._edit(domain_manager.add_allowed_domain, OP_ADD, ALLOWED_KEY, domain)
+
+    def remove_allowed_domain(self, domain: str) -> str:
+        return self._edit(domain_manager.remove_allowed_domain, OP_REMOVE, ALLOWED_KEY, domain)
+
+    # =========================
+    # STATISTICHE
+    # =========================
+
+    def _resolver(self):
+        if not self.server:
+            return None
+        return self.server.resolver
+
+    def get_cache_stats(self) -> dict | None:
+        resolver = self._resolver()
+        if resolver is None:
+            return None
+        return resolver.cache.stats()
+
+    def get_upstream_stats(self) -> dict | None:
+        resolver = self._resolver()
+        if resolver is None:
+            return None
+        return resolver.upstreams.stats()
+
+    def get_query_log_stats(self) -> dict | None:
+        resolver = self._resolver()
+        if resolver is None or resolver.query_log is None:
+            return None
+        # Record scritti e scartati (coda piena) del log delle query
+        return resolver.query_log.stats()
+
+    def get_metrics(self) -> dict | None:
+        resolver = self._resolver()
+        if resolver is None or resolver.metrics is None:
+            return None
+        # Query al secondo, esiti, timeout per upstream e tempi per fase
+        return resolver.metrics.stats()
+
+    def get_slow_queries(self) -> list[dict] | None:
+        resolver = self._resolver()
+        if resolver is None or resolver.tracer is None:
+            return None
+        # Tracce delle query lente campionate, dalla più vecchia
+        return resolver.tracer.dump()
+
+    def dump_slow_queries(self, path: Path | None = None) -> tuple[Path, int] | None:
+        """
+        Salva le tracce delle query lente in un file JSON (di default
+        logs/slow-queries-<data>.json): percorso e numero di tracce,
+        None se il resolver non è attivo o non traccia.
+        """
+        resolver = self._resolver()
+        if resolver is None or resolver.tracer is None:
+            return None
+        if path is None:
+            path = SLOW_QUERY_DUMP_DIR / f"slow-queries-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        count = resolver.tracer.dump_to(path)
+        self.log(f"[TRACE] {count} query lente salvate in {path}")
+        return Path(path), count
+
+    def set_slow_query_sample_rate(self, rate: float) -> bool:
+        resolver = self._resolver()
+        if resolver is None or resolver.tracer is None:
+            return False
+        resolver.tracer.sample_rate = min(max(rate, 0.0), 1.0)
+        return True
+
+    def get_blocklist_stats(self) -> dict | None:
+        resolver = self._resolver()
+        if resolver is None:
+            return None
+        index = resolver.blocklist.get()
+        # Indice compilato: dimensioni e resa del filtro di Bloom
+        return index.stats() if hasattr(index, "stats") else {"entries": len(index)}
@@ -12,7 +12,7 @@ from PyQt6.QtWidgets import (
     QDialog, QGroupBox, QTimeEdit, QSpinBox
 )
 
-from config.domain_manager import load_domains, add_domain, remove_domain
+from config.domain_manager import load_domains, load_allowed_domains
 from gui.controller import AppController
 from system.security import (
     check_password,
@@ -63,6 +63,10 @@ class MainWindow(QMainWindow):
         self.schedule_btn.setText("⏰")
         self.schedule_btn.setToolTip("Programma blocco")
 
+        self.slow_queries_btn = QToolButton()
+        self.slow_queries_btn.setText("🐢")
+        self.slow_queries_btn.setToolTip("Salva le query lente")
+
         self.info_btn = QToolButton()
         self.info_btn.setText("ℹ️")
         self.info_btn.setToolTip("Informazioni")
@@ -86,6 +90,18 @@ class MainWindow(QMainWindow):
         domain_input_layout.addWidget(self.domain_input)
         domain_input_layout.addWidget(self.add_domain_btn)
 
+        # Eccezioni: sottodomini consentiti anche se il padre è bloccato
+        self.allowed_list = QListWidget()
+        self.allowed_input = QLineEdit()
+        self.allowed_input.setPlaceholderText("es: cdn.facebook.com")
+
+        self.add_allowed_btn = QPushButton("Aggiungi eccezione")
+        self.remove_allowed_btn = QPushButton("Rimuovi eccezione")
+
+        allowed_input_layout = QHBoxLayout()
+        allowed_input_layout.addWidget(self.allowed_input)
+        allowed_input_layout.addWidget(self.add_allowed_btn)
+
         # =========================
         # LAYOUT PRINCIPALE
         # =========================
@@ -95,6 +111,7 @@ class MainWindow(QMainWindow):
         header_layout.addStretch(1)
         header_layout.addWidget(self.schedule_btn)
         header_layout.addWidget(self.change_password_icon_btn)
+        header_layout.addWidget(self.slow_queries_btn)
         header_layout.addWidget(self.info_btn)
 
         layout.addLayout(header_layout)
@@ -112,6 +129,11 @@ class MainWindow(QMainWindow):
         layout.addLayout(domain_input_layout)
         layout.addWidget(self.remove_domain_btn)
 
+        layout.addWidget(QLabel("Eccezioni (sempre consentiti):"))
+        layout.addWidget(self.allowed_list)
+        layout.addLayout(allowed_input_layout)
+        layout.addWidget(self.remove_allowed_btn)
+
         layout.addWidget(QLabel("Log:"))
         layout.addWidget(self.log_view)
 
@@ -132,8 +154,11 @@ class MainWindow(QMainWindow):
 
         self.add_domain_btn.clicked.connect(self.handle_add_domain)
         self.remove_domain_btn.clicked.connect(self.handle_remove_domain)
+        self.add_allowed_btn.clicked.connect(self.handle_add_allowed)
+        self.remove_allowed_btn.clicked.connect(self.handle_remove_allowed)
         self.change_password_icon_btn.clicked.connect(self.change_admin_password)
         self.schedule_btn.clicked.connect(self.open_schedule_dialog)
+        self.slow_queries_btn.clicked.connect(self.dump_slow_queries)
         self.info_btn.clicked.connect(self.open_info_dialog)
 
         self.load_domains_to_ui()
@@ -380,6 +405,17 @@ class MainWindow(QMainWindow):
 
         dialog.exec()
 
+    # =========================
+    # QUERY LENTE
+    # =========================
+    def dump_slow_queries(self):
+        result = self.controller.dump_slow_queries()
+        if result is None:
+            self._show_info("Query lente", "Il DNS blocker non è attivo: nessuna traccia disponibile.")
+            return
+        path, count = result
+        self._show_info("Query lente", f"{count} query lente salvate in:\n{path}")
+
     # =========================
     # INFO BOX
     # =========================
@@ -692,6 +728,9 @@ class MainWindow(QMainWindow):
         self.domain_list.clear()
         for domain in load_domains():
             self.domain_list.addItem(domain)
+        self.allowed_list.clear()
+        for domain in load_allowed_domains():
+            self.allowed_list.addItem(domain)
 
     def handle_add_domain(self):
         domain = self.domain_input.text().strip()
@@ -703,7 +742,11 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Errore", "Dominio non valido")
             return
 
-        add_domain(domain)
+        try:
+            self.controller.add_domain(domain)
+        except ValueError as e:
+            QMessageBox.warning(self, "Errore", f"Regola non valida: {e}")
+            return
         self.domain_input.clear()
         self.load_domains_to_ui()
         self.append_log(f"Aggiunto dominio bloccato: {domain}")
@@ -719,10 +762,44 @@ class MainWindow(QMainWindow):
             self.append_log(f"[SECURITY] Tentativo di rimozione bloccato: {domain}")
             return
 
-        remove_domain(domain)
+        self.controller.remove_domain(domain)
         self.load_domains_to_ui()
         self.append_log(f"Rimosso dominio bloccato: {domain}")
 
+    def handle_add_allowed(self):
+        domain = self.allowed_input.text().strip()
+
+        if not domain:
+            return
+
+        if " " in domain or "." not in domain:
+            QMessageBox.warning(self, "Errore", "Dominio non valido")
+            return
+
+        # Un'eccezione sblocca un dominio: stessa protezione della rimozione
+        if not self.request_password(f"consentire il dominio '{domain}'"):
+            self.append_log(f"[SECURITY] Tentativo di aggiungere eccezione bloccato: {domain}")
+            return
+
+        try:
+            self.controller.add_allowed_domain(domain)
+        except ValueError as e:
+            QMessageBox.warning(self, "Errore", f"Eccezione non valida: {e}")
+            return
+        self.allowed_input.clear()
+        self.load_domains_to_ui()
+        self.append_log(f"Aggiunta eccezione: {domain}")
+
+    def handle_remove_allowed(self):
+        item = self.allowed_list.currentItem()
+        if not item:
+            return
+
+        domain = item.text()
+        self.controller.remove_allowed_domain(domain)
+        self.load_domains_to_ui()
+        self.append_log(f"Rimossa eccezione: {domain}")
+
     # =========================
     # CHIUSURA FINESTRA
     # =========================
@@ -0,0 +1,93 @@
+"""
+Avvio e memoria della lista bloccati: domains.json caricato in un
+set di stringhe (load_blocked_domains + DomainIndex) contro indice
+compilato e mappato (MappedDomainIndex), con e senza filtro di Bloom.
+Ogni misura gira in un processo nuovo, così l'RSS riportato è solo
+quello della lista.
+
+Uso: python -m tests.bench_compiled [--sizes 100000,1000000]
+"""
+import argparse
+import json
+import tempfile
+import time
+from multiprocessing import get_context
+from pathlib import Path
+
+import psutil
+
+from dns.blocklist import DomainIndex, MappedDomainIndex
+from dns.compiler import compile_blocklist
+from dns.server import load_blocked_domains
+from tests.bench_blocklist import _time_per_query, make_domains, make_queries
+
+
+def _measure(mode: str, path: str, queries: list[str]) -> dict:
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start = time.perf_counter()
+    if mode == "json":
+        index = DomainIndex(load_blocked_domains(Path(path)))
+    else:
+        index = MappedDomainIndex(Path(path))
+    startup = time.perf_counter() - start
+    per_query = _time_per_query(index.is_blocked, queries)
+    stats = {}
+    if isinstance(index, MappedDomainIndex):
+        stats = {**index.stats(), **index.bloom_stats(queries)}
+    return {
+        "mode": mode,
+        "startup_s": startup,
+        "rss_mb": (process.memory_info().rss - rss_before) / 2**20,
+        "us_per_query": per_query * 1e6,
+        "bloom_kb": stats.get("bloom_bytes", 0) / 1024,
+        "bloom_hit_ratio": stats.get("bloom_hit_ratio", 0.0),
+    }
+
+
+def run(sizes: list[int], queries_count: int = 20000) -> list[dict]:
+    results = []
+    ctx = get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            domains = make_domains(size)
+            queries = make_queries(domains, queries_count)
+            json_path = Path(tmp) / "domains.json"
+            index_path = Path(tmp) / "domains.idx"
+            plain_path = Path(tmp) / "plain.idx"
+            json_path.write_text(json.dumps({"blocked_domains": domains}))
+
+            start = time.perf_counter()
+            compile_blocklist([json_path], index_path)
+            compile_time = time.perf_counter() - start
+            compile_blocklist([json_path], plain_path, bloom_fp_rate=0)
+            del domains
+
+            modes = (("json", json_path), ("bloom", index_path), ("no bloom", plain_path))
+            for mode, path in modes:
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(_measure, (mode, str(path), queries))
+                results.append({"size": size, "compile_s": compile_time, **result})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(
+        f"{'domini':>9} {'modo':>9} {'avvio s':>8} {'RSS MB':>8} {'us/query':>9} "
+        f"{'compila s':>10} {'bloom KB':>9} {'scartati':>9}"
+    )
+    for r in run([int(s) for s in args.sizes.split(",")], args.queries):
+        print(
+            f"{r['size']:>9} {r['mode']:>9} {r['startup_s']:>8.3f} {r['rss_mb']:>8.1f} "
+            f"{r['us_per_query']:>9.2f} {r['compile_s']:>10.2f} {r['bloom_kb']:>9.0f} "
+            f"{r['bloom_hit_ratio']:>9.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Load test dei motori server ("threaded" dnslib contro "asyncio") su
+localhost, con upstream finto a latenza fissa e nomi tutti diversi
+(nessun hit di cache). Per ogni livello di concorrenza riporta QPS
+ottenute e latenza p50/p99.
+
+Uso: python -m tests.bench_engines [--concurrency 1,16,64,256] [--duration 3]
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from pathlib import Path
+
+from dnslib import DNSRecord
+
+from dns.blocklist import BlocklistHolder
+from dns.server import BlockResolver, start_dns_server
+from tests.fake_upstream import FakeUpstream
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.pending: dict[int, asyncio.Future] = {}
+
+    def datagram_received(self, data, addr):
+        future = self.pending.pop(int.from_bytes(data[:2], "big"), None)
+        if future and not future.done():
+            future.set_result(data)
+
+
+async def run_load(port: int, concurrency: int, duration: float, prefix: str, timeout: float = 2.0) -> dict:
+    """
+    Carico a ciclo chiuso: `concurrency` client che inviano una query
+    alla volta per `duration` secondi.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _ClientProtocol, remote_addr=("127.0.0.1", port)
+    )
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+    end = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < end:
+            request = DNSRecord.question(f"{prefix}-{next(counter)}.bench.example")
+            txid = random.getrandbits(16)
+            while txid in protocol.pending:
+                txid = random.getrandbits(16)
+            request.header.id = txid
+            future = loop.create_future()
+            protocol.pending[txid] = future
+            start = time.perf_counter()
+            transport.sendto(request.pack())
+            try:
+                await asyncio.wait_for(future, timeout)
+                latencies.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                protocol.pending.pop(txid, None)
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    transport.close()
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "queries": len(latencies),
+        "errors": errors,
+        "qps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else None,
+    }
+
+
+def _run_load_process(port: int, concurrency: int, duration: float, prefix: str) -> dict:
+    return asyncio.run(run_load(port, concurrency, duration, prefix))
+
+
+def _server_port(server) -> int:
+    if hasattr(server, "port"):
+        return server.port
+    return server.server.server_address[1]
+
+
+def run(engines: list[str], levels: list[int], duration: float, upstream_delay: float) -> list[dict]:
+    results = []
+    # Il client gira in un processo separato per non contendersi il GIL
+    # con il server sotto misura
+    with FakeUpstream(delay=upstream_delay) as upstream, multiprocessing.Pool(1) as client:
+        for engine in engines:
+            resolver = BlockResolver(blocklist=BlocklistHolder(Path("missing.json"), set))
+            resolver.upstream_dns_list = [upstream.address]
+            server = start_dns_server("127.0.0.1", 0, engine=engine, resolver=resolver)
+            try:
+                port = _server_port(server)
+                for level in levels:
+                    result = client.apply(_run_load_process, (port, level, duration, f"{engine}{level}"))
+                    results.append({"engine": engine, **result})
+            finally:
+                server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engines", default="threaded,asyncio")
+    parser.add_argument("--concurrency", default="1,16,64,256")
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--upstream-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    # dnslib e il resolver stampano ogni richiesta: fuori dalla misura
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = run(
+            args.engines.split(","),
+            [int(c) for c in args.concurrency.split(",")],
+            args.duration,
+            args.upstream_delay,
+        )
+
+    print(f"{'motore':>9} {'conc':>5} {'query':>7} {'err':>5} {'QPS':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(
+            f"{r['engine']:>9} {r['concurrency']:>5} {r['queries']:>7} {r['errors']:>5} "
+            f"{r['qps']:>8.0f} {r['p50_ms'] or 0:>8.2f} {r['p99_ms'] or 0:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+Microbenchmark delle funzioni sul percorso di ogni query
+(dns.server.normalize_domain, is_blocked con ogni tipo di lista
+bloccati, load_blocked_domains) per dimensioni della lista da 10 a 1M
+e distribuzioni di nomi realistiche, con baseline salvata in
+tests/baselines/bench_hotpath.json.
+
+I tempi vengono divisi per quelli di un carico di riferimento fisso
+misurato subito prima (calibrazione), così la baseline resta
+confrontabile tra macchine diverse e tra momenti di carico diversi.
+tests/test_bench_regression.py ripete le misure e fallisce se un caso
+è più lento della baseline oltre la tolleranza più il rumore misurato
+per quel caso quando la baseline è stata salvata (solo con
+DNS_BENCH_REGRESSION=1).
+
+Uso: python -m tests.bench_hotpath [--sizes 10,1000,100000,1000000] [--update [--runs 5]]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from dns.blocklist import DomainIndex, JournalOverlay, MappedDomainIndex
+from dns.compiler import compile_blocklist
+from dns.journal import BLOCKED_KEY, OP_ADD
+from dns.server import LOCAL_SUFFIXES, is_blocked, load_blocked_domains, normalize_domain
+from tests.bench_blocklist import TLDS, _random_label, make_domains
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "bench_hotpath.json"
+SIZES = (10, 1000, 100_000, 1_000_000)
+QUERIES = 20000
+# Giri per misura, ognuno preceduto dalla calibrazione
+REPEAT = 5
+
+
+# =========================
+# DISTRIBUZIONI DEI NOMI
+# =========================
+
+def make_qnames(domains: list[str], distribution: str, count: int = QUERIES, seed: int = 5) -> list[str]:
+    """
+    Nomi richiesti, come li produce parse_query (minuscolo, senza
+    punto finale):
+    - mixed: 1/3 sottodomini bloccati, 2/3 nomi puliti
+    - zipf:  pochi nomi popolari ripetuti (1 su 10 bloccato)
+    - deep:  nomi puliti con molte label (il caso peggiore della
+      ricerca per suffisso)
+    """
+    rng = random.Random(seed)
+    if distribution == "mixed":
+        return [
+            f"www.{rng.choice(domains)}" if i % 3 == 0
+            else f"cdn.{_random_label(rng)}.{rng.choice(TLDS)}"
+            for i in range(count)
+        ]
+    if distribution == "zipf":
+        popular = [
+            f"www.{rng.choice(domains)}" if i % 10 == 0 else f"{_random_label(rng)}.{rng.choice(TLDS)}"
+            for i in range(200)
+        ]
+        weights = [1 / rank ** 1.1 for rank in range(1, len(popular) + 1)]
+        return rng.choices(popular, weights=weights, k=count)
+    if distribution == "deep":
+        return [
+            ".".join(_random_label(rng) for _ in range(6)) + f".{rng.choice(TLDS)}"
+            for _ in range(count)
+        ]
+    raise ValueError(f"Distribuzione sconosciuta: {distribution}")
+
+
+DISTRIBUTIONS = ("mixed", "zipf", "deep")
+
+
+def make_raw_qnames(style: str, count: int = QUERIES, seed: int = 6) -> list[str]:
+    """
+    Input di normalize_domain:
+    - wire:   minuscolo senza punto finale (percorso sui byte)
+    - dnslib: maiuscole e punto finale (str(DNSLabel))
+    - local:  nomi con i suffissi della rete locale
+    """
+    rng = random.Random(seed)
+    names = [f"{_random_label(rng)}.{_random_label(rng)}.{rng.choice(TLDS)}" for _ in range(count)]
+    if style == "wire":
+        return names
+    if style == "dnslib":
+        return [name.capitalize() + "." for name in names]
+    if style == "local":
+        return [f"{name.split('.')[0]}.{rng.choice(LOCAL_SUFFIXES)}." for name in names]
+    raise ValueError(f"Stile sconosciuto: {style}")
+
+
+NORMALIZE_STYLES = ("wire", "dnslib", "local")
+
+
+# =========================
+# MISURE
+# =========================
+
+def _per_op(func, items) -> float:
+    # Nanosecondi per chiamata, un giro
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return (time.perf_counter() - start) / len(items) * 1e9
+
+
+def calibrate(rounds: int = 5) -> float:
+    """
+    Carico di riferimento fisso (operazioni su stringhe e dict come
+    quelle misurate): nanosecondi per iterazione su questa macchina,
+    il migliore di tre giri brevi.
+    """
+    words = [f"label{i}.example.com" for i in range(1000)]
+    table = dict.fromkeys(words[::2])
+
+    def step(word):
+        return word.rstrip(".").lower() in table or word.partition(".")[2] in table
+
+    items = words * rounds
+    return min(_per_op(step, items) for _ in range(3))
+
+
+def _warm_up(seconds: float = 1.0):
+    # Le prime misure dopo una pausa escono più lente (frequenza della CPU)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        calibrate()
+
+
+def _measure(func, items, repeat: int = REPEAT, per: int = 1) -> dict:
+    """
+    Nanosecondi per operazione (il giro migliore) e "score": il
+    rapporto con la calibrazione misurata subito prima di ogni giro
+    (mediana dei giri), così un rallentamento della macchina pesa su
+    entrambe le misure.
+    """
+    times = []
+    scores = []
+    for _ in range(repeat):
+        calibration = calibrate()
+        ns = _per_op(func, items) / per
+        times.append(ns)
+        scores.append(ns / calibration)
+    return {"ns": min(times), "score": statistics.median(scores)}
+
+
+def _matchers(domains: list[str], tmp: Path) -> dict:
+    # Liste bloccati su cui si misura is_blocked: set di stringhe,
+    # DomainIndex, indice compilato mappato e lo stesso con il journal
+    # davanti (il caso del resolver in esecuzione)
+    source = tmp / "domains.json"
+    source.write_text(json.dumps({"blocked_domains": domains}))
+    compile_blocklist([source], tmp / "domains.idx")
+    mapped = MappedDomainIndex(tmp / "domains.idx")
+    overlay = JournalOverlay(MappedDomainIndex(tmp / "domains.idx")).apply(
+        [(OP_ADD, BLOCKED_KEY, f"journal{i}.example") for i in range(20)]
+    )
+    blocked = set(domains)
+    return {
+        "set": blocked,
+        "index": DomainIndex(blocked),
+        "mapped": mapped,
+        "overlay": overlay,
+    }
+
+
+def run(sizes=SIZES, queries: int = QUERIES, normalize: bool = True, log=print) -> dict[str, dict]:
+    """
+    Misure di ogni caso, per nome: normalize_domain/<stile>,
+    is_blocked/<lista>/<dimensione>/<distribuzione> e
+    load_blocked_domains/<dimensione> (per voce della lista).
+    Per ogni caso: nanosecondi per operazione e "score", gli stessi
+    nanosecondi divisi per la calibrazione.
+    """
+    results = {}
+    _warm_up()
+    if normalize:
+        for style in NORMALIZE_STYLES:
+            results[f"normalize_domain/{style}"] = _measure(normalize_domain, make_raw_qnames(style, queries))
+
+    for size in sizes:
+        domains = make_domains(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            matchers = _matchers(domains, tmp)
+            for distribution in DISTRIBUTIONS:
+                qnames = make_qnames(domains, distribution, queries)
+                for name, matcher in matchers.items():
+                    results[f"is_blocked/{name}/{size}/{distribution}"] = _measure(
+                        lambda qname: is_blocked(qname, matcher), qnames
+                    )
+            # Caricamento: al più 3 giri sulle liste grandi
+            results[f"load_blocked_domains/{size}"] = _measure(
+                load_blocked_domains, [tmp / "domains.json"], 3 if size >= 100_000 else REPEAT, per=size
+            )
+            del matchers
+        log(f"[BENCH] lista da {size} domini misurata")
+    return results
+
+
+# =========================
+# BASELINE
+# =========================
+
+def load_baseline(path: Path = BASELINE_PATH) -> dict | None:
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def save_baseline(results: dict[str, dict], path: Path = BASELINE_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    baseline = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {
+            name: {
+                "ns": round(case["ns"], 2),
+                "score": round(case["score"], 4),
+                "spread": round(case.get("spread", 0.0), 4),
+            }
+            for name, case in sorted(results.items())
+        },
+    }
+    path.write_text(json.dumps(baseline, indent=2) + "\n")
+
+
+def compare(results: dict[str, dict], baseline: dict) -> dict[str, float]:
+    """
+    Rapporto tra lo score di ogni caso e quello della baseline (1.25 =
+    25% più lento). I casi assenti dalla baseline sono saltati.
+    """
+    ratios = {}
+    for name, case in results.items():
+        base = baseline["results"].get(name)
+        if base:
+            ratios[name] = case["score"] / base["score"]
+    return ratios
+
+
+def median_results(runs: list[dict[str, dict]]) -> dict[str, dict]:
+    """
+    Caso per caso, la mediana di più esecuzioni di run(): la baseline
+    non deve dipendere da un singolo giro fortunato o sfortunato.
+    "spread" è il rumore del caso: la distanza tra lo score più alto e
+    la mediana, relativa alla mediana (0 con una sola esecuzione).
+    """
+    results = {}
+    for name in runs[0]:
+        scores = [r[name]["score"] for r in runs]
+        score = statistics.median(scores)
+        results[name] = {
+            "ns": statistics.median(r[name]["ns"] for r in runs),
+            "score": score,
+            "spread": (max(scores) - score) / score,
+        }
+    return results
+
+
+def allowed_ratio(name: str, baseline: dict, tolerance: float) -> float:
+    """
+    Rapporto massimo con la baseline per un caso: la tolleranza (in
+    percentuale) più il rumore misurato per quel caso nella baseline.
+    """
+    base = baseline["results"].get(name) or {}
+    return 1 + tolerance / 100 + base.get("spread", 0.0)
+
+
+def _case_size(name: str) -> int | None:
+    parts = name.split("/")
+    if parts[0] == "is_blocked":
+        return int(parts[2])
+    if parts[0] == "load_blocked_domains":
+        return int(parts[1])
+    return None
+
+
+def check(sizes, baseline: dict, tolerance: float, retries: int = 2, log=print) -> dict[str, float]:
+    """
+    Rapporti con la baseline; i casi oltre allowed_ratio() vengono
+    rimisurati fino a `retries` volte e vale la misura migliore, così
+    un picco di carico isolato non basta a far fallire il controllo.
+    """
+    ratios = compare(run(sizes, log=log), baseline)
+    for _ in range(retries):
+        slow = [name for name, ratio in ratios.items() if ratio > allowed_ratio(name, baseline, tolerance)]
+        if not slow:
+            break
+        slow_sizes = sorted({_case_size(name) for name in slow} - {None})
+        normalize = any(_case_size(name) is None for name in slow)
+        for name, ratio in compare(run(slow_sizes, normalize=normalize, log=log), baseline).items():
+            ratios[name] = min(ratios.get(name, ratio), ratio)
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES))
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update", action="store_true", help="salva i risultati come nuova baseline")
+    parser.add_argument("--runs", type=int, help="esecuzioni di cui prendere la mediana (default: 5 con --update, altrimenti 1)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    runs = args.runs or (5 if args.update else 1)
+    results = median_results([run(sizes, args.queries) for _ in range(runs)])
+    baseline = None if args.update else load_baseline(args.baseline)
+    ratios = compare(results, baseline) if baseline else {}
+
+    print(f"CPU disponibili: {os.cpu_count()}")
+    print(f"{'caso':<42} {'ns/op':>10} {'baseline':>9}")
+    for name, case in results.items():
+        ratio = f"{ratios[name]:.2f}x" if name in ratios else "-"
+        print(f"{name:<42} {case['ns']:>10.1f} {ratio:>9}")
+
+    if args.update:
+        save_baseline(results, args.baseline)
+        print(f"Baseline salvata in {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Load test end-to-end: start_dns_server() su una porta locale contro un
+upstream finto (processo separato) con latenza e perdita
+configurabili. Un processo client invia a ritmo costante (ciclo aperto,
+--qps) un mix realistico di query:
+- repeat: pochi nomi popolari con distribuzione di Zipf (hit di cache)
+- tail:   nomi tutti diversi (miss, vanno all'upstream)
+- blocked: sottodomini della lista bloccati (sinkhole)
+
+Per ogni livello di QPS riporta throughput, latenza p50/p95/p99 (anche
+per tipo di query), CPU e RSS del server (psutil, worker compresi) e
+scrive tutto in JSON; con --compare confronta con un risultato
+precedente, ad esempio di un altro commit.
+
+Uso: python -m tests.bench_load [--qps 1000,5000] [--duration 5] [--upstream-delay 0.02]
+                                [--loss 0.01] [-o risultato.json] [--compare base.json]
+
+Senza -o il risultato va in logs/bench_load.json.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import get_context
+from pathlib import Path
+from unittest import mock
+
+import psutil
+from dnslib import DNSRecord
+
+import dns.server as dns_server
+from dns.blocklist import BlocklistHolder
+from dns.metrics import ResolverMetrics
+from dns.querylog import QueryLog
+from tests.bench_blocklist import _random_label, make_domains
+from tests.fake_upstream import FakeUpstream
+
+
+# In logs/ (ignorata da git) e non nella directory corrente
+OUTPUT_PATH = Path(__file__).resolve().parent.parent / "logs" / "bench_load.json"
+
+KINDS = ("repeat", "tail", "blocked")
+
+# Metriche confrontate da --compare: True = più alto è meglio
+COMPARED = {
+    "throughput_qps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "cpu_percent": False,
+    "rss_peak_mb": False,
+}
+
+
+# =========================
+# MIX DI QUERY
+# =========================
+
+def make_mix(
+    count: int,
+    blocked: list[str],
+    repeat_share: float = 0.6,
+    blocked_share: float = 0.1,
+    popular: int = 1000,
+    zipf: float = 1.1,
+    seed: int = 3,
+) -> list[tuple[str, str]]:
+    """
+    (tipo, nome) di `count` query, deterministiche dato `seed`.
+    """
+    rng = random.Random(seed)
+    names = [f"site{i}.{_random_label(rng)}.com" for i in range(popular)]
+    weights = list(_cumulative(1 / (rank ** zipf) for rank in range(1, popular + 1)))
+    queries = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < blocked_share and blocked:
+            queries.append(("blocked", f"{_random_label(rng)}.{rng.choice(blocked)}"))
+        elif roll < blocked_share + repeat_share:
+            queries.append(("repeat", rng.choices(names, cum_weights=weights)[0]))
+        else:
+            queries.append(("tail", f"u{i}.{_random_label(rng)}.net"))
+    return queries
+
+
+def _cumulative(values):
+    total = 0.0
+    for value in values:
+        total += value
+        yield total
+
+
+# =========================
+# CLIENT A CICLO APERTO
+# =========================
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, latencies: list[list[float]]):
+        # txid -> (indice del tipo, istante di invio)
+        self.pending: dict[int, tuple[int, float]] = {}
+        self.latencies = latencies
+
+    def datagram_received(self, data, addr):
+        sent = self.pending.pop(int.from_bytes(data[:2], "big"), None)
+        if sent is not None:
+            self.latencies[sent[0]].append(time.perf_counter() - sent[1])
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    # Nearest-rank su una lista già ordinata
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def _summary(latencies: list[float], timeout: float) -> dict:
+    answered = sorted(latency for latency in latencies if latency <= timeout)
+    return {
+        "answered": len(answered),
+        "p50_ms": _ms(_percentile(answered, 0.50)),
+        "p95_ms": _ms(_percentile(answered, 0.95)),
+        "p99_ms": _ms(_percentile(answered, 0.99)),
+    }
+
+
+def _ms(seconds: float | None) -> float | None:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+async def replay(port: int, queries: list[tuple[str, str]], qps: float, timeout: float = 2.0) -> dict:
+    """
+    Invia le query a ritmo costante (la i-esima all'istante i/qps,
+    indipendentemente dalle risposte) e misura la latenza di ciascuna.
+    Le risposte oltre `timeout` contano come perse.
+    """
+    loop = asyncio.get_running_loop()
+    latencies = [[] for _ in KINDS]
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: _ClientProtocol(latencies), remote_addr=("127.0.0.1", port)
+    )
+    kind_index = {kind: i for i, kind in enumerate(KINDS)}
+    # Pacchetti pronti prima della misura: il client non deve essere il collo di bottiglia
+    packets = [(kind_index[kind], DNSRecord.question(name).pack()[2:]) for kind, name in queries]
+    sent = [0] * len(KINDS)
+    pending = protocol.pending
+    txid = 0
+
+    start = time.perf_counter()
+    i = 0
+    while i < len(packets):
+        now = time.perf_counter()
+        while i < len(packets) and start + i / qps <= now:
+            kind, packet = packets[i]
+            # ID libero (le query perse restano in attesa fino alla fine)
+            txid = (txid + 1) & 0xFFFF
+            while txid in pending:
+                txid = (txid + 1) & 0xFFFF
+            pending[txid] = (kind, time.perf_counter())
+            transport.sendto(txid.to_bytes(2, "big") + packet)
+            sent[kind] += 1
+            i += 1
+        if i < len(packets):
+            await asyncio.sleep(max(0.0, start + i / qps - time.perf_counter()))
+    send_elapsed = time.perf_counter() - start
+    # Attesa delle ultime risposte (e delle risposte vuote del server
+    # per le query perse, che arrivano allo scadere della sua deadline)
+    deadline = time.perf_counter() + timeout + 0.2
+    while pending and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    transport.close()
+
+    overall = _summary([latency for per_kind in latencies for latency in per_kind], timeout)
+    return {
+        "target_qps": qps,
+        "sent": len(packets),
+        "send_rate_qps": round(len(packets) / send_elapsed, 1),
+        "throughput_qps": round(overall["answered"] / send_elapsed, 1),
+        "lost": len(packets) - overall["answered"],
+        **{key: value for key, value in overall.items() if key != "answered"},
+        "answered": overall["answered"],
+        "by_kind": {
+            kind: {"sent": sent[k], **_summary(latencies[k], timeout)}
+            for k, kind in enumerate(KINDS)
+        },
+    }
+
+
+def _replay_process(port: int, queries: list[tuple[str, str]], qps: float, timeout: float) -> dict:
+    return asyncio.run(replay(port, queries, qps, timeout))
+
+
+# =========================
+# UPSTREAM IN UN PROCESSO SEPARATO
+# =========================
+
+def _serve_upstream(conn, options: dict):
+    # Fuori dal processo del server: non ne sporca CPU e GIL
+    with FakeUpstream(**options) as upstream:
+        conn.send(upstream.address)
+        conn.recv()
+
+
+@contextlib.contextmanager
+def upstream_process(ctx, **options):
+    """
+    FakeUpstream in un processo figlio; produce il suo indirizzo.
+    """
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=_serve_upstream, args=(child, options), daemon=True)
+    process.start()
+    address = tuple(parent.recv())
+    try:
+        yield address
+    finally:
+        parent.send(None)
+        process.join(timeout=3)
+        if process.is_alive():
+            process.terminate()
+
+
+# =========================
+# CPU E MEMORIA DEL SERVER
+# =========================
+
+class ResourceSampler:
+    """
+    CPU (tempo utente + sistema) e RSS di picco del processo corrente
+    (il server) e dei processi worker, campionati in un thread. Client
+    e upstream finto sono processi a parte e non vengono contati.
+    """
+
+    def __init__(self, pids: list[int] = (), interval: float = 0.1):
+        self.processes = [psutil.Process()] + [psutil.Process(pid) for pid in pids]
+        self.interval = interval
+        self.rss_peak = 0
+        self._cpu = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = 0
+        for process in self.processes:
+            try:
+                times = process.cpu_times()
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+            self._cpu[process.pid] = times.user + times.system
+        self.rss_peak = max(self.rss_peak, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._cpu_start = sum(self._cpu.values())
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self.elapsed = time.perf_counter() - self._started
+        self.cpu_seconds = sum(self._cpu.values()) - self._cpu_start
+
+    def stats(self) -> dict:
+        return {
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "cpu_percent": round(self.cpu_seconds / self.elapsed * 100, 1),
+            "rss_peak_mb": round(self.rss_peak / 2**20, 1),
+        }
+
+
+# =========================
+# ESECUZIONE
+# =========================
+
+def run(
+    qps_levels: list[float],
+    duration: float,
+    upstream_delay: float,
+    loss: float,
+    engine: str = dns_server.DNS_ENGINE,
+    workers: int = 1,
+    blocked_count: int = 10000,
+    repeat_share: float = 0.6,
+    blocked_share: float = 0.1,
+    timeout: float = 2.0,
+    metrics: bool = False,
+    port: int = 0,
+) -> list[dict]:
+    results = []
+    ctx = get_context("spawn")
+    blocked = make_domains(blocked_count)
+    with tempfile.TemporaryDirectory() as tmp, \
+            upstream_process(ctx, delay=upstream_delay, loss=loss, seed=1) as upstream, \
+            ctx.Pool(1) as client:
+        source = Path(tmp) / "domains.json"
+        source.write_text(json.dumps({"blocked_domains": blocked}))
+
+        with mock.patch.object(dns_server, "CONFIG_PATH", source), \
+                mock.patch.object(dns_server, "BLOCKLIST_INDEX_PATH", Path(tmp) / "domains.idx"), \
+                mock.patch.object(dns_server, "QUERY_LOG_PATH", Path(tmp) / "queries.jsonl"):
+            for qps in qps_levels:
+                # Server nuovo per ogni livello: cache vuota, misure indipendenti
+                resolver = dns_server.BlockResolver(
+                    blocklist=BlocklistHolder(source, lambda: dns_server.load_blocked_domains(source)),
+                    query_log=QueryLog(Path(tmp) / "queries.jsonl"),
+                    metrics=ResolverMetrics() if metrics else None,
+                )
+                resolver.upstream_dns_list = [upstream]
+                # Stessa attesa del client: allo stop non restano query in volo
+                resolver.deadline = timeout
+                server = dns_server.start_dns_server(
+                    "127.0.0.1", port, engine=engine, resolver=resolver, workers=workers
+                )
+                queries = make_mix(
+                    int(qps * duration), blocked, repeat_share, blocked_share, seed=int(qps)
+                )
+                pids = server.stats()["pids"] if workers > 1 else []
+                try:
+                    with ResourceSampler(pids) as sampler:
+                        load = client.apply(_replay_process, (server.port, queries, qps, timeout))
+                finally:
+                    server.stop()
+                    resolver.close()
+                result = {**load, **sampler.stats()}
+                if metrics and workers == 1:
+                    result["metrics"] = resolver.metrics.stats()
+                results.append(result)
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict) -> list[dict]:
+    """
+    Variazione percentuale (positiva = peggio) delle metriche in
+    COMPARED, per i livelli di QPS presenti in entrambi i risultati.
+    """
+    rows = []
+    previous = {r["target_qps"]: r for r in old["results"]}
+    for result in new["results"]:
+        before = previous.get(result["target_qps"])
+        if before is None:
+            continue
+        for key, higher_is_better in COMPARED.items():
+            a, b = before.get(key), result.get(key)
+            if not a or b is None:
+                continue
+            change = (b - a) / a * 100
+            rows.append({
+                "target_qps": result["target_qps"],
+                "metric": key,
+                "before": a,
+                "after": b,
+                "worse_percent": round(-change if higher_is_better else change, 1),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qps", default="1000,5000")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--upstream-delay", type=float, default=0.02)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--engine", default=dns_server.DNS_ENGINE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0, help="porta del server (default: scelta dal sistema)")
+    parser.add_argument("--blocked", type=int, default=10000, help="domini nella lista bloccati")
+    parser.add_argument("--repeat-share", type=float, default=0.6)
+    parser.add_argument("--blocked-share", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--metrics", action="store_true", help="attiva le metriche per fase del resolver")
+    parser.add_argument("-o", "--output", type=Path, default=OUTPUT_PATH)
+    parser.add_argument("--compare", type=Path, help="risultato JSON precedente da confrontare")
+    args = parser.parse_args()
+
+    config = {
+        "engine": args.engine,
+        "workers": args.workers,
+        "duration": args.duration,
+        "upstream_delay": args.upstream_delay,
+        "loss": args.loss,
+        "blocked": args.blocked,
+        "repeat_share": args.repeat_share,
+        "blocked_share": args.blocked_share,
+        "timeout": args.timeout,
+        "metrics": args.metrics,
+    }
+    results = run(
+        [float(q) for q in args.qps.split(",")],
+        args.duration,
+        args.upstream_delay,
+        args.loss,
+        engine=args.engine,
+        workers=args.workers,
+        blocked_count=args.blocked,
+        repeat_share=args.repeat_share,
+        blocked_share=args.blocked_share,
+        timeout=args.timeout,
+        metrics=args.metrics,
+        port=args.port,
+    )
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": config,
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2))
+
+    print(f"{'QPS obiettivo':>13} {'inviate':>8} {'perse':>6} {'QPS':>8} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'CPU %':>6} {'RSS MB':>7}")
+    for r in results:
+        print(
+            f"{r['target_qps']:>13.0f} {r['sent']:>8} {r['lost']:>6} {r['throughput_qps']:>8.0f} "
+            f"{r['p50_ms'] or 0:>8.2f} {r['p95_ms'] or 0:>8.2f} {r['p99_ms'] or 0:>8.2f} "
+            f"{r['cpu_percent']:>6.1f} {r['rss_peak_mb']:>7.1f}"
+        )
+    print(f"Risultati in {args.output}")
+
+    if args.compare:
+        rows = compare(json.loads(args.compare.read_text()), report)
+        print(f"\nConfronto con {args.compare} (positivo = peggio)")
+        for row in rows:
+            print(
+                f"{row['target_qps']:>13.0f} {row['metric']:>15} {row['before']:>10} "
+                f"{row['after']:>10} {row['worse_percent']:>+7.1f}%"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark regole a pattern: 10k regole wildcard/regex provate una per
+una (una regex per regola, come fnmatch) contro PatternMatcher, che le
+compila insieme. Riporta tempo di costruzione, costo per query e QPS
+massime sostenibili dal solo matching.
+Le wildcard condividono un'unica regex a trie e il loro costo resta
+quasi costante; le regex re: sono solo messe in alternanza e costano in
+proporzione al loro numero (qui 1 regola su 50).
+
+Uso: python -m tests.bench_patterns [--rules 10000] [--queries 20000]
+"""
+import argparse
+import random
+import re
+import time
+
+from dns.patterns import REGEX_PREFIX, PatternMatcher
+from tests.bench_blocklist import TLDS, _random_label
+
+
+def make_rules(count: int, seed: int = 3) -> list[str]:
+    """
+    Mix di regole: wildcard dentro la label, label wildcard, "**" e
+    qualche regex.
+    """
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        kind = 4 if i % 50 == 49 else i % 4
+        label = _random_label(rng)
+        if kind == 0:
+            rules.append(f"{label[:4]}*.{_random_label(rng)}.{rng.choice(TLDS)}")
+        elif kind == 1:
+            rules.append(f"*.{label}.*")
+        elif kind == 2:
+            rules.append(f"**.{label}.{rng.choice(TLDS)}")
+        elif kind == 3:
+            rules.append(f"{label}-*.{rng.choice(TLDS)}")
+        else:
+            rules.append(f"{REGEX_PREFIX}^{label[:5]}[0-9]+\\.")
+    return rules
+
+
+def make_queries(rules: list[str], count: int, seed: int = 4) -> list[str]:
+    """
+    1 query su 10 colpisce una regola, le altre sono nomi puliti.
+    """
+    rng = random.Random(seed)
+    hits = [r for r in rules if r.startswith("*.")]
+    queries = []
+    for i in range(count):
+        if i % 10 == 0:
+            queries.append("www" + rng.choice(hits)[1:-2] + ".com")
+        else:
+            queries.append(f"www.{_random_label(rng)}.{rng.choice(TLDS)}")
+    return queries
+
+
+def _one_by_one(rules: list[str]):
+    # Riferimento: ogni regola è una regex a sé, provata in sequenza
+    compiled = [PatternMatcher([rule]) for rule in rules]
+
+    def match(domain):
+        for matcher in compiled:
+            if matcher.match(domain) is not None:
+                return True
+        return False
+    return match
+
+
+def _measure(name: str, build, queries: list[str]) -> dict:
+    start = time.perf_counter()
+    match = build()
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    hits = sum(1 for q in queries if match(q))
+    per_query = (time.perf_counter() - start) / len(queries)
+    return {
+        "mode": name,
+        "build_s": build_s,
+        "us_per_query": per_query * 1e6,
+        "max_qps": 1 / per_query,
+        "hits": hits,
+    }
+
+
+def run(rules_count: int, queries_count: int, baseline_queries: int) -> list[dict]:
+    rules = make_rules(rules_count)
+    queries = make_queries(rules, queries_count)
+    re.purge()
+    results = [_measure("combinato", lambda: (lambda m: lambda q: m.match(q) is not None)(PatternMatcher(rules)), queries)]
+    # La scansione regola per regola è lenta: meno query
+    results.append(_measure("una a una", lambda: _one_by_one(rules), queries[:baseline_queries]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--baseline-queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'modo':>10} {'build s':>8} {'us/query':>10} {'QPS max':>10} {'match':>6}")
+    for r in run(args.rules, args.queries, args.baseline_queries):
+        print(
+            f"{r['mode']:>10} {r['build_s']:>8.2f} {r['us_per_query']:>10.1f} "
+            f"{r['max_qps']:>10.0f} {r['hits']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Scalabilità con i processi worker (SO_REUSEPORT): QPS al crescere del
+numero di worker, con più processi client per generare abbastanza
+carico. Di default le query riguardano un dominio bloccato (risposta
+sinkhole, solo CPU del server); con --forward vanno all'upstream finto.
+Su una macchina con un solo core non ci si aspetta alcun guadagno.
+
+Uso: python -m tests.bench_workers [--workers 1,2,4] [--clients 4] [--duration 3]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from multiprocessing import get_context
+from pathlib import Path
+from unittest import mock
+
+import dns.server as dns_server
+from dns.blocklist import BlocklistHolder
+from tests.bench_engines import _run_load_process
+from tests.fake_upstream import FakeUpstream
+
+
+def run(worker_levels: list[int], clients: int, concurrency: int, duration: float, engine: str, forward: bool) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, FakeUpstream() as upstream, \
+            get_context("spawn").Pool(clients) as pool:
+        source = Path(tmp) / "domains.json"
+        blocked = [] if forward else ["bench.example"]
+        source.write_text(json.dumps({"blocked_domains": blocked}))
+
+        with mock.patch.object(dns_server, "CONFIG_PATH", source), \
+                mock.patch.object(dns_server, "BLOCKLIST_INDEX_PATH", Path(tmp) / "domains.idx"):
+            for workers in worker_levels:
+                # Con più worker del resolver si usano solo gli upstream
+                resolver = dns_server.BlockResolver(
+                    blocklist=BlocklistHolder(source, lambda: dns_server.load_blocked_domains(source))
+                )
+                resolver.upstream_dns_list = [upstream.address]
+                server = dns_server.start_dns_server(
+                    "127.0.0.1", 0, engine=engine, resolver=resolver, workers=workers
+                )
+                try:
+                    jobs = [
+                        pool.apply_async(_run_load_process, (server.port, concurrency, duration, f"w{workers}c{c}"))
+                        for c in range(clients)
+                    ]
+                    loads = [job.get() for job in jobs]
+                finally:
+                    server.stop()
+                    resolver.close()
+                results.append({
+                    "workers": workers,
+                    "queries": sum(r["queries"] for r in loads),
+                    "errors": sum(r["errors"] for r in loads),
+                    "qps": sum(r["qps"] for r in loads),
+                    "p99_ms": max(r["p99_ms"] or 0 for r in loads),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--engine", default="asyncio")
+    parser.add_argument("--forward", action="store_true")
+    args = parser.parse_args()
+
+    # Il resolver stampa ogni dominio bloccato: fuori dalla misura.
+    # Redirezione sul file descriptor, ereditata dai processi worker
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            results = run(
+                [int(w) for w in args.workers.split(",")],
+                args.clients,
+                args.concurrency,
+                args.duration,
+                args.engine,
+                args.forward,
+            )
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+    print(f"CPU disponibili: {os.cpu_count()}")
+    print(f"{'worker':>7} {'query':>8} {'err':>6} {'QPS':>9} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['queries']:>8} {r['errors']:>6} {r['qps']:>9.0f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
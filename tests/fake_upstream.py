@@ -0,0 +1,197 @@
+"""
+Upstream DNS finto per test e benchmark: risponde in locale con un
+record A fisso, con latenza e perdita configurabili. Ascolta anche in
+TCP sulla stessa porta e, come un server vero, tronca (bit TC) le
+risposte UDP più grandi di quanto accetta il client.
+"""
+import heapq
+import itertools
+import random
+import socket
+import struct
+import threading
+import time
+
+from dnslib import DNSRecord, QTYPE, RR, A
+
+from dns.upstream import recv_exact
+from dns.wire import fit_udp, udp_payload_size
+
+
+class FakeUpstream:
+    def __init__(
+        self,
+        delay: float = 0.0,
+        loss: float = 0.0,
+        answer: str = "10.0.0.1",
+        ttl: int = 300,
+        respond: bool = True,
+        seed: int | None = None,
+        answers: int = 1,
+    ):
+        self.delay = delay
+        self.loss = loss
+        self.answer = answer
+        self.ttl = ttl
+        self.respond = respond
+        self.answers = answers
+        self.received = 0
+        self.clients = set()
+        self.tcp_received = 0
+        self.tcp_connections = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sock, self._tcp_sock = self._bind_pair()
+        self._sock.settimeout(0.2)
+        self.address = self._sock.getsockname()
+        self._tcp_sock.listen()
+        self._tcp_sock.settimeout(0.2)
+        self._tcp_clients = []
+        self._running = False
+        self._thread = None
+        # Risposte ritardate: un solo thread con coda a priorità
+        self._delayed = []
+        self._seq = itertools.count()
+        self._delayed_cond = threading.Condition()
+        self._delay_thread = None
+        self._tcp_thread = None
+
+    @staticmethod
+    def _bind_pair() -> tuple[socket.socket, socket.socket]:
+        # La porta UDP scelta dal kernel può essere già occupata in TCP
+        while True:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.bind(("127.0.0.1", 0))
+            tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                tcp.bind(udp.getsockname())
+            except OSError:
+                udp.close()
+                tcp.close()
+                continue
+            return udp, tcp
+
+    def build_reply(self, data: bytes) -> bytes:
+        request = DNSRecord.parse(data)
+        reply = request.reply()
+        if request.q.qtype == QTYPE.A:
+            for _ in range(self.answers):
+                reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=self.ttl, rdata=A(self.answer)))
+        return reply.pack()
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                self.received += 1
+                self.clients.add(addr)
+            if not self.respond or (self.loss and self._rng.random() < self.loss):
+                continue
+            if self.delay:
+                with self._delayed_cond:
+                    due = time.monotonic() + self.delay
+                    heapq.heappush(self._delayed, (due, next(self._seq), data, addr))
+                    self._delayed_cond.notify()
+            else:
+                self._reply(data, addr)
+
+    def _serve_delayed(self):
+        while self._running:
+            with self._delayed_cond:
+                if not self._delayed:
+                    self._delayed_cond.wait(0.2)
+                    continue
+                wait = self._delayed[0][0] - time.monotonic()
+                if wait > 0:
+                    self._delayed_cond.wait(wait)
+                    continue
+                _, _, data, addr = heapq.heappop(self._delayed)
+            self._reply(data, addr)
+
+    def _reply(self, data: bytes, addr):
+        try:
+            reply = fit_udp(self.build_reply(data), udp_payload_size(data))
+            self._sock.sendto(reply, addr)
+        except OSError:
+            pass
+
+    def _serve_tcp(self):
+        while self._running:
+            try:
+                conn, _ = self._tcp_sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                self.tcp_connections += 1
+                self._tcp_clients.append(conn)
+            threading.Thread(target=self._serve_tcp_client, args=(conn,), daemon=True).start()
+
+    def _serve_tcp_client(self, conn: socket.socket):
+        try:
+            while True:
+                header = recv_exact(conn, 2)
+                if header is None:
+                    break
+                data = recv_exact(conn, struct.unpack("!H", header)[0])
+                if data is None:
+                    break
+                with self._lock:
+                    self.tcp_received += 1
+                if not self.respond:
+                    continue
+                if self.delay:
+                    time.sleep(self.delay)
+                reply = self.build_reply(data)
+                conn.sendall(struct.pack("!H", len(reply)) + reply)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def drop_tcp(self):
+        """
+        Chiude le connessioni TCP aperte, come un server al timeout di
+        inattività.
+        """
+        with self._lock:
+            clients, self._tcp_clients = self._tcp_clients, []
+        for conn in clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self) -> "FakeUpstream":
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._delay_thread = threading.Thread(target=self._serve_delayed, daemon=True)
+        self._delay_thread.start()
+        self._tcp_thread = threading.Thread(target=self._serve_tcp, daemon=True)
+        self._tcp_thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._delayed_cond:
+            self._delayed_cond.notify()
+        for thread in (self._thread, self._delay_thread, self._tcp_thread):
+            if thread:
+                thread.join(timeout=1)
+        self.drop_tcp()
+        self._sock.close()
+        self._tcp_sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
@@ -0,0 +1,28 @@
+import os
+import unittest
+
+from tests.bench_hotpath import SIZES, allowed_ratio, check, load_baseline
+
+# Opt-in: le misure durano circa un minuto e dipendono dal carico della macchina
+ENABLED = os.environ.get("DNS_BENCH_REGRESSION") == "1"
+# Rallentamento massimo rispetto alla baseline, in percentuale, oltre
+# al rumore di ogni caso salvato con la baseline
+TOLERANCE = float(os.environ.get("DNS_BENCH_TOLERANCE", "20"))
+# Dimensioni della lista misurate (default: tutte quelle della baseline)
+BENCH_SIZES = [int(s) for s in os.environ.get("DNS_BENCH_SIZES", ",".join(map(str, SIZES))).split(",")]
+
+
+@unittest.skipUnless(ENABLED, "impostare DNS_BENCH_REGRESSION=1 per confrontare con la baseline")
+class TestHotPathRegression(unittest.TestCase):
+    def test_no_case_slower_than_baseline(self):
+        baseline = load_baseline()
+        self.assertIsNotNone(baseline, "baseline mancante: python -m tests.bench_hotpath --update")
+        ratios = check(BENCH_SIZES, baseline, TOLERANCE, log=lambda message: None)
+
+        self.assertTrue(ratios, "nessun caso in comune con la baseline")
+        for name, ratio in sorted(ratios.items()):
+            limit = allowed_ratio(name, baseline, TOLERANCE)
+            with self.subTest(case=name):
+                self.assertLessEqual(
+                    ratio, limit, f"{name}: {ratio:.2f}x la baseline (limite {limit:.2f}x)"
+                )
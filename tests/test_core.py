@@ -1,13 +1,19 @@
 from pathlib import Path
 import json
 import tempfile
+import time
 import unittest
+import urllib.request
 from unittest import mock
 
 import config.domain_manager as domain_manager
 import state.blocker_state as blocker_state
 import system.network as network
 import system.security as security
+from dns.blocklist import BlocklistHolder
+from dns.metrics import ResolverMetrics
+from dns.tracing import SlowQueryTracer
+from gui.controller import AppController
 from gui.main_window import MainWindow
 from PyQt6.QtWidgets import QApplication
 
@@ -73,6 +79,68 @@ class TestDomainManager(unittest.TestCase):
 
         self.assertEqual(loaded, ["test.com"])
 
+    def test_edits_append_to_journal_without_rewriting_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_file = Path(tmp) / "domains.json"
+            with mock.patch.object(domain_manager, "DOMAINS_FILE", tmp_file):
+                domain_manager.save_domains(["example.com"])
+                snapshot = tmp_file.read_text()
+                domain_manager.add_domain("Test.com")
+                domain_manager.remove_domain("example.com")
+                journal = tmp_file.with_suffix(".journal").read_text().splitlines()
+                loaded = domain_manager.load_domains()
+                after = tmp_file.read_text()
+
+        self.assertEqual(after, snapshot)
+        self.assertEqual(len(journal), 2)
+        self.assertEqual(loaded, ["test.com"])
+
+    def test_compact_folds_journal_and_interrupted_rotation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_file = Path(tmp) / "domains.json"
+            journal = tmp_file.with_suffix(".journal")
+            with mock.patch.object(domain_manager, "DOMAINS_FILE", tmp_file):
+                domain_manager.save_domains(["example.com"])
+                domain_manager.add_domain("a.com")
+                # Compattazione interrotta dopo la rotazione del journal
+                journal.rename(journal.with_name(journal.name + ".old"))
+                domain_manager.add_domain("b.com")
+                domain_manager.remove_domain("example.com")
+                self.assertEqual(domain_manager.load_domains(), ["a.com", "b.com"])
+
+                domain_manager.compact()
+                leftovers = sorted(p.name for p in Path(tmp).iterdir())
+                snapshot = json.loads(tmp_file.read_text())["blocked_domains"]
+                domain_manager.compact()
+                loaded = domain_manager.load_domains()
+                final = json.loads(tmp_file.read_text())["blocked_domains"]
+
+        # Il primo giro riversa solo il journal ruotato; il secondo il resto
+        self.assertEqual(snapshot, ["a.com", "example.com"])
+        self.assertEqual(leftovers, ["domains.journal", "domains.json"])
+        self.assertEqual(final, ["a.com", "b.com"])
+        self.assertEqual(loaded, ["a.com", "b.com"])
+
+    def test_journal_compacted_in_background_over_threshold(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_file = Path(tmp) / "domains.json"
+            with (
+                mock.patch.object(domain_manager, "DOMAINS_FILE", tmp_file),
+                mock.patch.object(domain_manager, "JOURNAL_COMPACT_BYTES", 200),
+            ):
+                for i in range(5):
+                    domain_manager.add_domain(f"site{i}.com")
+                deadline = time.monotonic() + 5
+                while tmp_file.with_suffix(".journal.old").exists() or not tmp_file.exists():
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.01)
+                with domain_manager._compact_lock:
+                    snapshot = json.loads(tmp_file.read_text())["blocked_domains"]
+                loaded = domain_manager.load_domains()
+
+        self.assertTrue(snapshot)
+        self.assertEqual(loaded, [f"site{i}.com" for i in range(5)])
+
 
 class TestBlockerState(unittest.TestCase):
     def test_save_and_load_state(self):
@@ -156,6 +224,87 @@ class TestNetwork(unittest.TestCase):
                 self.assertIsNone(network.load_dns_state())
 
 
+class TestControllerBlocklistDeltas(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.holder = BlocklistHolder(Path(tmp.name) / "domains.idx", lambda: ["facebook.com"], check_interval=3600)
+        server = mock.Mock()
+        server.resolver.blocklist = self.holder
+        server.resolver.metrics = None
+        server.resolver.tracer = None
+        self.server = server
+        for patcher in (
+            mock.patch.object(domain_manager, "DOMAINS_FILE", Path(tmp.name) / "domains.json"),
+            mock.patch("gui.controller.refresh_dns_state"),
+            mock.patch("gui.controller.set_dns_localhost"),
+            mock.patch("gui.controller.set_dns_automatic"),
+            mock.patch("gui.controller.save_state"),
+            mock.patch("gui.controller.start_dns_server", return_value=server),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.controller = AppController(lambda message: None)
+
+    def test_edits_reach_running_index_without_reload(self):
+        self.controller.start()
+        self.controller.add_domain("Ads.Example.com")
+        self.controller.add_allowed_domain("cdn.facebook.com")
+
+        index = self.holder.get()
+        self.assertTrue(index.is_blocked("x.ads.example.com"))
+        self.assertFalse(index.is_blocked("cdn.facebook.com"))
+        self.assertTrue(index.is_blocked("www.facebook.com"))
+
+        self.controller.remove_domain("facebook.com")
+        self.assertFalse(self.holder.get().is_blocked("www.facebook.com"))
+        # Salvate anche su disco
+        self.assertEqual(domain_manager.load_domains(), ["ads.example.com"])
+
+    def test_edits_only_saved_when_stopped(self):
+        self.controller.add_domain("ads.example.com")
+
+        self.assertFalse(self.holder.get().is_blocked("ads.example.com"))
+        self.assertEqual(domain_manager.load_domains(), ["ads.example.com"])
+
+
+    def test_metrics_exposed_while_running(self):
+        self.assertIsNone(self.controller.get_metrics())
+        self.server.resolver.metrics = ResolverMetrics()
+        self.server.resolver.metrics.count("blocked")
+        with mock.patch("gui.controller.METRICS_PORT", 0):
+            self.controller.start()
+        port = self.controller.metrics_server.port
+
+        self.assertEqual(self.controller.get_metrics()["blocked"], 1)
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+            self.assertIn('dns_blocker_queries_total{verdict="blocked"} 1', response.read().decode())
+
+        self.controller.stop()
+        self.assertIsNone(self.controller.metrics_server)
+        with self.assertRaises(OSError):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2)
+
+    def test_slow_queries_dumped_on_demand(self):
+        self.controller.start()
+        self.assertIsNone(self.controller.dump_slow_queries())
+        tracer = SlowQueryTracer(threshold=0, sample_rate=1.0)
+        self.server.resolver.tracer = tracer
+        trace = tracer.start("slow.example", 1)
+        trace.record_cache(False)
+        tracer.finish(trace)
+
+        self.assertTrue(self.controller.set_slow_query_sample_rate(5))
+        self.assertEqual(tracer.sample_rate, 1.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch("gui.controller.SLOW_QUERY_DUMP_DIR", Path(tmp)):
+                path, count = self.controller.dump_slow_queries()
+            self.assertEqual(path.parent, Path(tmp))
+            self.assertEqual(count, 1)
+            self.assertEqual(json.loads(path.read_text(encoding="utf-8")), self.controller.get_slow_queries())
+        self.assertEqual(self.controller.get_slow_queries()[0]["qname"], "slow.example")
+
+
 class TestMainWindowGui(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -201,6 +350,30 @@ class TestMainWindowGui(unittest.TestCase):
         self.assertFalse(event.ignored)
         controller.stop.assert_called_once()
 
+    def test_add_domain_goes_through_controller(self):
+        with mock.patch("gui.main_window.AppController") as controller_cls:
+            controller = controller_cls.return_value
+            controller.is_running = True
+            window = MainWindow()
+
+        window.domain_input.setText("ads.example.com")
+        with mock.patch.object(window, "load_domains_to_ui"):
+            window.handle_add_domain()
+
+        controller.add_domain.assert_called_once_with("ads.example.com")
+
+    def test_slow_queries_button_dumps_through_controller(self):
+        with mock.patch("gui.main_window.AppController") as controller_cls:
+            controller = controller_cls.return_value
+            controller.dump_slow_queries.return_value = (Path("logs/slow-queries.json"), 3)
+            window = MainWindow()
+
+        with mock.patch.object(window, "_show_info") as show_info:
+            window.slow_queries_btn.click()
+
+        controller.dump_slow_queries.assert_called_once_with()
+        self.assertIn("3 query lente", show_info.call_args.args[1])
+
 
 if __name__ == "__main__":
     unittest.main()
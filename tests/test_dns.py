@@ -0,0 +1,1459 @@
+from pathlib import Path
+import json
+import os
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from dnslib import DNSRecord, EDNS0, QTYPE, RCODE, RR, A, SOA
+
+import config.domain_manager as domain_manager
+import config.importer as config_importer
+import dns.blocklist as dns_blocklist
+import dns.cache as dns_cache
+import dns.compiler as dns_compiler
+import dns.server as dns_server
+from dns.blocklist import BlocklistHolder, BloomFilter, DomainIndex, JournalOverlay, MappedDomainIndex, write_hash_index
+from dns.aio_server import AsyncDNSServer
+from dns.cache import DNSCache
+from dns.journal import ALLOWED_KEY, BLOCKED_KEY, OP_ADD, OP_REMOVE, JournalReader
+from dns.metrics import Histogram, MetricsServer, ResolverMetrics
+from dns.patterns import PatternMatcher
+from dns.querylog import QueryLog
+from dns.tracing import SlowQueryTracer
+import dns.upstream as dns_upstream
+from dns.upstream import UpstreamConnection, UpstreamHealth, UpstreamPool, _PendingQuery
+from dns.wire import fit_udp, parse_query, question_bytes, reply_ttl, udp_payload_size
+from tests.fake_upstream import FakeUpstream
+
+
+class TestBlocklistIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DomainIndex({"example.com", "ads.tracker.net"})
+
+    def test_exact_match_blocked(self):
+        self.assertTrue(self.index.is_blocked("example.com"))
+        self.assertEqual(self.index.match("example.com"), "example.com")
+
+    def test_subdomain_blocked(self):
+        self.assertTrue(self.index.is_blocked("www.example.com"))
+        self.assertEqual(self.index.match("a.b.ads.tracker.net"), "ads.tracker.net")
+
+    def test_parent_and_partial_label_not_blocked(self):
+        self.assertFalse(self.index.is_blocked("tracker.net"))
+        self.assertFalse(self.index.is_blocked("notexample.com"))
+        self.assertFalse(self.index.is_blocked("example.com.evil.org"))
+
+    def test_is_blocked_accepts_set_and_index(self):
+        blocked = {"example.com"}
+        self.assertTrue(dns_server.is_blocked("x.example.com", blocked))
+        self.assertTrue(dns_server.is_blocked("x.example.com", DomainIndex(blocked)))
+        self.assertFalse(dns_server.is_blocked("example.org", blocked))
+
+    def test_normalize_then_match_local_suffix(self):
+        domain = dns_server.normalize_domain("WWW.Example.com.lan.")
+        self.assertTrue(self.index.is_blocked(domain))
+
+
+class TestBlocklistHolder(unittest.TestCase):
+    def _write(self, path: Path, domains, mtime_ns: int):
+        path.write_text(json.dumps({"blocked_domains": domains}))
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def _make_holder(self, path: Path) -> BlocklistHolder:
+        return BlocklistHolder(path, dns_server.load_blocked_domains, check_interval=0)
+
+    def _wait_reload(self, holder: BlocklistHolder):
+        thread = holder._reload_thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def test_index_reused_until_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "domains.json"
+            self._write(path, ["example.com"], 1_000_000_000)
+            with mock.patch.object(dns_server, "CONFIG_PATH", path):
+                holder = self._make_holder(path)
+                first = holder.get()
+                self.assertIs(holder.get(), first)
+
+                self._write(path, ["example.com", "test.com"], 2_000_000_000)
+                holder.get()
+                self._wait_reload(holder)
+                second = holder.get()
+
+        self.assertIsNot(second, first)
+        self.assertTrue(second.is_blocked("www.test.com"))
+
+    def test_invalid_file_keeps_previous_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "domains.json"
+            self._write(path, ["example.com"], 1_000_000_000)
+            with mock.patch.object(dns_server, "CONFIG_PATH", path):
+                holder = self._make_holder(path)
+                path.write_text("{ non-json")
+                with mock.patch("builtins.print"):
+                    holder.get()
+                    self._wait_reload(holder)
+                    index = holder.get()
+
+        self.assertTrue(index.is_blocked("example.com"))
+
+    def test_reload_does_not_block_queries(self):
+        loaded = threading.Event()
+        domains = [["example.com"]]
+
+        def slow_loader():
+            if domains[0] != ["example.com"]:
+                loaded.wait(5)
+            return domains[0]
+
+        holder = BlocklistHolder(Path("missing.json"), slow_loader, check_interval=0, signature=lambda: domains[0])
+        first = holder.get()
+        domains[0] = ["test.com"]
+        start = time.monotonic()
+        self.assertIs(holder.get(), first)
+        self.assertLess(time.monotonic() - start, 1)
+
+        loaded.set()
+        self._wait_reload(holder)
+        self.assertTrue(holder.get().is_blocked("www.test.com"))
+
+    def test_each_compiled_version_gets_its_own_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            output = Path(tmp) / "domains.idx"
+            self._write(source, ["example.com"], 1_000_000_000)
+            first = dns_compiler.load_compiled([source], output)
+            self._write(source, ["example.com", "test.com"], 2_000_000_000)
+            # La versione in uso resta mappata: su Windows non si potrebbe sostituire
+            second = dns_compiler.load_compiled([source], output)
+
+            self.assertNotEqual(first.path, second.path)
+            self.assertFalse(first.is_blocked("test.com"))
+            self.assertTrue(second.is_blocked("test.com"))
+            self.assertEqual([p.name for p in Path(tmp).glob("domains.*.idx")], [Path(second.path).name])
+
+
+class TestMappedIndex(unittest.TestCase):
+    def test_mapped_index_matches_domain_index(self):
+        domains = {"example.com", "ads.tracker.net"}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "domains.idx"
+            write_hash_index(domains, path)
+            mapped = MappedDomainIndex(path)
+            reference = DomainIndex(domains)
+            for name in ("example.com", "www.example.com", "a.b.ads.tracker.net",
+                         "tracker.net", "notexample.com", "example.com.evil.org"):
+                with self.subTest(name=name):
+                    self.assertEqual(mapped.match(name), reference.match(name))
+            self.assertEqual(len(mapped), 2)
+            self.assertTrue(dns_server.is_blocked("www.example.com", mapped))
+
+    def test_holder_accepts_prebuilt_index_and_empty_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "domains.idx"
+            write_hash_index([], path)
+            holder = BlocklistHolder(path, lambda: MappedDomainIndex(path), check_interval=0)
+            self.assertIsInstance(holder.get(), MappedDomainIndex)
+            self.assertFalse(holder.get().is_blocked("example.com"))
+
+    def test_invalid_index_file_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "domains.idx"
+            path.write_bytes(b"not an index at all, just some bytes")
+            with self.assertRaises(ValueError):
+                MappedDomainIndex(path)
+            self.assertIsNone(dns_blocklist.read_index_header(path))
+
+
+class TestBloomFilter(unittest.TestCase):
+    def _compile(self, domains, fp_rate) -> MappedDomainIndex:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "domains.idx"
+        write_hash_index(domains, path, bloom_fp_rate=fp_rate)
+        return MappedDomainIndex(path)
+
+    def test_no_false_negatives_and_bounded_false_positives(self):
+        blocked = [f"blocked{i}.example" for i in range(5000)]
+        index = self._compile(blocked, 0.01)
+
+        for domain in blocked:
+            self.assertTrue(index.is_blocked(f"www.{domain}"))
+        clean = [f"clean{i}.test" for i in range(20000)]
+        false_positives = sum(index.bloom.might_contain(d) for d in clean)
+        self.assertLess(false_positives / len(clean), 0.03)
+
+    def test_stats_report_memory_and_hit_ratio(self):
+        index = self._compile([f"blocked{i}.example" for i in range(1000)], 0.01)
+        stats = index.stats()
+        bloom = index.bloom_stats([f"host{i}.clean.test" for i in range(100)] + ["www.blocked1.example"])
+
+        self.assertEqual(stats["entries"], 1000)
+        self.assertEqual(stats["bloom_hashes"], 7)
+        # ~9.6 bit per voce all'1%
+        self.assertAlmostEqual(stats["bloom_bytes"], 1200, delta=20)
+        self.assertEqual(bloom["lookups"], 303)
+        self.assertGreater(bloom["bloom_hit_ratio"], 0.9)
+        self.assertLess(bloom["bloom_observed_fp_rate"], 0.05)
+
+    def test_hash_count_follows_rate_not_padding(self):
+        self.assertEqual(BloomFilter.parameters(1, 0.01), (64, 7))
+        self.assertEqual(BloomFilter.parameters(10, 0.2)[1], 2)
+        self.assertEqual(BloomFilter.parameters(1_000_000, 1e-6)[1], dns_blocklist.BLOOM_MAX_HASHES)
+
+    def test_filter_can_be_disabled(self):
+        index = self._compile(["example.com"], 0)
+        self.assertIsNone(index.bloom)
+        self.assertTrue(index.is_blocked("www.example.com"))
+        self.assertEqual(index.stats()["bloom_bytes"], 0)
+
+
+class TestPatternRules(unittest.TestCase):
+    def test_wildcard_syntax(self):
+        cases = [
+            ("ads*.example.com", "ads.example.com", True),
+            ("ads*.example.com", "ads42.example.com", True),
+            ("ads*.example.com", "x.ads42.example.com", True),
+            ("ads*.example.com", "bads.example.com", False),
+            ("ads*.example.com", "ads.x.example.com", False),
+            ("*.tracking.*", "eu.tracking.net", True),
+            ("*.tracking.*", "a.eu.tracking.net", True),
+            ("*.tracking.*", "tracking.net", False),
+            ("*.tracking.*", "eu.tracking.net.evil", False),
+            ("**.cdn.example", "a.b.cdn.example", True),
+            ("**.cdn.example", "cdn.example", False),
+            ("re:^ad[0-9]+\\.", "ad12.example.org", True),
+            ("re:^ad[0-9]+\\.", "bad12.example.org", False),
+        ]
+        for rule, name, expected in cases:
+            with self.subTest(rule=rule, name=name):
+                self.assertEqual(PatternMatcher([rule]).match(name) is not None, expected)
+
+    def test_rules_combined_in_one_matcher(self):
+        matcher = PatternMatcher(["ads*.example.com", "ad*.example.com", "*.tracking.*", "re:[", "re:^x"])
+        self.assertEqual(len(matcher), 4)
+        self.assertEqual(matcher.invalid[0][0], "re:[")
+        self.assertEqual(matcher.match("www.ads1.example.com"), "ads1.example.com")
+        self.assertEqual(matcher.match("adv.example.com"), "adv.example.com")
+        self.assertEqual(matcher.match("xyz.test"), "xyz.test")
+        self.assertIsNone(matcher.match("example.com"))
+
+    def test_compiled_index_applies_patterns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            index_path = Path(tmp) / "domains.idx"
+            source.write_text(json.dumps({"blocked_domains": [
+                "example.com", "ADS*.Example.org", "re:^ad\\D", "re:(",
+            ]}))
+            with mock.patch("builtins.print") as fake_print:
+                count = dns_compiler.compile_blocklist([source], index_path)
+            index = MappedDomainIndex(index_path)
+
+            self.assertEqual(count, 1)
+            self.assertEqual(index.stats()["patterns"], 2)
+            self.assertIn("re:(", fake_print.call_args[0][0])
+            self.assertTrue(dns_server.is_blocked("www.example.com", index))
+            self.assertTrue(dns_server.is_blocked("ads1.example.org", index))
+            # Regex non convertite in minuscolo: \D resta "non cifra"
+            self.assertTrue(index.is_blocked("adx.test"))
+            self.assertFalse(index.is_blocked("ad1.test"))
+            self.assertFalse(index.is_blocked("example.org"))
+
+    def test_uncombinable_regex_never_disables_list(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            index_path = Path(tmp) / "domains.idx"
+            source.write_text(json.dumps({"blocked_domains": [
+                "ads.example.com", "re:(?i)^tracker", "re:(?P<n>x)\\.", "re:(a)\\1",
+            ]}))
+            with mock.patch("builtins.print") as fake_print:
+                dns_compiler.compile_blocklist([source], index_path)
+            index = MappedDomainIndex(index_path)
+
+            # Flag globali riscritti come locali; gruppi con nome e
+            # riferimenti all'indietro scartati con un avviso
+            self.assertEqual(index.stats()["patterns"], 1)
+            self.assertEqual(fake_print.call_count, 2)
+            self.assertTrue(index.is_blocked("www.ads.example.com"))
+            self.assertTrue(index.is_blocked("tracker.net"))
+        with self.assertRaises(ValueError):
+            config_importer.parse_line("re:(?P<n>ads)")
+        # Indici già compilati con regole non combinabili: applicate una per una
+        matcher = PatternMatcher(["re:(?P<n>ads)", "re:(?P<n>trk)", "re:(a)\\1\\.com", "re:^x"])
+        self.assertEqual(len(matcher), 4)
+        for name in ("ads.net", "trk.net", "aa.com", "xyz.test"):
+            self.assertEqual(matcher.match(name), name)
+        self.assertIsNone(matcher.match("ab.com"))
+
+
+class TestAllowlist(unittest.TestCase):
+    BLOCKED = ["facebook.com", "ads*.example.org", "tracker.net"]
+    ALLOWED = ["cdn.facebook.com", "good.ads1.example.org", "tracker.net"]
+    CASES = [
+        ("www.facebook.com", True),
+        ("cdn.facebook.com", False),
+        ("img.cdn.facebook.com", False),
+        ("ads1.example.org", True),
+        ("good.ads1.example.org", False),
+        # A parità di nome vince l'eccezione
+        ("x.tracker.net", False),
+        ("example.com", False),
+    ]
+
+    def test_domain_index_most_specific_rule_wins(self):
+        index = DomainIndex({"facebook.com", "tracker.net"}, allowed=self.ALLOWED)
+        for name, expected in self.CASES:
+            if "ads" in name:
+                continue
+            with self.subTest(name=name):
+                self.assertEqual(index.is_blocked(name), expected)
+
+    def test_compiled_index_resolves_allow_and_block_in_one_walk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            lists = Path(tmp) / "extra.txt"
+            index_path = Path(tmp) / "domains.idx"
+            source.write_text(json.dumps({"blocked_domains": self.BLOCKED, "allowed_domains": self.ALLOWED}))
+            lists.write_text("doubleclick.net\n@@safe.doubleclick.net\n")
+            count = dns_compiler.compile_blocklist([source, lists], index_path)
+            index = MappedDomainIndex(index_path)
+
+            self.assertEqual(count, 7)
+            for name, expected in self.CASES + [("safe.doubleclick.net", False), ("ad.doubleclick.net", True)]:
+                with self.subTest(name=name):
+                    self.assertEqual(index.is_blocked(name), expected)
+
+            # Una sola scansione: una lookup per label fino alla prima voce
+            with mock.patch.object(MappedDomainIndex, "_lookup", autospec=True,
+                                   side_effect=MappedDomainIndex._lookup) as lookup:
+                index.is_blocked("img.cdn.facebook.com")
+            self.assertEqual(lookup.call_count, 2)
+
+    def test_parent_allow_beats_regex_block(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            index_path = Path(tmp) / "domains.idx"
+            source.write_text(json.dumps({
+                "blocked_domains": ["re:.*facebook\\.com$", "ads*.cdn.facebook.com"],
+                "allowed_domains": ["cdn.facebook.com"],
+            }))
+            dns_compiler.compile_blocklist([source], index_path)
+            index = MappedDomainIndex(index_path)
+            overlay = JournalOverlay(MappedDomainIndex(index_path)).apply([
+                (OP_ADD, BLOCKED_KEY, "re:^img\\."),
+            ])
+
+            for name, expected in [
+                ("www.facebook.com", True),
+                ("cdn.facebook.com", False),
+                ("x.cdn.facebook.com", False),
+                # Wildcard più specifica dell'eccezione: vince la wildcard
+                ("ads1.cdn.facebook.com", True),
+            ]:
+                with self.subTest(name=name):
+                    self.assertEqual(index.is_blocked(name), expected)
+                    self.assertEqual(overlay.is_blocked(name), expected)
+            self.assertFalse(overlay.is_blocked("img.cdn.facebook.com"))
+            self.assertTrue(overlay.is_blocked("img.example.org"))
+
+    def test_domain_manager_edits_both_lists(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(domain_manager, "DOMAINS_FILE", Path(tmp) / "domains.json"):
+            domain_manager.add_domain("Facebook.com")
+            domain_manager.add_allowed_domain("CDN.facebook.com")
+            domain_manager.add_domain("instagram.com")
+
+            self.assertEqual(domain_manager.load_domains(), ["facebook.com", "instagram.com"])
+            self.assertEqual(domain_manager.load_allowed_domains(), ["cdn.facebook.com"])
+
+            domain_manager.remove_allowed_domain("cdn.facebook.com")
+            self.assertEqual(domain_manager.load_allowed_domains(), [])
+            self.assertEqual(domain_manager.load_domains(), ["facebook.com", "instagram.com"])
+
+    def test_pattern_allow_rules_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(domain_manager, "DOMAINS_FILE", Path(tmp) / "domains.json"):
+            for rule in ("re:^ads\\..*", "ads*.example.org"):
+                with self.subTest(rule=rule), self.assertRaises(ValueError):
+                    domain_manager.add_allowed_domain(rule)
+            self.assertEqual(domain_manager.load_allowed_domains(), [])
+
+
+class TestJournalOverlay(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.json_path = Path(tmp.name) / "domains.json"
+        self.journal = self.json_path.with_suffix(".journal")
+        self.json_path.write_text(json.dumps({"blocked_domains": ["facebook.com", "tracker.net"]}))
+        self.loads = 0
+
+        def loader():
+            self.loads += 1
+            return dns_server.load_blocked_domains(self.json_path)
+
+        self.holder = BlocklistHolder(
+            self.json_path, loader, check_interval=0, journal=JournalReader(self.journal)
+        )
+        patcher = mock.patch.object(domain_manager, "DOMAINS_FILE", self.json_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_edits_applied_incrementally_without_reload(self):
+        domain_manager.add_domain("ads.example.com")
+        domain_manager.add_allowed_domain("cdn.facebook.com")
+        domain_manager.remove_domain("tracker.net")
+        domain_manager.add_domain("ads*.cdn.org")
+        index = self.holder.get()
+
+        self.assertEqual(self.loads, 1)
+        self.assertTrue(index.is_blocked("x.ads.example.com"))
+        self.assertTrue(index.is_blocked("www.facebook.com"))
+        self.assertFalse(index.is_blocked("img.cdn.facebook.com"))
+        self.assertFalse(index.is_blocked("x.tracker.net"))
+        self.assertTrue(index.is_blocked("ads1.cdn.org"))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.stats()["journal_entries"], 4)
+
+        domain_manager.add_domain("tracker.net")
+        self.assertTrue(self.holder.get().is_blocked("x.tracker.net"))
+        self.assertEqual(self.loads, 1)
+
+    def test_removing_allow_keeps_base_block_on_same_name(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / "domains.json"
+            index_path = Path(tmp) / "domains.idx"
+            source.write_text(json.dumps({"blocked_domains": ["tracker.net"], "allowed_domains": ["tracker.net"]}))
+            dns_compiler.compile_blocklist([source], index_path)
+            bases = [DomainIndex({"tracker.net"}, allowed={"tracker.net"}), MappedDomainIndex(index_path)]
+            for base in bases:
+                with self.subTest(base=type(base).__name__):
+                    overlay = JournalOverlay(base)
+                    self.assertFalse(overlay.is_blocked("x.tracker.net"))
+                    overlay.apply([(OP_REMOVE, ALLOWED_KEY, "tracker.net")])
+                    # Come dopo una ricarica completa: resta il blocco della base
+                    self.assertTrue(overlay.is_blocked("x.tracker.net"))
+                    self.assertEqual(len(overlay), len(base))
+                    overlay.apply([(OP_REMOVE, BLOCKED_KEY, "tracker.net")])
+                    self.assertFalse(overlay.is_blocked("x.tracker.net"))
+                    self.assertEqual(len(overlay), len(base) - 1)
+
+    def test_live_deltas_with_concurrent_readers(self):
+        holder = BlocklistHolder(self.json_path, lambda: ["facebook.com"], check_interval=3600)
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    self.assertTrue(holder.get().is_blocked("www.facebook.com"))
+                    holder.get().is_blocked("x.site1.com")
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(2000):
+            holder.apply([("add", "blocked_domains", f"site{i}.com")])
+        holder.apply([("remove", "blocked_domains", "site1.com")])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(holder.get().is_blocked("x.site1999.com"))
+        self.assertFalse(holder.get().is_blocked("x.site1.com"))
+        self.assertEqual(len(holder.get()), 2000)
+
+    def test_partial_line_waits_for_completion(self):
+        domain_manager.add_domain("a.com")
+        with open(self.journal, "ab") as f:
+            f.write(b'{"op": "add", "key": "blocked_domains", "rule": "b.c')
+        self.assertTrue(self.holder.get().is_blocked("a.com"))
+        self.assertFalse(self.holder.get().is_blocked("b.com"))
+
+        with open(self.journal, "ab") as f:
+            f.write(b'om"}\n')
+        self.assertTrue(self.holder.get().is_blocked("b.com"))
+
+    def test_compaction_reloads_base_and_keeps_pending_edits(self):
+        domain_manager.add_domain("a.com")
+        self.assertTrue(self.holder.get().is_blocked("a.com"))
+        domain_manager.compact()
+        domain_manager.add_domain("b.com")
+        self.holder.get()
+        # La ricarica avviene in background
+        thread = self.holder._reload_thread
+        if thread is not None:
+            thread.join(timeout=5)
+        index = self.holder.get()
+
+        self.assertEqual(self.loads, 2)
+        self.assertIn("a.com", index.base)
+        self.assertTrue(index.is_blocked("a.com"))
+        self.assertTrue(index.is_blocked("b.com"))
+
+    def test_reload_publishes_base_with_pending_edits(self):
+        domain_manager.remove_domain("tracker.net")
+        self.assertFalse(self.holder.get().is_blocked("x.tracker.net"))
+        journal = self.holder._journal
+        read_all = journal.read_all
+        seen = []
+
+        def spy():
+            # Stato visibile alle query mentre la ricarica legge il journal
+            seen.append(self.holder.get().is_blocked("x.tracker.net"))
+            return read_all()
+
+        os.utime(self.json_path, ns=(1_000_000_000, 1_000_000_000))
+        with mock.patch.object(journal, "read_all", side_effect=spy):
+            self.holder.reload()
+
+        self.assertEqual(seen, [False])
+        self.assertFalse(self.holder.get().is_blocked("x.tracker.net"))
+
+    def test_journal_applied_while_reload_fails(self):
+        self.json_path.write_text("{ non-json")
+        domain_manager.add_domain("ads.example.com")
+        with mock.patch("builtins.print"):
+            for _ in range(3):
+                index = self.holder.get()
+                thread = self.holder._reload_thread
+                if thread is not None:
+                    thread.join(timeout=5)
+
+        self.assertTrue(index.is_blocked("x.ads.example.com"))
+        self.assertTrue(index.is_blocked("www.facebook.com"))
+
+    def test_trailing_dot_normalized_like_compiler(self):
+        self.assertEqual(domain_manager.add_domain("Ads.Example.COM."), "ads.example.com")
+        self.assertEqual(domain_manager.add_allowed_domain("CDN.facebook.com."), "cdn.facebook.com")
+        index = self.holder.get()
+
+        self.assertTrue(index.is_blocked("x.ads.example.com"))
+        self.assertFalse(index.is_blocked("cdn.facebook.com"))
+
+    def test_appends_not_lost_during_compaction(self):
+        def writer(n):
+            for i in range(50):
+                domain_manager.add_domain(f"w{n}-{i}.com")
+
+        # Compattazione nel thread di chi scrive: gli altri continuano ad aggiungere
+        with mock.patch.object(domain_manager, "JOURNAL_COMPACT_BYTES", 512), \
+                mock.patch.object(domain_manager, "_compact_in_background", domain_manager._compact_worker):
+            threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        domains = set(domain_manager.load_domains())
+        self.assertEqual({f"w{n}-{i}.com" for n in range(4) for i in range(50)} - domains, set())
+
+
+class TestBlocklistCompiler(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.json_path = self.dir / "domains.json"
+        self.list_path = self.dir / "lists" / "ads.txt"
+        self.list_path.parent.mkdir()
+        self.index_path = self.dir / "domains.idx"
+        self.json_path.write_text(json.dumps({"blocked_domains": ["Example.COM.", "test.com"]}))
+        self.list_path.write_text("# lista importata\nads.tracker.net\n\ntest.com  # duplicato\n")
+
+    def test_compiles_json_and_imported_lists(self):
+        count = dns_compiler.compile_blocklist([self.json_path, self.list_path], self.index_path)
+        index = MappedDomainIndex(self.index_path)
+
+        self.assertEqual(count, 3)
+        self.assertEqual(len(index), 3)
+        self.assertTrue(index.is_blocked("www.example.com"))
+        self.assertTrue(index.is_blocked("a.ads.tracker.net"))
+        self.assertFalse(index.is_blocked("tracker.net"))
+
+    def test_recompiles_only_when_sources_change(self):
+        sources = [self.json_path, self.list_path]
+        self.assertTrue(dns_compiler.ensure_compiled(sources, self.index_path))
+        self.assertFalse(dns_compiler.ensure_compiled(sources, self.index_path))
+
+        self.list_path.write_text("later.com\n")
+        self.assertTrue(dns_compiler.ensure_compiled(sources, self.index_path))
+        self.assertTrue(MappedDomainIndex(self.index_path).is_blocked("later.com"))
+
+    def test_default_resolver_uses_compiled_index(self):
+        with mock.patch.object(dns_server, "CONFIG_PATH", self.json_path), \
+                mock.patch.object(dns_server, "IMPORTED_LISTS_DIR", self.list_path.parent), \
+                mock.patch.object(dns_server, "BLOCKLIST_INDEX_PATH", self.index_path), \
+                mock.patch.object(dns_server, "load_dns_state", return_value=None):
+            resolver = dns_server.BlockResolver()
+            self.addCleanup(resolver.close)
+            self.assertIsInstance(resolver.blocklist.get(), MappedDomainIndex)
+            request = DNSRecord.question("x.ads.tracker.net")
+            with mock.patch("builtins.print"):
+                reply = DNSRecord.parse(resolver.handle_packet(request.pack()))
+        self.assertEqual(str(reply.rr[0].rdata), "0.0.0.0")
+
+
+class TestListImporter(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.lists_dir = self.dir / "lists"
+        self.source = self.dir / "mixed.txt"
+        self.source.write_text(
+            "# hosts\n"
+            "127.0.0.1 localhost\n"
+            "0.0.0.0 Ads.Example.com tracker.net  # commento\n"
+            "ads.example.com\n"
+            "! adblock\n"
+            "||doubleclick.net^\n"
+            "@@||safe.doubleclick.net^\n"
+            "||ads*.cdn.org^\n"
+            "example.org##.banner\n"
+            "||third.party^$third-party\n"
+            "bad domain here\n"
+            "0.0.0.0\n"
+            "@@||*.tracker.net^\n"
+            "münchen.de\n",
+            encoding="utf-8",
+        )
+
+    def _import(self, **kw):
+        with mock.patch("builtins.print"):
+            return config_importer.import_list(self.source, lists_dir=self.lists_dir, **kw)
+
+    def test_mixed_formats_normalized_and_deduplicated(self):
+        stats = self._import()
+        rules = stats["output"].read_text().splitlines()[1:]
+
+        self.assertEqual(stats["output"], self.lists_dir / "mixed.txt")
+        self.assertEqual(rules, sorted([
+            "ads.example.com", "tracker.net", "doubleclick.net",
+            "@@safe.doubleclick.net", "ads*.cdn.org", "xn--mnchen-3ya.de",
+        ]))
+        self.assertEqual((stats["rules"], stats["allowed"], stats["ignored"]), (6, 1, 2))
+        self.assertEqual([lineno for lineno, _ in stats["error_lines"]], [11, 12, 13])
+        self.assertEqual(stats["errors"], 3)
+
+    def test_external_sort_matches_in_memory_sort(self):
+        expected = self._import()["output"].read_text().splitlines()[1:]
+        stats = self._import(chunk_size=2)
+
+        self.assertEqual(stats["output"].read_text().splitlines()[1:], expected)
+        self.assertEqual(sorted(p.name for p in self.lists_dir.iterdir()), ["mixed.txt"])
+
+    def test_failed_import_keeps_existing_list(self):
+        output = self._import()["output"]
+        before = output.read_text()
+        self.source.write_text("bad domain here\n!! solo commenti\n")
+
+        with self.assertRaises(ValueError):
+            self._import()
+        self.assertEqual(output.read_text(), before)
+        self.assertEqual(sorted(p.name for p in self.lists_dir.iterdir()), ["mixed.txt"])
+
+    def test_imported_list_compiles(self):
+        output = self._import()["output"]
+        index_path = self.dir / "domains.idx"
+        with mock.patch("builtins.print"):
+            dns_compiler.compile_blocklist([output], index_path)
+        index = MappedDomainIndex(index_path)
+
+        self.assertTrue(index.is_blocked("x.ads.example.com"))
+        self.assertTrue(index.is_blocked("ads1.cdn.org"))
+        self.assertTrue(index.is_blocked("ad.doubleclick.net"))
+        self.assertFalse(index.is_blocked("safe.doubleclick.net"))
+
+    def test_regex_with_hash_and_spaces_survives_compilation(self):
+        self.source.write_text(
+            "re:(?x) ^ads [0-9]+ \\.cdn\\.org $\n"
+            "re:^track#?\\.example\\.net$\n",
+            encoding="utf-8",
+        )
+        output = self._import()["output"]
+        index_path = self.dir / "domains.idx"
+        with mock.patch("builtins.print"):
+            dns_compiler.compile_blocklist([output], index_path)
+        index = MappedDomainIndex(index_path)
+
+        self.assertTrue(index.is_blocked("ads42.cdn.org"))
+        self.assertFalse(index.is_blocked("adsx.cdn.org"))
+        self.assertTrue(index.is_blocked("track.example.net"))
+
+
+class TestDNSCache(unittest.TestCase):
+    def _answer(self, request: DNSRecord, ttl: int = 300) -> DNSRecord:
+        reply = request.reply()
+        reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=ttl, rdata=A("1.2.3.4")))
+        return reply
+
+    def test_hit_rewrites_id_and_decrements_ttl(self):
+        cache = DNSCache()
+        request = DNSRecord.question("example.com")
+        with mock.patch.object(dns_cache.time, "monotonic", return_value=100.0):
+            cache.put(request, self._answer(request))
+
+        again = DNSRecord.question("EXAMPLE.com")
+        with mock.patch.object(dns_cache.time, "monotonic", return_value=130.0):
+            hit = cache.get(again)
+
+        self.assertEqual(hit.header.id, again.header.id)
+        self.assertEqual(hit.rr[0].ttl, 270)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_hit_echoes_client_question_and_edns(self):
+        cache = DNSCache()
+        first = DNSRecord.question("WwW.ExAmple.CoM")
+        first.add_ar(EDNS0(udp_len=4096))
+        reply = self._answer(first)
+        reply.add_ar(EDNS0(udp_len=1232))
+        cache.put(first, reply)
+
+        plain = DNSRecord.question("www.example.com")
+        plain.header.rd = 0
+        hit = cache.get(plain)
+        self.assertEqual(str(hit.q.qname), "www.example.com.")
+        self.assertEqual(hit.ar, [])
+        self.assertEqual(hit.header.rd, 0)
+        self.assertEqual(str(hit.rr[0].rdata), "1.2.3.4")
+
+        with_edns = DNSRecord.question("WWW.example.com")
+        with_edns.add_ar(EDNS0(udp_len=4096))
+        hit = cache.get(with_edns)
+        self.assertEqual(str(hit.q.qname), "WWW.example.com.")
+        self.assertEqual(hit.ar[0].rtype, QTYPE.OPT)
+
+    def test_entry_expires_after_min_ttl(self):
+        cache = DNSCache()
+        request = DNSRecord.question("example.com")
+        with mock.patch.object(dns_cache.time, "monotonic", return_value=100.0):
+            cache.put(request, self._answer(request, ttl=10))
+        with mock.patch.object(dns_cache.time, "monotonic", return_value=111.0):
+            self.assertIsNone(cache.get(request))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_nxdomain_cached_with_soa_minimum(self):
+        request = DNSRecord.question("missing.example.com")
+        reply = request.reply()
+        reply.header.rcode = RCODE.NXDOMAIN
+        reply.add_auth(RR("example.com", QTYPE.SOA, ttl=3600, rdata=SOA("ns.", "host.", (1, 2, 3, 4, 60))))
+        self.assertEqual(reply_ttl(reply.pack()), 60)
+
+        servfail = request.reply()
+        servfail.header.rcode = RCODE.SERVFAIL
+        self.assertIsNone(reply_ttl(servfail.pack()))
+
+    def test_lru_eviction(self):
+        cache = DNSCache(max_entries=2)
+        names = ["a.com", "b.com", "c.com"]
+        requests = [DNSRecord.question(n) for n in names]
+        cache.put(requests[0], self._answer(requests[0]))
+        cache.put(requests[1], self._answer(requests[1]))
+        cache.get(requests[0])
+        cache.put(requests[2], self._answer(requests[2]))
+
+        self.assertIsNotNone(cache.get(requests[0]))
+        self.assertIsNone(cache.get(requests[1]))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+class TestWireFastPath(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(dns_server, "load_dns_state", return_value=None):
+            self.resolver = dns_server.BlockResolver(
+                blocklist=BlocklistHolder(Path("missing.json"), lambda: {"blocked.com"}),
+            )
+        self.addCleanup(self.resolver.close)
+
+    def _both_paths(self, request: DNSRecord) -> tuple[bytes, bytes]:
+        with mock.patch("builtins.print"):
+            fast = self.resolver.handle_packet(request.pack())
+            slow = self.resolver.blocked_reply(DNSRecord.parse(request.pack())).pack()
+        return fast, slow
+
+    def test_sinkhole_bytes_match_dnslib_reply(self):
+        for qtype in ("A", "AAAA", "MX"):
+            fast, slow = self._both_paths(DNSRecord.question("Ads.Blocked.com", qtype))
+            self.assertEqual(fast, slow, qtype)
+
+    def test_edns_query_handled_on_fast_path(self):
+        request = DNSRecord.question("www.blocked.com", "AAAA")
+        request.add_ar(EDNS0())
+        fast, _ = self._both_paths(request)
+        reply = DNSRecord.parse(fast)
+
+        self.assertEqual(reply.header.id, request.header.id)
+        self.assertEqual(str(reply.rr[0].rdata), "::")
+
+    def test_unusual_packets_fall_back(self):
+        response = DNSRecord.question("blocked.com").reply().pack()
+        self.assertIsNone(parse_query(response))
+
+        two_questions = DNSRecord.question("blocked.com")
+        two_questions.add_question(*DNSRecord.question("other.com").questions)
+        self.assertIsNone(parse_query(two_questions.pack()))
+        self.assertIsNone(parse_query(b"\x00\x01"))
+
+
+class _ResolverTestCase(unittest.TestCase):
+    def _make_resolver(self, upstreams, **kwargs) -> dns_server.BlockResolver:
+        with mock.patch.object(dns_server, "load_dns_state", return_value=None):
+            resolver = dns_server.BlockResolver(
+                blocklist=BlocklistHolder(Path("missing.json"), lambda: {"blocked.com"}),
+                **kwargs,
+            )
+        resolver.upstream_dns_list = [u.address for u in upstreams]
+        self.addCleanup(resolver.close)
+        return resolver
+
+
+class TestUpstreamRace(_ResolverTestCase):
+    def test_dead_upstream_costs_only_stagger_delay(self):
+        with FakeUpstream(respond=False) as dead, FakeUpstream() as alive:
+            resolver = self._make_resolver([dead, alive], deadline=2, stagger=0.05)
+            start = time.monotonic()
+            reply = resolver.resolve(DNSRecord.question("example.com"), None)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(str(reply.rr[0].rdata), "10.0.0.1")
+        self.assertLess(elapsed, 1)
+        self.assertEqual(dead.received, 1)
+
+    def test_fast_first_upstream_no_extra_query(self):
+        with FakeUpstream() as first, FakeUpstream() as second:
+            resolver = self._make_resolver([first, second], stagger=0.5)
+            resolver.resolve(DNSRecord.question("example.com"), None)
+
+        self.assertEqual(second.received, 0)
+
+    def test_total_time_capped_by_deadline(self):
+        with FakeUpstream(respond=False) as a, FakeUpstream(respond=False) as b:
+            resolver = self._make_resolver([a, b], deadline=0.3, stagger=0)
+            start = time.monotonic()
+            with mock.patch("builtins.print"):
+                reply = resolver.resolve(DNSRecord.question("example.com"), None)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(reply.rr, [])
+        self.assertLess(elapsed, 1)
+        self.assertEqual((a.received, b.received), (1, 1))
+
+
+class TestUpstreamPool(_ResolverTestCase):
+    def test_sockets_reused_across_queries(self):
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream])
+            for i in range(10):
+                resolver.resolve(DNSRecord.question(f"host{i}.example.com"), None)
+
+        self.assertEqual(upstream.received, 10)
+        self.assertLessEqual(len(upstream.clients), resolver.upstreams.sockets_per_upstream)
+
+    def test_reply_id_restored_for_client(self):
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream])
+            request = DNSRecord.question("example.com")
+            reply = resolver.resolve(request, None)
+
+        self.assertEqual(reply.header.id, request.header.id)
+
+    def test_mismatched_question_rejected(self):
+        with FakeUpstream(respond=False) as upstream:
+            conn = UpstreamConnection(upstream.address)
+            self.addCleanup(conn.close)
+            packet = DNSRecord.question("example.com").pack()
+            pending = _PendingQuery(question_bytes(packet))
+            txid = conn.send(packet, pending)
+
+            forged = DNSRecord.question("evil.com").reply()
+            forged.header.id = txid
+            conn._dispatch(forged.pack())
+            self.assertIsNone(pending.data)
+
+            genuine = DNSRecord.parse(packet).reply()
+            genuine.header.id = txid
+            conn._dispatch(genuine.pack())
+
+        self.assertEqual(conn.rejected, 1)
+        self.assertIsNotNone(pending.data)
+
+
+class TestUpstreamHealth(unittest.TestCase):
+    def test_rtt_smoothing_and_adaptive_timeout(self):
+        health = UpstreamHealth(("1.1.1.1", 53))
+        self.assertEqual(health.timeout(), dns_upstream.INITIAL_UPSTREAM_TIMEOUT)
+
+        health.record_success(0.020)
+        self.assertAlmostEqual(health.srtt, 0.020)
+        health.record_success(0.020)
+        self.assertLess(health.timeout(), 0.1)
+        self.assertGreaterEqual(health.timeout(), dns_upstream.MIN_UPSTREAM_TIMEOUT)
+
+    def test_circuit_breaker_opens_after_repeated_timeouts(self):
+        health = UpstreamHealth(("1.1.1.1", 53))
+        with mock.patch("builtins.print"):
+            for _ in range(dns_upstream.FAILURE_THRESHOLD):
+                health.record_timeout(100.0)
+
+        self.assertFalse(health.available(101.0))
+        self.assertTrue(health.available(100.0 + dns_upstream.BACKOFF_BASE))
+
+        health.record_success(0.01)
+        self.assertEqual(health.failures, 0)
+
+    def test_ordered_by_rtt_skipping_open_circuits(self):
+        pool = UpstreamPool()
+        slow, fast, dead = ("10.0.0.1", 53), ("10.0.0.2", 53), ("10.0.0.3", 53)
+        pool.health(slow).record_success(0.200)
+        pool.health(fast).record_success(0.010)
+        pool.health(dead).open_until = time.monotonic() + 60
+
+        self.assertEqual(pool.ordered([slow, fast, dead]), [fast, slow])
+        self.assertEqual(pool.ordered([dead]), [dead])
+
+
+class TestUpstreamSelection(_ResolverTestCase):
+    def test_fast_upstream_preferred_after_measurement(self):
+        with FakeUpstream(delay=0.15) as slow, FakeUpstream() as fast:
+            resolver = self._make_resolver([slow, fast], stagger=0.05)
+            for i in range(4):
+                resolver.resolve(DNSRecord.question(f"host{i}.example.com"), None)
+            slow_before = slow.received
+            resolver.resolve(DNSRecord.question("last.example.com"), None)
+
+        self.assertEqual(slow.received, slow_before)
+        stats = resolver.upstreams.stats()
+        key = f"{fast.address[0]}:{fast.address[1]}"
+        self.assertIsNotNone(stats[key]["srtt_ms"])
+
+
+class TestRawRelay(_ResolverTestCase):
+    def test_upstream_bytes_relayed_unchanged_apart_from_id(self):
+        request = DNSRecord.question("example.com")
+        request.add_ar(EDNS0())
+        packet = request.pack()
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream])
+            relayed = resolver.handle_packet(packet)
+            cached = resolver.handle_packet(b"\x12\x34" + packet[2:])
+
+        expected = upstream.build_reply(packet)
+        self.assertEqual(relayed, expected)
+        self.assertEqual(cached, b"\x12\x34" + expected[2:])
+        self.assertEqual(upstream.received, 1)
+
+    def test_no_answer_returns_empty_reply(self):
+        packet = DNSRecord.question("example.com").pack()
+        with FakeUpstream(respond=False) as upstream:
+            resolver = self._make_resolver([upstream], deadline=0.2)
+            with mock.patch("builtins.print"):
+                reply = DNSRecord.parse(resolver.handle_packet(packet))
+
+        self.assertEqual(reply.header.id, DNSRecord.parse(packet).header.id)
+        self.assertEqual(reply.rr, [])
+
+    def test_upstream_error_returns_empty_reply(self):
+        packet = DNSRecord.question("example.com").pack()
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream])
+            with mock.patch.object(resolver.upstreams, "connection", side_effect=OSError("unreachable")), \
+                    mock.patch("builtins.print"):
+                reply = DNSRecord.parse(resolver.handle_packet(packet))
+            # Il flight è chiuso: la query successiva riprova l'upstream
+            again = DNSRecord.parse(resolver.handle_packet(packet))
+
+        self.assertEqual(reply.rr, [])
+        self.assertEqual(str(again.rr[0].rdata), "10.0.0.1")
+
+
+class TestQueryLog(_ResolverTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "queries.jsonl"
+
+    def _records(self) -> list[dict]:
+        return [json.loads(line) for line in self.path.read_text().splitlines()]
+
+    def test_resolver_verdicts_written_as_json_lines(self):
+        log = QueryLog(self.path, flush_interval=3600)
+        with FakeUpstream() as upstream, FakeUpstream(respond=False) as dead:
+            resolver = self._make_resolver([upstream], query_log=log)
+            client = ("192.168.1.10", 5353)
+            with mock.patch("builtins.print") as printed:
+                resolver.handle_packet(DNSRecord.question("ads.blocked.com").pack(), client)
+                resolver.handle_packet(DNSRecord.question("example.com").pack(), client)
+                resolver.handle_packet(DNSRecord.question("example.com").pack(), client)
+                resolver.upstream_dns_list = [dead.address]
+                resolver.deadline = 0.1
+                resolver.handle_packet(DNSRecord.question("down.example").pack(), client)
+                log.close()
+        records = self._records()
+
+        printed.assert_not_called()
+        self.assertEqual(
+            [(r["verdict"], r["qname"]) for r in records],
+            [("blocked", "ads.blocked.com"), ("forwarded", "example.com"), ("cached", "example.com"),
+             ("timeout", "down.example"), ("failed", "down.example")],
+        )
+        self.assertEqual(records[0]["client"], "192.168.1.10")
+        self.assertEqual(records[0]["qtype"], 1)
+        self.assertEqual(records[1]["upstream"], f"{upstream.address[0]}:{upstream.address[1]}")
+        self.assertGreater(records[1]["latency_ms"], 0)
+        self.assertEqual(log.stats()["written"], 5)
+
+    def test_full_queue_drops_and_counts(self):
+        log = QueryLog(self.path, max_queue=10, flush_interval=3600)
+        start = time.perf_counter()
+        for i in range(25):
+            log.record(None, f"host{i}.example", 1, "forwarded")
+        elapsed = time.perf_counter() - start
+        log.close()
+
+        self.assertLess(elapsed, 0.05)
+        self.assertEqual(log.stats()["dropped"], 15)
+        self.assertEqual([r["qname"] for r in self._records()], [f"host{i}.example" for i in range(10)])
+
+    def test_rotation_keeps_bounded_backups(self):
+        log = QueryLog(self.path, flush_interval=3600, max_bytes=1000, backups=2)
+        for batch in range(6):
+            for i in range(5):
+                log.record(None, f"host{batch}-{i}.example", 1, "cached")
+            log.flush()
+        log.close()
+
+        names = sorted(p.name for p in self.path.parent.iterdir())
+        self.assertEqual(names, ["queries.jsonl", "queries.jsonl.1", "queries.jsonl.2"])
+        self.assertLessEqual(self.path.stat().st_size, 1000)
+        self.assertEqual(self._records()[-1]["qname"], "host5-4.example")
+
+
+class TestResolverMetrics(_ResolverTestCase):
+    def test_histogram_buckets_and_quantiles(self):
+        histogram = Histogram(bounds=(0.001, 0.01, 0.1))
+        for value in (0.0005, 0.002, 0.002, 0.05, 5.0):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 5.0545)
+        self.assertIsNone(Histogram().quantile(0.5))
+        self.assertTrue(0.001 < histogram.quantile(0.5) <= 0.01)
+        self.assertEqual(histogram.quantile(0.99), 0.1)
+
+    def test_resolver_records_stages_and_counters(self):
+        metrics = ResolverMetrics()
+        with FakeUpstream() as upstream, FakeUpstream(respond=False) as dead:
+            resolver = self._make_resolver([upstream], metrics=metrics)
+            with mock.patch("builtins.print"):
+                resolver.handle_packet(DNSRecord.question("ads.blocked.com").pack())
+                resolver.handle_packet(DNSRecord.question("example.com").pack())
+                resolver.handle_packet(DNSRecord.question("example.com").pack())
+                resolver.upstream_dns_list = [dead.address]
+                resolver.deadline = 0.1
+                resolver.handle_packet(DNSRecord.question("down.example").pack())
+        stats = metrics.stats()
+
+        self.assertEqual(stats["queries"], 4)
+        self.assertEqual(
+            (stats["blocked"], stats["forwarded"], stats["cached"], stats["failed"]), (1, 1, 1, 1)
+        )
+        self.assertEqual(stats["upstream_timeouts"], {f"{dead.address[0]}:{dead.address[1]}": 1})
+        counts = {stage: values["count"] for stage, values in stats["stages"].items()}
+        self.assertEqual(
+            counts, {"parse": 4, "normalize": 4, "match": 4, "cache": 3, "upstream": 2, "pack": 1}
+        )
+        self.assertGreater(stats["stages"]["upstream"]["avg_us"], stats["stages"]["parse"]["avg_us"])
+        self.assertGreater(stats["qps"], 0)
+
+    def test_prometheus_endpoint_on_localhost(self):
+        metrics = ResolverMetrics()
+        metrics.count("forwarded")
+        metrics.observe("match", 0.000003)
+        metrics.timeout(("9.9.9.9", 53))
+        server = MetricsServer(metrics, port=0)
+        server.start_thread()
+        self.addCleanup(server.stop)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=2) as response:
+            content_type = response.headers["Content-Type"]
+            body = response.read().decode()
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"http://127.0.0.1:{server.port}/", timeout=2)
+
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn('dns_blocker_queries_total{verdict="forwarded"} 1', body)
+        self.assertIn('dns_blocker_upstream_timeouts_total{upstream="9.9.9.9:53"} 1', body)
+        self.assertIn('dns_blocker_stage_duration_seconds_bucket{stage="match",le="2.5e-06"} 0', body)
+        self.assertIn('dns_blocker_stage_duration_seconds_bucket{stage="match",le="5e-06"} 1', body)
+        self.assertIn('dns_blocker_stage_duration_seconds_count{stage="match"} 1', body)
+        self.assertEqual(server.httpd.server_address[0], "127.0.0.1")
+
+
+class TestSlowQueryTracer(_ResolverTestCase):
+    def test_trace_records_race_cache_and_match(self):
+        tracer = SlowQueryTracer(threshold=0, sample_rate=1.0)
+        with FakeUpstream(respond=False) as dead, FakeUpstream() as alive:
+            resolver = self._make_resolver([dead, alive], stagger=0.05, tracer=tracer)
+            with mock.patch("builtins.print"):
+                resolver.handle_packet(DNSRecord.question("Example.com").pack())
+                resolver.handle_packet(DNSRecord.question("example.com").pack())
+                resolver.handle_packet(DNSRecord.question("ads.blocked.com").pack())
+        forwarded, cached, blocked = tracer.dump()
+
+        self.assertEqual(forwarded["verdict"], "forwarded")
+        self.assertEqual(forwarded["cache"], "miss")
+        self.assertEqual(forwarded["match"], {"domain": "example.com", "rule": None})
+        self.assertEqual(
+            [(a["upstream"], a["outcome"]) for a in forwarded["attempts"]],
+            [(f"{dead.address[0]}:{dead.address[1]}", "late"), (f"{alive.address[0]}:{alive.address[1]}", "answer")],
+        )
+        first, second = forwarded["attempts"]
+        self.assertIsNone(first["received_ms"])
+        self.assertGreaterEqual(second["sent_ms"], 40)
+        self.assertGreaterEqual(second["received_ms"], second["sent_ms"])
+        self.assertGreaterEqual(forwarded["duration_ms"], second["received_ms"])
+        self.assertEqual((cached["verdict"], cached["cache"], cached["attempts"]), ("cached", "hit", []))
+        self.assertEqual(blocked["verdict"], "blocked")
+        self.assertEqual(blocked["match"], {"domain": "ads.blocked.com", "rule": "blocked.com"})
+        self.assertIsNone(blocked["cache"])
+
+    def test_follower_wait_is_traced(self):
+        tracer = SlowQueryTracer(threshold=0, sample_rate=1.0)
+        with FakeUpstream(delay=0.2) as upstream:
+            resolver = self._make_resolver([upstream], tracer=tracer)
+            leader = threading.Thread(
+                target=resolver.handle_packet, args=(DNSRecord.question("example.com").pack(),)
+            )
+            leader.start()
+            time.sleep(0.05)
+            resolver.handle_packet(DNSRecord.question("example.com").pack())
+            leader.join()
+        # Finiscono quasi insieme: l'ordine nel buffer non è garantito
+        traced_leader, follower = sorted(tracer.dump(), key=lambda t: t["wait_ms"] is not None)
+
+        self.assertGreater(follower["wait_ms"], 50)
+        self.assertEqual(follower["attempts"], [])
+        self.assertIsNone(traced_leader["wait_ms"])
+        self.assertEqual(len(traced_leader["attempts"]), 1)
+
+    def test_threshold_sampling_and_bounded_buffer(self):
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream], tracer=SlowQueryTracer(threshold=10, sample_rate=1.0))
+            resolver.handle_packet(DNSRecord.question("example.com").pack())
+            self.assertEqual(resolver.tracer.dump(), [])
+            self.assertEqual(resolver.tracer.stats()["sampled"], 1)
+
+            resolver.tracer = SlowQueryTracer(threshold=0, sample_rate=0.0)
+            resolver.handle_packet(DNSRecord.question("example.com").pack())
+            self.assertEqual(resolver.tracer.stats()["sampled"], 0)
+
+            resolver.tracer = SlowQueryTracer(threshold=0, sample_rate=1.0, size=3)
+            for i in range(5):
+                resolver.handle_packet(DNSRecord.question(f"host{i}.example").pack())
+        traces = resolver.tracer.dump()
+
+        self.assertEqual([t["qname"] for t in traces], ["host2.example", "host3.example", "host4.example"])
+        self.assertEqual(resolver.tracer.stats()["slow"], 5)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "logs" / "slow.json"
+            self.assertEqual(resolver.tracer.dump_to(path), 3)
+            self.assertEqual(json.loads(path.read_text(encoding="utf-8")), traces)
+
+
+class TestQueryCoalescing(_ResolverTestCase):
+    def test_concurrent_identical_queries_share_one_upstream_packet(self):
+        clients = 8
+        with FakeUpstream(delay=0.3) as upstream:
+            resolver = self._make_resolver([upstream])
+            barrier = threading.Barrier(clients)
+            requests = [DNSRecord.question("example.com") for _ in range(clients)]
+            replies = [None] * clients
+
+            def worker(i):
+                barrier.wait()
+                replies[i] = resolver.resolve(requests[i], None)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(upstream.received, 1)
+        self.assertEqual(resolver.inflight.coalesced, clients - 1)
+        for request, reply in zip(requests, replies):
+            self.assertEqual(reply.header.id, request.header.id)
+            self.assertEqual(str(reply.rr[0].rdata), "10.0.0.1")
+
+    def test_followers_get_their_own_question(self):
+        names = ["example.com", "EXAMPLE.com", "eXaMpLe.CoM"]
+        with FakeUpstream(delay=0.3) as upstream:
+            resolver = self._make_resolver([upstream])
+            barrier = threading.Barrier(len(names))
+            replies = {}
+
+            def worker(name):
+                barrier.wait()
+                replies[name] = resolver.resolve(DNSRecord.question(name), None)
+
+            threads = [threading.Thread(target=worker, args=(name,)) for name in names]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(upstream.received, 1)
+        for name, reply in replies.items():
+            self.assertEqual(str(reply.q.qname), name + ".")
+
+
+class TestAsyncEngine(_ResolverTestCase):
+    def _start(self, upstream) -> AsyncDNSServer:
+        resolver = self._make_resolver([upstream])
+        server = AsyncDNSServer(resolver, addresses=["127.0.0.1"], port=0)
+        server.start_thread()
+        self.addCleanup(server.stop)
+        return server
+
+    def _query(self, server, name: str, tcp: bool = False) -> DNSRecord:
+        data = DNSRecord.question(name).send("127.0.0.1", server.port, tcp=tcp, timeout=2)
+        return DNSRecord.parse(data)
+
+    def test_forwarded_over_udp_and_tcp(self):
+        with FakeUpstream() as upstream:
+            server = self._start(upstream)
+            udp = self._query(server, "example.com")
+            tcp = self._query(server, "other.example.com", tcp=True)
+
+        self.assertEqual(str(udp.rr[0].rdata), "10.0.0.1")
+        self.assertEqual(str(tcp.rr[0].rdata), "10.0.0.1")
+
+    def test_blocked_domain_sinkholed(self):
+        with FakeUpstream() as upstream:
+            server = self._start(upstream)
+            with mock.patch("builtins.print"):
+                reply = self._query(server, "www.blocked.com")
+
+        self.assertEqual(str(reply.rr[0].rdata), "0.0.0.0")
+        self.assertEqual(upstream.received, 0)
+
+    def test_upstream_error_still_answers(self):
+        with FakeUpstream() as upstream:
+            server = self._start(upstream)
+            failing = mock.AsyncMock(side_effect=OSError("Network is unreachable"))
+            with mock.patch.object(server.upstreams, "query_with_winner", failing), \
+                    mock.patch("builtins.print") as fake_print:
+                reply = self._query(server, "example.com")
+
+        # Come un timeout: risposta vuota, nessun task con eccezione non letta
+        self.assertEqual(reply.rr, [])
+        self.assertEqual(RCODE[reply.header.rcode], "NOERROR")
+        self.assertIn("Network is unreachable", fake_print.call_args[0][0])
+
+    def _check_all_transports(self, engine: str):
+        with FakeUpstream() as upstream:
+            resolver = self._make_resolver([upstream])
+            with mock.patch("builtins.print"):
+                server = dns_server.start_dns_server(
+                    ["127.0.0.1", "::1"], 0, engine=engine, resolver=resolver
+                )
+            self.addCleanup(server.stop)
+
+            for dest, ipv6 in (("127.0.0.1", False), ("::1", True)):
+                for tcp in (False, True):
+                    with self.subTest(engine=engine, dest=dest, tcp=tcp):
+                        data = DNSRecord.question(f"host.{dest.replace(':', 'x')}.{int(tcp)}.test").send(
+                            dest, server.port, tcp=tcp, timeout=2, ipv6=ipv6
+                        )
+                        self.assertEqual(str(DNSRecord.parse(data).rr[0].rdata), "10.0.0.1")
+
+        # Un solo resolver (e una sola cache) dietro tutti i socket
+        self.assertEqual(resolver.cache.stats()["size"], 4)
+
+    def test_threaded_engine_serves_ipv4_and_ipv6_udp_tcp(self):
+        self._check_all_transports("threaded")
+
+    def test_asyncio_engine_serves_ipv4_and_ipv6_udp_tcp(self):
+        self._check_all_transports("asyncio")
+
+
+class TestTruncation(_ResolverTestCase):
+    def test_fit_udp_truncates_to_question_with_tc(self):
+        request = DNSRecord.question("big.test")
+        reply = request.reply()
+        for _ in range(60):
+            reply.add_answer(RR("big.test", QTYPE.A, ttl=60, rdata=A("10.0.0.1")))
+        data = reply.pack()
+
+        self.assertEqual(udp_payload_size(request.pack()), 512)
+        truncated = DNSRecord.parse(fit_udp(data, 512))
+        self.assertTrue(truncated.header.tc)
+        self.assertEqual(truncated.q.qname, request.q.qname)
+        self.assertEqual(truncated.rr, [])
+
+        request.add_ar(EDNS0(udp_len=4096))
+        self.assertEqual(udp_payload_size(request.pack()), 4096)
+        self.assertEqual(fit_udp(data, 4096), data)
+
+    def test_truncated_udp_reply_retried_over_tcp(self):
+        with FakeUpstream(answers=60) as upstream:
+            resolver = self._make_resolver([upstream])
+            request = DNSRecord.question("big.test")
+            reply = DNSRecord.parse(resolver.query_upstreams(request.pack()))
+
+        self.assertFalse(reply.header.tc)
+        self.assertEqual(reply.header.id, request.header.id)
+        self.assertEqual(len(reply.rr), 60)
+        self.assertEqual(upstream.received, 1)
+        self.assertEqual(upstream.tcp_received, 1)
+
+    def test_tcp_connection_reused_pipelined_and_reconnected(self):
+        pool = UpstreamPool()
+        self.addCleanup(pool.close)
+        with FakeUpstream() as upstream:
+            results = {}
+
+            def worker(i):
+                data = pool.query_tcp(DNSRecord.question(f"h{i}.test").pack(), upstream.address, 2)
+                results[i] = DNSRecord.parse(data)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for i, reply in results.items():
+                self.assertEqual(str(reply.q.qname), f"h{i}.test.")
+            self.assertEqual(len(results), 10)
+            self.assertEqual(upstream.tcp_connections, 1)
+
+            # L'upstream chiude la connessione: la query successiva riconnette
+            upstream.drop_tcp()
+            data = pool.query_tcp(DNSRecord.question("again.test").pack(), upstream.address, 2)
+            self.assertIsNotNone(data)
+            self.assertEqual(upstream.tcp_connections, 2)
+
+    def test_tcp_connect_bounded_by_query_timeout(self):
+        pool = UpstreamPool()
+        self.addCleanup(pool.close)
+        attempts = []
+
+        def slow_connect(address, timeout):
+            attempts.append(timeout)
+            time.sleep(timeout)
+            raise socket.timeout("timed out")
+
+        packet = DNSRecord.question("slow.test").pack()
+        with mock.patch("dns.upstream.socket.create_connection", slow_connect), \
+                mock.patch("builtins.print"):
+            start = time.monotonic()
+            data = pool.query_tcp(packet, ("127.0.0.1", 9), 0.3)
+            elapsed = time.monotonic() - start
+
+        self.assertIsNone(data)
+        # Un solo tentativo, entro il timeout della query e non TCP_CONNECT_TIMEOUT
+        self.assertEqual(len(attempts), 1)
+        self.assertLessEqual(attempts[0], 0.3)
+        self.assertLess(elapsed, 0.6)
+
+    def _check_truncation_and_pipelining(self, engine: str):
+        with FakeUpstream(answers=60) as upstream:
+            resolver = self._make_resolver([upstream])
+            with mock.patch("builtins.print"):
+                server = dns_server.start_dns_server("127.0.0.1", 0, engine=engine, resolver=resolver)
+            self.addCleanup(server.stop)
+
+            # UDP senza EDNS: risposta troncata, il client deve passare a TCP
+            data = DNSRecord.question("big.test").send("127.0.0.1", server.port, timeout=2)
+            reply = DNSRecord.parse(data)
+            self.assertTrue(reply.header.tc)
+            self.assertEqual(reply.rr, [])
+
+            # TCP: più query in pipeline sulla stessa connessione
+            requests = {}
+            with socket.create_connection(("127.0.0.1", server.port), timeout=2) as sock:
+                for i in range(3):
+                    request = DNSRecord.question(f"pipe{i}.test")
+                    requests[request.header.id] = request
+                    packet = request.pack()
+                    sock.sendall(struct.pack("!H", len(packet)) + packet)
+                for _ in range(3):
+                    length = struct.unpack("!H", dns_upstream.recv_exact(sock, 2))[0]
+                    reply = DNSRecord.parse(dns_upstream.recv_exact(sock, length))
+                    request = requests.pop(reply.header.id)
+                    self.assertEqual(reply.q.qname, request.q.qname)
+                    self.assertEqual(len(reply.rr), 60)
+            self.assertEqual(requests, {})
+
+    def test_threaded_engine_truncates_udp_and_pipelines_tcp(self):
+        self._check_truncation_and_pipelining("threaded")
+
+    def test_asyncio_engine_truncates_udp_and_pipelines_tcp(self):
+        self._check_truncation_and_pipelining("asyncio")
+
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "SO_REUSEPORT non disponibile")
+class TestWorkerProcesses(unittest.TestCase):
+    def _ask(self, port: int, name: str) -> str:
+        data = DNSRecord.question(name).send("127.0.0.1", port, timeout=2)
+        return str(DNSRecord.parse(data).rr[0].rdata)
+
+    def _wait_for(self, condition, timeout: float = 10.0):
+        end = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > end:
+                self.fail("condizione non raggiunta in tempo")
+            time.sleep(0.1)
+
+    def test_workers_share_port_and_index_and_are_restarted(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name)
+        source = root / "domains.json"
+        source.write_text(json.dumps({"blocked_domains": ["blocked.com"]}))
+
+        # Nessun file del repository: liste importate, indice e log nella cartella temporanea
+        with FakeUpstream() as upstream, mock.patch.object(dns_server, "CONFIG_PATH", source), \
+                mock.patch.object(dns_server, "IMPORTED_LISTS_DIR", root / "lists"), \
+                mock.patch.object(dns_server, "BLOCKLIST_INDEX_PATH", root / "domains.idx"), \
+                mock.patch.object(dns_server, "QUERY_LOG_PATH", root / "logs" / "queries.jsonl"), \
+                mock.patch("builtins.print"):
+            resolver = mock.Mock(upstream_dns_list=[upstream.address])
+            server = dns_server.start_dns_server("127.0.0.1", 0, resolver=resolver, workers=2)
+            self.addCleanup(server.stop)
+
+            self.assertEqual(server.stats()["alive"], 2)
+            self.assertEqual(self._ask(server.port, "www.blocked.com"), "0.0.0.0")
+            self.assertEqual(self._ask(server.port, "allowed.com"), "10.0.0.1")
+            self._wait_for(lambda: any((root / "logs").glob("queries-*.jsonl")))
+
+            # Worker terminato: il supervisore lo riavvia sulla stessa porta
+            victim = server.stats()["pids"][0]
+            os.kill(victim, signal.SIGKILL)
+            self._wait_for(lambda: server.stats()["restarts"] == 1 and server.stats()["alive"] == 2)
+            self.assertNotIn(victim, server.stats()["pids"])
+
+            # Lista modificata: indice riscritto e ricaricato da tutti i worker
+            source.write_text(json.dumps({"blocked_domains": ["blocked.com", "later.com"]}))
+            self._wait_for(lambda: all(
+                self._ask(server.port, f"x{i}.later.com") == "0.0.0.0" for i in range(8)
+            ))
+
+
+if __name__ == "__main__":
+    unittest.main()